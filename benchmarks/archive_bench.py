@@ -0,0 +1,178 @@
+"""
+Benchmark da camada de arquivo (core/archive.py), sem rede.
+
+Gera um histórico sintético em um diretório temporário (perguntas curtas e respostas longas em
+markdown, como as do modelo), marca a maior parte das sessões como inativas e mede:
+- tamanho do banco e latência das leituras comuns antes e depois de arquivar + incremental_vacuum;
+- vazão do arquivamento e taxa de compressão de cada codec disponível (zlib e, se instalado, zstd);
+- latência de abrir uma sessão arquivada (descompressão) e de restaurá-la ao gravar uma mensagem;
+- que as mensagens lidas do arquivo são idênticas às originais.
+
+Uso: python benchmarks/archive_bench.py [--messages 200000] [--session-size 40] [--idle 0.8]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+WORDS = ("mercado preço taxa juros inflação governo empresa resultado trimestre análise projeto código "
+         "função servidor banco consulta exemplo tabela campo valor usuário sistema memória processo "
+         "arquivo dados modelo resposta pergunta notícia semana ano mês dia hoje").split()
+TEMPLATES = [
+    "## {a}\n\n{s}\n\n- **{b}**: {s}\n- **{c}**: {s}\n\n```python\ndef {a}({b}):\n    return {b} * 2\n```\n\n{s}",
+    "### Resumo\n\n{s} {s}\n\n| {a} | {b} |\n|---|---|\n| {c} | {s} |\n\n> {s}",
+    "{s}\n\n1. {s}\n2. {s}\n3. {s}\n\n**Conclusão:** {s}",
+]
+
+def sentence(rng: random.Random) -> str:
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 20))).capitalize() + "."
+
+def reply(rng: random.Random) -> str:
+    parts = [rng.choice(TEMPLATES).format(a=rng.choice(WORDS), b=rng.choice(WORDS), c=rng.choice(WORDS),
+                                          s=sentence(rng)) for _ in range(rng.randint(1, 4))]
+    return "\n\n".join(parts)
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+def populate(path: str, messages: int, session_size: int, idle: float, rng: random.Random) -> int:
+    """Histórico sintético; retorna o número de sessões. As primeiras `idle` (fração) ficam inativas."""
+    from core import models
+    models.ensure_db_ready()
+
+    sessions = (messages + session_size - 1) // session_size
+    idle_sessions = int(sessions * idle)
+    now = datetime.utcnow()
+    conn = sqlite3.connect(path)
+
+    def session_start(session_id: int) -> datetime:
+        # Inativas: há mais de um ano; ativas: na última semana
+        if session_id <= idle_sessions:
+            return now - timedelta(days=400) + timedelta(minutes=session_id)
+        return now - timedelta(days=7) + timedelta(minutes=session_id - idle_sessions)
+
+    conn.executemany(
+        "INSERT INTO chat_sessions (id, start_time, title, message_count, last_activity, preview) VALUES (?, ?, ?, ?, ?, ?)",
+        ((i, session_start(i), "Pergunta", min(session_size, messages - (i - 1) * session_size),
+          session_start(i) + timedelta(seconds=session_size), "Resposta") for i in range(1, sessions + 1)))
+
+    def rows():
+        for i in range(messages):
+            session_id = i // session_size + 1
+            is_user = i % 2 == 0
+            text = sentence(rng) + "?" if is_user else reply(rng)
+            yield (i + 1, session_id, "user" if is_user else "dk_chat", text,
+                   session_start(session_id) + timedelta(seconds=i % session_size))
+
+    conn.executemany("INSERT INTO chat_messages (id, session_id, sender, text, timestamp) VALUES (?, ?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+    return sessions
+
+def compression_ratios(sample_session_ids: list[int]) -> None:
+    """Taxa e velocidade de compressão de cada codec, sobre as mesmas sessões (antes de arquivar)."""
+    from sqlalchemy import select
+    from core.archive import compress, decompress, encode_messages, zstandard
+    from core.models import ChatMessage, engine
+
+    with engine.connect() as conn:
+        raws = [encode_messages(conn.execute(
+            select(ChatMessage.id, ChatMessage.sender, ChatMessage.text, ChatMessage.timestamp)
+            .where(ChatMessage.session_id == session_id).order_by(ChatMessage.timestamp, ChatMessage.id)).all())
+            for session_id in sample_session_ids]
+    raw_bytes = sum(len(raw) for raw in raws)
+    for codec in ["zlib"] + (["zstd"] if zstandard is not None else []):
+        started = time.perf_counter()
+        blobs = [compress(raw, codec) for raw in raws]
+        compress_s = time.perf_counter() - started
+        started = time.perf_counter()
+        for blob in blobs:
+            decompress(blob, codec)
+        decompress_s = time.perf_counter() - started
+        stored = sum(len(blob) for blob in blobs)
+        print(f"  {codec:>4}: {raw_bytes / stored:.1f}x  compressão {raw_bytes / compress_s / 1e6:.0f} MB/s  "
+              f"descompressão {raw_bytes / decompress_s / 1e6:.0f} MB/s")
+    if zstandard is None:
+        print("  zstd: pacote 'zstandard' não instalado")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=200_000)
+    parser.add_argument("--session-size", type=int, default=40)
+    parser.add_argument("--idle", type=float, default=0.8, help="Fração das sessões inativas")
+    parser.add_argument("--opens", type=int, default=200, help="Aberturas de sessões arquivadas medidas")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dk_chat_archive_bench_")
+    path = os.path.join(workdir, "dk_chat_history.db")
+    os.environ["DK_CHAT_DATABASE_URL"] = f"sqlite:///{path}"
+    try:
+        import manage
+        from core import archive
+        from core.db_manager import get_db, get_message_rows_for_session, get_messages_page, save_message
+
+        rng = random.Random(5)
+        started = time.perf_counter()
+        sessions = populate(path, args.messages, args.session_size, args.idle, rng)
+        print(f"Histórico sintético: {args.messages:,} mensagens em {sessions:,} sessões em {time.perf_counter() - started:.1f}s")
+        with archive.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")  # Tamanho "antes" sem o WAL da carga
+
+        idle_sessions = int(sessions * args.idle)
+        samples = rng.sample(range(1, idle_sessions + 1), min(args.opens, idle_sessions))
+        print("\nCompressão por codec (amostra de sessões inativas):")
+        compression_ratios(samples[:100])
+
+        with get_db() as db:
+            originals = {session_id: [tuple(row) for row in get_message_rows_for_session(db, session_id)]
+                         for session_id in samples[:20]}
+
+        before = archive.storage_report()
+        manage._print_report("Antes", before)
+        archived = archive.archive_idle_sessions(archive.ARCHIVE_AFTER_DAYS)
+        print(f"\nArquivamento: {archived['sessions']:,} sessões ({archived['messages']:,} mensagens) em "
+              f"{archived['seconds']:.1f}s ({archived['messages'] / max(archived['seconds'], 1e-9):,.0f} msg/s); "
+              f"{archived['raw_bytes'] / 1e6:.1f} MB -> {archived['stored_bytes'] / 1e6:.1f} MB ({archive.ARCHIVE_CODEC})")
+        started = time.perf_counter()
+        vacuum = archive.incremental_vacuum()
+        print(f"incremental_vacuum: {vacuum['free_pages_before']:,} -> {vacuum['free_pages_after']:,} páginas livres "
+              f"em {vacuum['steps']} passo(s), {time.perf_counter() - started:.1f}s")
+        with archive.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        manage._print_report("Depois", archive.storage_report(), before)
+
+        with get_db() as db:
+            for session_id, rows in originals.items():
+                assert [tuple(row) for row in get_message_rows_for_session(db, session_id)] == rows, session_id
+        print(f"\nConferência: {len(originals)} sessões lidas do arquivo idênticas às originais")
+
+        latencies = []
+        for session_id in samples:
+            archive._invalidate(session_id)  # Mede a descompressão, não o cache
+            started = time.perf_counter()
+            with get_db() as db:
+                get_messages_page(db, session_id)
+            latencies.append((time.perf_counter() - started) * 1000)
+        print(f"Abrir sessão arquivada: p50 {percentile(latencies, 50):.2f} ms  p95 {percentile(latencies, 95):.2f} ms")
+
+        latencies = []
+        for session_id in samples[:50]:
+            started = time.perf_counter()
+            with get_db() as db:
+                save_message(db, session_id, "user", "E sobre aquele assunto?")
+            latencies.append((time.perf_counter() - started) * 1000)
+        print(f"Gravar em sessão arquivada (restaura): p50 {percentile(latencies, 50):.2f} ms  "
+              f"p95 {percentile(latencies, 95):.2f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
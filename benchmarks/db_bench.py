@@ -0,0 +1,122 @@
+"""
+Benchmark das consultas do histórico no SQLite.
+
+Para cada tamanho de banco (padrão: 10k, 100k e 1M mensagens) gera um banco sintético em
+um diretório temporário e mede, com e sem o índice composto (session_id, timestamp):
+- `get_messages_for_session` (filtro por sessão + ordenação por horário);
+- `clear_chat_history_for_session`;
+- `save_message` (insert + commit com o perfil de pragmas de core.models).
+
+Uso: python benchmarks/db_bench.py [--sizes 10000 100000 1000000] [--per-session 50] [--queries 200]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+def populate(path: str, total_messages: int, per_session: int):
+    """Cria o esquema via core.models e insere os dados diretamente com sqlite3 (mais rápido)."""
+    from core import models
+    models.create_db_and_tables()
+
+    conn = sqlite3.connect(path)
+    num_sessions = max(1, total_messages // per_session)
+    start = datetime(2024, 1, 1)
+    conn.executemany(
+        "INSERT INTO chat_sessions (id, start_time) VALUES (?, ?)",
+        ((i + 1, start + timedelta(minutes=i)) for i in range(num_sessions)),
+    )
+
+    def rows():
+        # Sessões intercaladas no tempo, como em um banco real com vários usuários
+        for n in range(total_messages):
+            session_id = (n % num_sessions) + 1
+            sender = "user" if (n // num_sessions) % 2 == 0 else "dk_chat"
+            yield (session_id, sender, f"mensagem sintética {n} " + "x" * random.randint(20, 400),
+                   start + timedelta(seconds=n))
+
+    conn.executemany("INSERT INTO chat_messages (session_id, sender, text, timestamp) VALUES (?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+    return num_sessions
+
+def measure(fn, repeat: int) -> tuple[float, float]:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+def run_size(total_messages: int, per_session: int, queries: int):
+    tmpdir = tempfile.mkdtemp(prefix="dk_chat_bench_")
+    path = os.path.join(tmpdir, "bench.db")
+    os.environ["DK_CHAT_DATABASE_URL"] = f"sqlite:///{path}"
+    for name in [m for m in sys.modules if m == "core" or m.startswith("core.")]:
+        del sys.modules[name]  # Recarrega core.models com a nova URL
+
+    t0 = time.perf_counter()
+    num_sessions = populate(path, total_messages, per_session)
+    print(f"\n{total_messages:,} mensagens em {num_sessions:,} sessões (gerado em {time.perf_counter() - t0:.1f}s)")
+
+    from core.db_manager import get_db, get_messages_for_session, clear_chat_history_for_session, save_message
+    from core.models import engine
+    from sqlalchemy import text
+
+    def query_random_session():
+        with get_db() as db:
+            get_messages_for_session(db, random.randint(1, num_sessions))
+
+    next_session = iter(range(1, num_sessions + 1))
+
+    def clear_next_session():
+        with get_db() as db:
+            clear_chat_history_for_session(db, next(next_session))
+
+    def save_one():
+        with get_db() as db:
+            save_message(db, 1, "user", "nova mensagem do benchmark")
+
+    results = {}
+    for label, create_index in (("sem índice", False), ("com índice", True)):
+        with engine.begin() as conn:
+            if create_index:
+                conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_messages_session_timestamp ON chat_messages (session_id, timestamp)"))
+            else:
+                conn.execute(text("DROP INDEX IF EXISTS ix_chat_messages_session_timestamp"))
+        # Consultas sem índice são varreduras completas; limitamos as repetições nos bancos grandes
+        repeat = queries if create_index else max(3, min(queries, 2_000_000 // total_messages))
+        results[label] = {
+            "get_messages_for_session": measure(query_random_session, repeat),
+            "clear_chat_history_for_session": measure(clear_next_session, max(3, repeat // 4)),
+        }
+    results["com índice"]["save_message"] = measure(save_one, queries)
+
+    print(f"{'operação':<34} {'variante':<12} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+    for label, ops in results.items():
+        for op, (p50, p95) in ops.items():
+            print(f"{op:<34} {label:<12} {p50:>10.3f} {p95:>10.3f}")
+    engine.dispose()
+    shutil.rmtree(tmpdir, ignore_errors=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--per-session", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    for size in args.sizes:
+        run_size(size, args.per_session, args.queries)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,356 @@
+"""
+Benchmark de ponta a ponta do DK Chat, sem rede nem chaves de API.
+
+Sobe o servidor falso de benchmarks/fake_llm_server.py (DeepSeek compatível com a OpenAI e a API
+REST do Gemini, usada pelo SDK de verdade), gera um dk_chat_history.db sintético em um diretório
+temporário e mede:
+- latência dos turnos (p50/p95/p99 do total e do primeiro trecho, por rota), com conversas de
+  vários turnos roteiradas executadas em paralelo pelo TurnPipeline, como no app;
+- operações por segundo das funções do db_manager;
+- tempo de carregamento do histórico (ConversationState.load e primeira página) por tamanho de conversa;
+- memória por sessão carregada (tracemalloc), por tamanho de conversa.
+
+O resultado pode ser gravado com --json (inclui o commit) e comparado entre commits com --compare.
+
+Uso: python benchmarks/e2e_bench.py [--sessions 500] [--history 40] [--conversations 32] [--turns 8]
+       [--concurrency 8] [--news-ratio 0.25] [--lengths 10 100 1000] [--json saida.json]
+       [--compare base.json] [opções do servidor falso: --latency-ms 200 --error-rate 0.02 ...]
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(__file__))
+
+from fake_llm_server import FakeLLMServer, add_config_arguments, config_from_args
+
+GENERAL_PROMPTS = [
+    "Me explique como funciona uma lista em Python.",
+    "Qual a diferença entre juros simples e compostos?",
+    "Sugira um roteiro de viagem de três dias para o Rio de Janeiro.",
+    "Como posso melhorar meu sono?",
+    "Escreva um poema curto sobre o mar.",
+    "Resuma a história da internet em poucas linhas.",
+    "Quais são boas práticas para escrever testes?",
+    "Me dá uma receita de bolo de cenoura.",
+]
+NEWS_PROMPTS = [
+    "Quais as últimas notícias de hoje?",
+    "Quem ganhou o jogo do Flamengo ontem?",
+    "Qual a cotação do dólar agora?",
+    "Como está a previsão do tempo para amanhã em São Paulo?",
+    "O que aconteceu na bolsa de valores hoje?",
+]
+
+def percentile(samples: list[float], p: float) -> float:
+    """Percentil por posição mais próxima (nearest rank)."""
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+def summarize(samples_ms: list[float]) -> dict:
+    return {
+        "n": len(samples_ms),
+        "p50": percentile(samples_ms, 50),
+        "p95": percentile(samples_ms, 95),
+        "p99": percentile(samples_ms, 99),
+        "mean": statistics.fmean(samples_ms) if samples_ms else float("nan"),
+    }
+
+def git_revision() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+        dirty = bool(subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                                    capture_output=True, text=True).stdout.strip())
+        return {"commit": commit, "dirty": dirty}
+    except OSError:
+        return {"commit": None, "dirty": None}
+
+def populate(path: str, sessions: int, history: int, lengths: list[int]) -> dict[int, int]:
+    """Sessões sintéticas (`sessions` x `history` mensagens) + uma sessão de cada tamanho em `lengths`."""
+    from core import models
+    models.Base.metadata.create_all(bind=models.engine)
+
+    rng = random.Random(42)
+    start = datetime(2024, 1, 1)
+    sizes = [history] * sessions + list(lengths)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO chat_sessions (id, start_time) VALUES (?, ?)",
+        ((i + 1, start + timedelta(minutes=i)) for i in range(len(sizes))),
+    )
+
+    def rows():
+        clock = start
+        for session_index, size in enumerate(sizes):
+            for n in range(size):
+                clock += timedelta(seconds=1)
+                prompt = rng.choice(GENERAL_PROMPTS + NEWS_PROMPTS)
+                text = prompt if n % 2 == 0 else f"Resposta sintética {n}: " + " ".join(rng.choices(prompt.split(), k=rng.randint(10, 80)))
+                yield session_index + 1, "user" if n % 2 == 0 else "dk_chat", text, clock
+
+    conn.executemany("INSERT INTO chat_messages (session_id, sender, text, timestamp) VALUES (?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+    models.ensure_db_ready()  # Migrações: índices, busca textual e estatísticas das sessões
+    models.rebuild_search_index()
+    # Sessão de cada tamanho medido -> id
+    return {length: sessions + i + 1 for i, length in enumerate(lengths)}
+
+
+def bench_db_ops(num_sessions: int, ops: int) -> dict:
+    from core.db_manager import (
+        get_db, save_message, get_messages_page, get_sessions_page, search_messages, get_message_rows_for_session,
+    )
+    rng = random.Random(3)
+
+    def run(fn) -> float:
+        started = time.perf_counter()
+        for _ in range(ops):
+            with get_db() as db:
+                fn(db)
+        return ops / (time.perf_counter() - started)
+
+    return {
+        "save_message": run(lambda db: save_message(db, rng.randint(1, num_sessions), "user", "mensagem de benchmark " * 4)),
+        "get_messages_page": run(lambda db: get_messages_page(db, rng.randint(1, num_sessions), limit=30)),
+        "get_message_rows_for_session": run(lambda db: get_message_rows_for_session(db, rng.randint(1, num_sessions))),
+        "get_sessions_page": run(lambda db: get_sessions_page(db, limit=30)),
+        "search_messages": run(lambda db: search_messages(db, rng.choice(["python", "dólar", "receita bolo", "viagem"]), limit=20)),
+    }
+
+def bench_history(length_sessions: dict[int, int], repeat: int) -> dict:
+    from core.conversation import ConversationState
+    from core.db_manager import get_db, get_messages_page
+
+    results = {}
+    for length, session_id in length_sessions.items():
+        load_ms, page_ms = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            ConversationState(session_id).load()
+            load_ms.append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            with get_db() as db:
+                get_messages_page(db, session_id, limit=30)
+            page_ms.append((time.perf_counter() - started) * 1000)
+        results[str(length)] = {"load_p50_ms": statistics.median(load_ms), "first_page_p50_ms": statistics.median(page_ms)}
+    return results
+
+def bench_memory(length_sessions: dict[int, int], copies: int) -> dict:
+    """Memória retida por uma sessão carregada (ConversationState), média de `copies` cópias."""
+    from core.conversation import ConversationState
+
+    results = {}
+    for length, session_id in length_sessions.items():
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        states = []
+        for _ in range(copies):
+            state = ConversationState(session_id)
+            state.load()
+            states.append(state)
+        after = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        results[str(length)] = {"kb_per_session": (after - before) / copies / 1024}
+        del states
+    return results
+
+def bench_turns(conversations: int, turns: int, concurrency: int, news_ratio: float) -> dict:
+    from core.chat_logic import get_chat_logic
+    from core.conversation import get_conversation_state
+    from core.db_manager import get_db, create_chat_session
+    from core.turn_pipeline import TurnPipeline
+    from core.write_behind import persist_message
+
+    chat_logic = get_chat_logic()
+    pipeline = TurnPipeline(max_workers=concurrency, source="bench")
+
+    def turn_job(turn):
+        # Mesmo fluxo de ChatScreen._run_turn / servidor: grava a pergunta, transmite a resposta, grava a resposta
+        persist_message(turn.session_id, "user", turn.user_message).result()
+        conversation = get_conversation_state(turn.session_id)
+        text = "".join(chat_logic.get_response(turn.user_message, stream=True, conversation=conversation))
+        persist_message(turn.session_id, "dk_chat", text or "Recebi uma resposta vazia.").result()
+        return text
+
+    samples: dict[str, list[tuple[float, float | None]]] = {}
+    samples_lock = threading.Lock()
+    failures = []
+
+    def drive(conversation_index: int):
+        rng = random.Random(conversation_index)
+        with get_db() as db:
+            session_id = create_chat_session(db).id
+        for _ in range(turns):
+            prompt = rng.choice(NEWS_PROMPTS) if rng.random() < news_ratio else rng.choice(GENERAL_PROMPTS)
+            started = time.perf_counter()
+            turn = pipeline.submit(session_id, prompt, turn_job)
+            try:
+                turn.future.result()
+            except Exception as e:
+                failures.append(repr(e))
+                continue
+            total_ms = (time.perf_counter() - started) * 1000
+            first_ms = turn.trace.first_chunk * 1000 if turn.trace.first_chunk is not None else None
+            route = turn.trace.route.split(":")[0] + (":cache" if turn.trace.route.endswith(":cache") else "")
+            with samples_lock:
+                samples.setdefault(route, []).append((total_ms, first_ms))
+
+    started = time.perf_counter()
+    # `concurrency` conversas ao mesmo tempo; cada uma envia seus turnos em sequência
+    with ThreadPoolExecutor(max_workers=concurrency) as drivers:
+        list(drivers.map(drive, range(conversations)))
+    elapsed = time.perf_counter() - started
+    pipeline.shutdown(wait=True)
+
+    all_samples = [s for route_samples in samples.values() for s in route_samples]
+    result = {
+        "turns_per_sec": len(all_samples) / elapsed,
+        "failures": len(failures),
+        "total_ms": summarize([s[0] for s in all_samples]),
+        "first_chunk_ms": summarize([s[1] for s in all_samples if s[1] is not None]),
+        "by_route": {
+            route: {"total_ms": summarize([s[0] for s in route_samples]),
+                    "first_chunk_ms": summarize([s[1] for s in route_samples if s[1] is not None])}
+            for route, route_samples in sorted(samples.items())
+        },
+    }
+    return result
+
+
+def print_report(report: dict):
+    params, results = report["params"], report["results"]
+    print(f"\nCommit {report['revision']['commit']}{' (com alterações)' if report['revision']['dirty'] else ''}; "
+          f"servidor falso: latência {params['latency_ms']:.0f} ms, {params['chunks']} trechos a cada "
+          f"{params['chunk_delay_ms']:.0f} ms, erros {params['error_rate']:.0%} / {params['stream_error_rate']:.0%} no stream")
+
+    turns = results["turns"]
+    print(f"\nTurnos: {turns['total_ms']['n']} em {params['conversations']} conversas x {params['turns']} "
+          f"({params['concurrency']} simultâneas), {turns['turns_per_sec']:.1f} turnos/s, {turns['failures']} falhas")
+    print(f"{'rota':<18} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'1º trecho p50':>14} {'p95':>9}")
+    rows = [("todas", turns)] + list(turns["by_route"].items())
+    for route, data in rows:
+        total, first = data["total_ms"], data["first_chunk_ms"]
+        print(f"{route:<18} {total['n']:>5} {total['p50']:>9.1f} {total['p95']:>9.1f} {total['p99']:>9.1f} "
+              f"{first['p50']:>14.1f} {first['p95']:>9.1f}")
+
+    print(f"\n{'operação do banco':<30} {'ops/s':>10}")
+    for op, rate in results["db_ops_per_sec"].items():
+        print(f"{op:<30} {rate:>10.0f}")
+
+    print(f"\n{'mensagens na sessão':<20} {'load p50 ms':>12} {'1ª página ms':>13} {'KB/sessão':>10}")
+    for length, data in results["history"].items():
+        memory = results["memory"][length]["kb_per_session"]
+        print(f"{length:<20} {data['load_p50_ms']:>12.2f} {data['first_page_p50_ms']:>13.2f} {memory:>10.1f}")
+    print(f"\nChamadas ao servidor falso: {results['upstream']}")
+
+def _flatten(prefix: str, value, out: dict):
+    if isinstance(value, dict):
+        for key, item in value.items():
+            _flatten(f"{prefix}.{key}" if prefix else key, item, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+
+def print_comparison(base: dict, current: dict):
+    base_values, current_values = {}, {}
+    _flatten("", base["results"], base_values)
+    _flatten("", current["results"], current_values)
+    print(f"\nComparação: {base['revision']['commit']} -> {current['revision']['commit']}")
+    changed = {key for key in base["params"].keys() | current["params"].keys()
+               if base["params"].get(key) != current["params"].get(key)}
+    if changed:
+        print(f"AVISO: parâmetros diferentes entre as execuções: {', '.join(sorted(changed))}")
+    print(f"{'métrica':<60} {'base':>10} {'atual':>10} {'variação':>9}")
+    for key in sorted(base_values.keys() & current_values.keys()):
+        old, new = base_values[key], current_values[key]
+        change = f"{(new - old) / old:+.1%}" if old else "-"
+        print(f"{key:<60} {old:>10.2f} {new:>10.2f} {change:>9}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=500, help="sessões sintéticas pré-existentes")
+    parser.add_argument("--history", type=int, default=40, help="mensagens por sessão sintética")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[10, 100, 1000], help="tamanhos de conversa medidos")
+    parser.add_argument("--conversations", type=int, default=32)
+    parser.add_argument("--turns", type=int, default=8)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--news-ratio", type=float, default=0.25)
+    parser.add_argument("--db-ops", type=int, default=300)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="grava o resultado neste arquivo")
+    parser.add_argument("--compare", help="resultado (--json) de outro commit para comparar")
+    add_config_arguments(parser)
+    args = parser.parse_args()
+
+    server = FakeLLMServer(config_from_args(args))
+    base_url = server.start()
+    tmpdir = tempfile.mkdtemp(prefix="dk_chat_e2e_")
+    path = os.path.join(tmpdir, "dk_chat_history.db")
+    # Configuração lida na importação dos módulos do app: precisa vir antes de importar `core`
+    os.environ.update({
+        "DK_CHAT_DATABASE_URL": f"sqlite:///{path}",
+        "GEMINI_API_KEY": "chave-falsa",
+        "GEMINI_API_ENDPOINT": base_url,
+        "DEEPSEEK_API_KEY": "chave-falsa",
+        "DEEPSEEK_API_URL": f"{base_url}/v1/chat/completions",
+        "DK_CHAT_TRACE_FILE": "",
+        "DK_CHAT_METRICS_PORT": "0",
+    })
+    try:
+        t0 = time.perf_counter()
+        length_sessions = populate(path, args.sessions, args.history, args.lengths)
+        print(f"Banco sintético: {args.sessions} sessões x {args.history} mensagens + conversas de "
+              f"{args.lengths} mensagens (gerado em {time.perf_counter() - t0:.1f}s)")
+
+        from core.warmup import warm_up
+        warm_up()  # SDK do Gemini e conexões fora das medições
+
+        results = {
+            "db_ops_per_sec": bench_db_ops(args.sessions, args.db_ops),
+            "history": bench_history(length_sessions, args.repeat),
+            "memory": bench_memory(length_sessions, max(1, args.repeat // 4)),
+        }
+        results["turns"] = bench_turns(args.conversations, args.turns, args.concurrency, args.news_ratio)
+        results["upstream"] = dict(server.stats)
+
+        report = {
+            "revision": git_revision(),
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "params": {key: value for key, value in vars(args).items() if key not in ("json", "compare")},
+            "results": results,
+        }
+        print_report(report)
+        if args.json:
+            with open(args.json, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+            print(f"\nResultado gravado em {args.json}")
+        if args.compare:
+            with open(args.compare, encoding="utf-8") as f:
+                print_comparison(json.load(f), report)
+
+        from core import models
+        from core.write_behind import shutdown_message_writer
+        shutdown_message_writer()
+        models.engine.dispose()
+    finally:
+        server.stop()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+"""
+Servidor local que imita as APIs usadas pelo DK Chat, para benchmarks sem rede nem chaves:
+- DeepSeek (compatível com a OpenAI): POST /v1/chat/completions, com ou sem "stream": true (SSE);
+- Gemini (API REST usada pelo google.generativeai com transport="rest"):
+  POST /v1beta/models/{modelo}:generateContent e :streamGenerateContent (array JSON transmitido aos poucos).
+
+Latência até o primeiro byte, atraso entre trechos, tamanho da resposta e injeção de erros
+(status HTTP de erro ou conexão interrompida no meio do stream) são configuráveis.
+
+Uso:
+  python benchmarks/fake_llm_server.py --port 8090 --latency-ms 300 --chunk-delay-ms 30 --error-rate 0.05
+  DEEPSEEK_API_KEY=x DEEPSEEK_API_URL=http://127.0.0.1:8090/v1/chat/completions \\
+  GEMINI_API_KEY=x GEMINI_API_ENDPOINT=http://127.0.0.1:8090 python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+from dataclasses import dataclass, asdict
+
+from aiohttp import web
+
+WORDS = (
+    "segundo as informações disponíveis o resultado indica que a situação continua estável "
+    "e os especialistas recomendam acompanhar as próximas atualizações com atenção porque "
+    "novos dados devem ser divulgados ainda hoje pela manhã ou no fim da tarde"
+).split()
+
+
+@dataclass
+class FakeLLMConfig:
+    latency_ms: float = 200       # Até o primeiro byte (cabeçalhos + primeiro trecho)
+    jitter_ms: float = 50         # Variação uniforme somada à latência
+    chunk_delay_ms: float = 20    # Entre trechos do stream
+    chunks: int = 12              # Trechos por resposta
+    words_per_chunk: int = 4
+    error_rate: float = 0.0       # Fração das requisições respondidas com `error_status`
+    error_status: int = 503
+    stream_error_rate: float = 0.0  # Fração dos streams interrompidos na metade
+    seed: int = 1
+
+
+class FakeLLMServer:
+    """Sobe o servidor falso em uma thread própria (com seu loop de eventos); `start()` retorna a URL base."""
+
+    def __init__(self, config: FakeLLMConfig | None = None, host: str = "127.0.0.1", port: int = 0):
+        self.config = config or FakeLLMConfig()
+        self.host = host
+        self.port = port
+        self.rng = random.Random(self.config.seed)
+        self.stats = {"deepseek": 0, "gemini": 0, "errors": 0, "stream_errors": 0, "client_closed": 0}
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._runner: web.AppRunner | None = None
+        self._thread: threading.Thread | None = None
+
+    # --- Respostas ---
+
+    def _answer_chunks(self, prompt: str) -> list[str]:
+        cfg = self.config
+        words = [f"(resposta simulada para: {prompt[:40]})"] + [
+            self.rng.choice(WORDS) for _ in range(cfg.chunks * cfg.words_per_chunk)
+        ]
+        return [" ".join(words[i:i + cfg.words_per_chunk]) + " " for i in range(0, len(words), cfg.words_per_chunk)]
+
+    async def _delay_first_byte(self):
+        cfg = self.config
+        await asyncio.sleep(max(0.0, cfg.latency_ms + self.rng.uniform(0, cfg.jitter_ms)) / 1000)
+
+    def _should_fail(self) -> bool:
+        if self.config.error_rate and self.rng.random() < self.config.error_rate:
+            self.stats["errors"] += 1
+            return True
+        return False
+
+    def _should_cut_stream(self) -> bool:
+        if self.config.stream_error_rate and self.rng.random() < self.config.stream_error_rate:
+            self.stats["stream_errors"] += 1
+            return True
+        return False
+
+    async def _stream(self, request: web.Request, content_type: str, pieces, prefix: str = "", suffix: str = ""):
+        response = web.StreamResponse(headers={"Content-Type": content_type})
+        await response.prepare(request)
+        if prefix:
+            await response.write(prefix.encode())
+        cut_at = len(pieces) // 2 if self._should_cut_stream() else None
+        try:
+            for i, piece in enumerate(pieces):
+                if i == cut_at:
+                    # Conexão cai no meio da resposta
+                    request.transport.close()
+                    return response
+                if i:
+                    await asyncio.sleep(self.config.chunk_delay_ms / 1000)
+                await response.write(piece.encode())
+            if suffix:
+                await response.write(suffix.encode())
+            await response.write_eof()
+        except ConnectionResetError:
+            # O cliente fechou a conexão (ex.: perna cancelada de um turno de notícias)
+            self.stats["client_closed"] += 1
+        return response
+
+    async def openai_chat(self, request: web.Request) -> web.StreamResponse:
+        self.stats["deepseek"] += 1
+        body = await request.json()
+        prompt = body["messages"][-1]["content"]
+        await self._delay_first_byte()
+        if self._should_fail():
+            return web.json_response({"error": {"message": "falha simulada"}}, status=self.config.error_status)
+        chunks = self._answer_chunks(prompt)
+        if not body.get("stream"):
+            await asyncio.sleep(self.config.chunk_delay_ms * (len(chunks) - 1) / 1000)
+            return web.json_response({
+                "id": "fake", "object": "chat.completion", "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(chunks)}, "finish_reason": "stop"}],
+            })
+        events = [
+            "data: " + json.dumps({"choices": [{"index": 0, "delta": {"content": chunk}}]}) + "\n\n" for chunk in chunks
+        ]
+        return await self._stream(request, "text/event-stream", events, suffix="data: [DONE]\n\n")
+
+    async def gemini(self, request: web.Request) -> web.StreamResponse:
+        self.stats["gemini"] += 1
+        method = request.match_info["tail"].rsplit(":", 1)[-1]
+        body = await request.json()
+        contents = body.get("contents") or [{"parts": [{"text": ""}]}]
+        prompt = "".join(part.get("text", "") for part in contents[-1].get("parts", []))
+        await self._delay_first_byte()
+        if self._should_fail():
+            return web.json_response(
+                {"error": {"code": self.config.error_status, "message": "falha simulada", "status": "UNAVAILABLE"}},
+                status=self.config.error_status,
+            )
+
+        def candidate(text: str, last: bool) -> dict:
+            item = {"content": {"role": "model", "parts": [{"text": text}]}, "index": 0}
+            if last:
+                item["finishReason"] = "STOP"
+            return {"candidates": [item]}
+
+        chunks = self._answer_chunks(prompt)
+        if method == "generateContent":
+            await asyncio.sleep(self.config.chunk_delay_ms * (len(chunks) - 1) / 1000)
+            return web.json_response(candidate("".join(chunks), True))
+        # streamGenerateContent sem alt=sse: um array JSON cujos elementos chegam aos poucos
+        pieces = [("," if i else "") + json.dumps(candidate(chunk, i == len(chunks) - 1)) + "\n"
+                  for i, chunk in enumerate(chunks)]
+        return await self._stream(request, "application/json", pieces, prefix="[", suffix="]")
+
+    # --- Ciclo de vida ---
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.add_routes([
+            web.post("/v1/chat/completions", self.openai_chat),
+            web.post("/chat/completions", self.openai_chat),
+            web.post("/v1beta/models/{tail:.+}", self.gemini),
+        ])
+        return app
+
+    def start(self) -> str:
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            self._runner = web.AppRunner(self.make_app(), access_log=None)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, self.host, self.port)
+            self._loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+
+        self._thread = threading.Thread(target=run, daemon=True, name="fake-llm-server")
+        self._thread.start()
+        started.wait()
+        return f"http://{self.host}:{self.port}"
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+
+
+def add_config_arguments(parser: argparse.ArgumentParser):
+    defaults = FakeLLMConfig()
+    for field, value in asdict(defaults).items():
+        parser.add_argument(f"--{field.replace('_', '-')}", type=type(value), default=value)
+
+def config_from_args(args: argparse.Namespace) -> FakeLLMConfig:
+    return FakeLLMConfig(**{field: getattr(args, field) for field in asdict(FakeLLMConfig())})
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8090)
+    add_config_arguments(parser)
+    args = parser.parse_args()
+    server = FakeLLMServer(config_from_args(args), host=args.host, port=args.port)
+    web.run_app(server.make_app(), host=args.host, port=args.port)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+Benchmark da memória de longo prazo (core/memory_index.py), sem rede.
+
+Gera um histórico sintético (vocabulário com distribuição de Zipf) em um diretório temporário,
+com alguns fatos plantados em sessões antigas, indexa tudo como a thread de segundo plano faria
+e mede:
+- vazão da indexação (mensagens por segundo), número de segmentos e tamanho do índice em disco;
+- latência da consulta (p50/p95/p99) de `search` e de `retrieve` (que também lê os trechos do banco);
+- recall@k: fração dos fatos plantados cujo trecho volta entre os k primeiros, a partir de uma
+  pergunta de outra sessão.
+
+Uso: python benchmarks/memory_bench.py [--messages 1000000] [--facts 200] [--queries 500] [--top-k 4]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+SYLLABLES = ["ba", "ce", "di", "fo", "gu", "la", "me", "ni", "po", "ru", "sa", "te", "vi", "zo", "tra", "pre", "cli", "mar", "ven", "tos"]
+COMMON = ("de a o que e do da em um para com não uma os no se na por mais as dos como mas ao ele das seu sua ou quando "
+          "muito nos já eu também só pelo pela até isso ela entre depois sem mesmo aos seus quem nas me esse eles você").split()
+
+def vocabulary(size: int, rng: random.Random) -> list[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return COMMON + sorted(words)
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+def populate(path: str, words: list[str], messages: int, facts: int, session_size: int,
+             rng: random.Random) -> list[tuple[int, str]]:
+    """Histórico sintético; retorna (id da mensagem, pergunta) de cada fato plantado."""
+    import numpy as np
+    from core import models
+    models.Base.metadata.create_all(bind=models.engine)
+
+    np_rng = np.random.default_rng(7)
+    # Índices de palavras com distribuição de Zipf (poucas muito comuns, muitas raras)
+    ranks = np.minimum(np_rng.zipf(1.15, size=messages * 30), len(words)) - 1
+    lengths = np_rng.integers(8, 52, size=messages)
+    offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+    fact_ids = set(rng.sample(range(1, messages // 2), facts))  # Fatos na primeira metade do histórico
+    questions = []
+    sessions = (messages + session_size - 1) // session_size
+    start = datetime(2023, 1, 1)
+    conn = sqlite3.connect(path)
+    conn.executemany("INSERT INTO chat_sessions (id, start_time) VALUES (?, ?)",
+                     ((i + 1, start + timedelta(hours=i)) for i in range(sessions)))
+
+    def rows():
+        for i in range(messages):
+            message_id = i + 1
+            if message_id in fact_ids:
+                codename, database, host = (rng.choice(words[len(COMMON):]) for _ in range(3))
+                text = f"O projeto {codename} usa o banco {database} e roda no servidor {host} desde o ano passado."
+                questions.append((message_id, f"Em qual servidor roda mesmo o projeto {codename}?"))
+            else:
+                text = " ".join(words[rank] for rank in ranks[offsets[i] % len(ranks):offsets[i] % len(ranks) + lengths[i]])
+            yield (message_id, i // session_size + 1, "user" if i % 2 == 0 else "dk_chat", text,
+                   start + timedelta(seconds=i))
+
+    conn.executemany("INSERT INTO chat_messages (id, session_id, sender, text, timestamp) VALUES (?, ?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+    models.ensure_db_ready()
+    return questions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--facts", type=int, default=200)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--session-size", type=int, default=40)
+    parser.add_argument("--top-k", type=int, default=4)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dk_chat_memory_bench_")
+    os.environ["DK_CHAT_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'dk_chat_history.db')}"
+    try:
+        from core.memory_index import MemoryIndex
+
+        rng = random.Random(11)
+        words = vocabulary(30000, rng)
+        started = time.perf_counter()
+        questions = populate(os.path.join(workdir, "dk_chat_history.db"), words, args.messages, args.facts,
+                             args.session_size, rng)
+        print(f"Histórico sintético: {args.messages:,} mensagens em {time.perf_counter() - started:.1f}s")
+
+        index = MemoryIndex(os.path.join(workdir, "memory"), background=False)
+        started = time.perf_counter()
+        indexed = index.index_pending()
+        index_s = time.perf_counter() - started
+        stats = index.stats()
+        index_mb = sum(os.path.getsize(os.path.join(root, name))
+                       for root, _, names in os.walk(index.directory) for name in names) / 1e6
+        print(f"Indexação: {indexed:,} mensagens em {index_s:.1f}s ({indexed / index_s:,.0f} msg/s); "
+              f"{stats['chunks']:,} trechos, {stats['segments']} segmento(s), {index_mb:.1f} MB")
+
+        # Perguntas de outra sessão (id fora do histórico), como em um turno novo
+        found = 0
+        for message_id, question in questions:
+            hits = index.search(question, exclude_session_id=-1, top_k=args.top_k)
+            found += any(hit[1] == message_id for hit in hits)
+        print(f"recall@{args.top_k} dos fatos plantados: {found / len(questions):.1%}")
+
+        probes = [question for _, question in questions]
+        probes += [" ".join(rng.sample(words, rng.randint(3, 12)))
+                   for _ in range(max(0, args.queries - len(probes)))]
+        for name, call in (("search", lambda q: index.search(q, exclude_session_id=-1, top_k=args.top_k)),
+                           ("retrieve", lambda q: index.retrieve(q, exclude_session_id=-1, top_k=args.top_k))):
+            samples = []
+            for probe in probes[:args.queries]:
+                started = time.perf_counter()
+                call(probe)
+                samples.append((time.perf_counter() - started) * 1000)
+            print(f"{name:>8}: p50 {percentile(samples, 50):.2f} ms  p95 {percentile(samples, 95):.2f} ms  "
+                  f"p99 {percentile(samples, 99):.2f} ms")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Micro-benchmark do roteamento DeepSeek x Gemini.
+
+Compara o laço de palavras-chave original de `_should_use_deepseek` com o `IntentRouter`
+compilado, usando o corpus rotulado em `benchmarks/data/router_corpus.jsonl`:
+- vazão (mensagens por segundo);
+- taxa de chamadas desnecessárias à DeepSeek (mensagens "gemini" roteadas para a DeepSeek);
+- taxa de buscas perdidas (mensagens "deepseek" que não foram roteadas).
+
+Uso: python benchmarks/router_bench.py [--repeat N] [--verbose]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from core.router import IntentRouter
+
+CORPUS_PATH = os.path.join(os.path.dirname(__file__), "data", "router_corpus.jsonl")
+
+LEGACY_NEWS_KEYWORDS = [
+    "notícia", "notícias", "hoje", "agora", "recente", "últimas",
+    "o que aconteceu", "qual a novidade", "aconteceu com", "previsão do tempo",
+    "cotação", "dólar", "bolsa de valores", "resultado de jogo", "quem ganhou"
+]
+
+def legacy_should_use_deepseek(user_message: str) -> bool:
+    # Cópia do algoritmo anterior (sem a verificação da chave de API)
+    message_lower = user_message.lower()
+    for keyword in LEGACY_NEWS_KEYWORDS:
+        if keyword in message_lower:
+            return True
+    current_year = str(datetime.now().year)
+    if "?" in user_message and (current_year in message_lower or "ontem" in message_lower or "esta semana" in message_lower):
+        if any(kw in message_lower for kw in ["quando", "quem", "onde", "qual foi"]):
+            return True
+    return False
+
+def load_corpus(path: str = CORPUS_PATH) -> list[dict]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def evaluate(name: str, classify, corpus: list[dict], repeat: int, verbose: bool) -> dict:
+    unnecessary = missed = 0
+    for item in corpus:
+        routed = classify(item["text"])
+        if routed and item["label"] == "gemini":
+            unnecessary += 1
+            if verbose:
+                print(f"  [{name}] DeepSeek desnecessária: {item['text']}")
+        elif not routed and item["label"] == "deepseek":
+            missed += 1
+            if verbose:
+                print(f"  [{name}] Busca perdida: {item['text']}")
+
+    texts = [item["text"] for item in corpus]
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            classify(text)
+    elapsed = time.perf_counter() - start
+
+    gemini_total = sum(1 for item in corpus if item["label"] == "gemini")
+    deepseek_total = len(corpus) - gemini_total
+    return {
+        "name": name,
+        "msgs_per_sec": repeat * len(texts) / elapsed,
+        "unnecessary_rate": unnecessary / gemini_total if gemini_total else 0.0,
+        "missed_rate": missed / deepseek_total if deepseek_total else 0.0,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=2000)
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    corpus = load_corpus()
+    router = IntentRouter()
+    results = [
+        evaluate("legado", legacy_should_use_deepseek, corpus, args.repeat, args.verbose),
+        evaluate("router", lambda text: router.route(text).use_deepseek, corpus, args.repeat, args.verbose),
+    ]
+
+    print(f"Corpus: {len(corpus)} mensagens rotuladas, {args.repeat} repetições")
+    print(f"{'roteador':<10} {'msgs/s':>12} {'DeepSeek desnecessária':>24} {'buscas perdidas':>16}")
+    for r in results:
+        print(f"{r['name']:<10} {r['msgs_per_sec']:>12,.0f} {r['unnecessary_rate']:>24.1%} {r['missed_rate']:>16.1%}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""
+Benchmark da busca textual no histórico (SQLite FTS5).
+
+Gera um banco sintético (padrão: 1M mensagens) com frases em português e mede:
+- tempo do backfill (`python manage.py fts-backfill`, isto é, core.models.rebuild_search_index)
+  e o crescimento do arquivo do banco;
+- latência de `search_messages` (todo o histórico e uma sessão) x `LIKE '%termo%'`;
+- custo extra dos gatilhos do índice em `save_message`.
+
+Uso: python benchmarks/search_bench.py [--messages 1000000] [--per-session 50] [--queries 200]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+WORDS = (
+    "notícia notícias hoje amanhã ontem cotação dólar euro bolsa mercado ação ações juros inflação "
+    "governo eleição presidente ministro congresso lei projeto votação economia emprego salário "
+    "futebol jogo partida campeonato gol time técnico torcida estádio resultado vitória derrota "
+    "previsão tempo chuva sol frio calor temperatura semana fim cidade estado país mundo São Paulo "
+    "Rio Janeiro Brasília Minas Bahia receita bolo café almoço jantar viagem praia montanha hotel "
+    "filme série música livro história ciência saúde médico vacina hospital escola universidade "
+    "tecnologia computador celular aplicativo internet programa código python dados banco rede "
+    "como quando onde porque qual quais quem explicar ajudar entender aprender resumo exemplo "
+    "carro trânsito ônibus metrô avião aeroporto passagem preço compra venda loja produto serviço"
+).split()
+
+def sentence(rng: random.Random, weights: list[float]) -> str:
+    return " ".join(rng.choices(WORDS, weights=weights, k=rng.randint(6, 40)))
+
+def populate(path: str, total_messages: int, per_session: int) -> int:
+    """Cria as tabelas (sem as migrações) e insere as mensagens diretamente com sqlite3."""
+    from core import models
+    models.Base.metadata.create_all(bind=models.engine)
+
+    rng = random.Random(42)
+    weights = [1 / (rank + 1) for rank in range(len(WORDS))]  # Distribuição de Zipf
+    num_sessions = max(1, total_messages // per_session)
+    start = datetime(2024, 1, 1)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO chat_sessions (id, start_time) VALUES (?, ?)",
+        ((i + 1, start + timedelta(minutes=i)) for i in range(num_sessions)),
+    )
+    conn.executemany(
+        "INSERT INTO chat_messages (session_id, sender, text, timestamp) VALUES (?, ?, ?, ?)",
+        (((n % num_sessions) + 1, "user" if n % 2 == 0 else "dk_chat", sentence(rng, weights),
+          start + timedelta(seconds=n)) for n in range(total_messages)),
+    )
+    conn.commit()
+    conn.close()
+    return num_sessions
+
+def measure(fn, repeat: int) -> tuple[float, float]:
+    samples = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - t0) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[max(0, int(len(samples) * 0.95) - 1)]
+
+def db_size(path: str) -> int:
+    return sum(os.path.getsize(p) for p in (path, path + "-wal") if os.path.exists(p))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--per-session", type=int, default=50)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(prefix="dk_chat_search_")
+    path = os.path.join(tmpdir, "bench.db")
+    os.environ["DK_CHAT_DATABASE_URL"] = f"sqlite:///{path}"
+    try:
+        t0 = time.perf_counter()
+        num_sessions = populate(path, args.messages, args.per_session)
+        print(f"{args.messages:,} mensagens em {num_sessions:,} sessões (gerado em {time.perf_counter() - t0:.1f}s)")
+
+        from sqlalchemy import text
+        from core import models
+        from core.db_manager import get_db, search_messages, save_message
+
+        models.ensure_db_ready()  # Migrações: índice de sessão e tabela FTS5 + gatilhos (vazia)
+        size_before = db_size(path)
+        t0 = time.perf_counter()
+        models.rebuild_search_index()
+        print(f"Backfill do índice: {time.perf_counter() - t0:.1f}s; banco {size_before / 2**20:.0f} MB -> {db_size(path) / 2**20:.0f} MB")
+
+        rng = random.Random(7)
+        # Termos frequentes (topo da distribuição de Zipf) casam com boa parte do histórico;
+        # pares de termos raros são o caso típico de quem procura uma conversa específica
+        query_sets = {
+            "termo frequente": [rng.choice(WORDS[:20]) for _ in range(args.queries)],
+            "2 termos raros": [f"{rng.choice(WORDS[-40:])} {rng.choice(WORDS[-40:])}" for _ in range(args.queries)],
+        }
+
+        def fts(queries, per_session=False):
+            it = iter(queries * 2)
+            def run():
+                session_id = rng.randint(1, num_sessions) if per_session else None
+                with get_db() as db:
+                    search_messages(db, next(it), session_id=session_id, limit=20)
+            return run
+
+        def like(queries):
+            # Sem índice, o LIKE varre a tabela inteira para achar os 20 resultados mais recentes
+            it = iter(queries * 2)
+            def run():
+                terms = next(it).split()
+                where = " AND ".join(f"text LIKE :t{i}" for i in range(len(terms)))
+                with get_db() as db:
+                    db.execute(text(f"SELECT id FROM chat_messages WHERE {where} ORDER BY timestamp DESC LIMIT 20"),
+                               {f"t{i}": f"%{term}%" for i, term in enumerate(terms)}).all()
+            return run
+
+        results = {}
+        for label, queries in query_sets.items():
+            results[f"search_messages, {label}"] = measure(fts(queries), args.queries)
+            results[f"search_messages/sessão, {label}"] = measure(fts(queries, per_session=True), args.queries)
+            results[f"LIKE, {label}"] = measure(like(queries), max(5, args.queries // 20))
+
+        def save_one():
+            with get_db() as db:
+                save_message(db, 1, "user", sentence(rng, [1.0] * len(WORDS)))
+
+        results["save_message (com gatilhos)"] = measure(save_one, args.queries)
+        with models.engine.begin() as conn:
+            triggers = conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'chat_messages_fts_%'")).scalars().all()
+            for name in ("ai", "ad", "au"):
+                conn.execute(text(f"DROP TRIGGER chat_messages_fts_{name}"))
+        results["save_message (sem gatilhos)"] = measure(save_one, args.queries)
+        with models.engine.begin() as conn:
+            for sql in triggers:
+                conn.execute(text(sql))
+
+        print(f"{'operação':<42} {'p50 (ms)':>10} {'p95 (ms)':>10}")
+        for op, (p50, p95) in results.items():
+            print(f"{op:<42} {p50:>10.3f} {p95:>10.3f}")
+        models.engine.dispose()
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
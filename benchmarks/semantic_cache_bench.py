@@ -0,0 +1,165 @@
+"""
+Benchmark do cache semântico (core/semantic_cache.py), sem rede.
+
+Gera um histórico sintético com N pares pergunta/resposta em um diretório temporário,
+reconstrói o índice e mede:
+- tempo da reconstrução e tamanho dos arquivos do índice;
+- latência da consulta (p50/p95), uma pergunta por vez e em lotes (`lookup_many`);
+- qualidade: acertos corretos para paráfrases de perguntas indexadas e acertos falsos para
+  perguntas sobre assuntos que não estão no índice, no limiar configurado.
+
+Uso: python benchmarks/semantic_cache_bench.py [--pairs 10000 100000] [--queries 500] [--batch 32]
+       [--threshold 0.9] [--dim 1024]
+"""
+import argparse
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+TEMPLATES = [
+    "Como funciona {s}?",
+    "Me explique como funciona {s}.",
+    "Você pode explicar o funcionamento de {s}?",
+    "Quais são as vantagens de {s}?",
+    "Quais as principais vantagens de {s}?",
+    "Qual a história de {s}?",
+]
+# Paráfrases das três primeiras formas (mesma intenção)
+PARAPHRASES = [
+    "como funciona {s}",
+    "Me explica como {s} funciona?",
+    "Pode me explicar como funciona {s}?",
+]
+NOUNS = ["a fotossíntese", "o motor", "a bateria", "o sistema", "a rede", "o compilador", "a vacina", "o mercado",
+         "a memória", "o protocolo", "a turbina", "o algoritmo", "a célula", "o satélite", "a moeda", "o vulcão"]
+ADJECTIVES = ["elétrico", "solar", "quântico", "digital", "neural", "orbital", "financeiro", "biológico",
+              "distribuído", "térmico", "magnético", "híbrido", "nuclear", "marítimo", "industrial", "urbano"]
+PLACES = ["do Brasil", "da Europa", "dos oceanos", "de Marte", "das abelhas", "das cidades", "do corpo humano",
+          "da internet", "dos carros", "das fábricas", "das escolas", "dos hospitais", "das florestas", "do Japão"]
+
+def subjects(rng: random.Random, count: int, offset: int = 0) -> list[str]:
+    """Assuntos distintos ("o motor elétrico das fábricas 17"); `offset` gera assuntos fora do índice."""
+    return [f"{rng.choice(NOUNS)} {rng.choice(ADJECTIVES)} {rng.choice(PLACES)} modelo {offset + i}" for i in range(count)]
+
+def percentile(samples: list[float], p: float) -> float:
+    ordered = sorted(samples)
+    return ordered[max(0, min(len(ordered) - 1, int(round(p / 100 * len(ordered) + 0.5)) - 1))]
+
+def populate(path: str, topics: list[str], rng: random.Random) -> list[tuple[str, int]]:
+    """Uma sessão por 50 pares; retorna (assunto, índice do modelo de pergunta) de cada par."""
+    from core import models
+    models.Base.metadata.create_all(bind=models.engine)
+    conn = sqlite3.connect(path)
+    start = datetime(2024, 1, 1)
+    sessions = (len(topics) + 49) // 50
+    conn.executemany("INSERT INTO chat_sessions (id, start_time) VALUES (?, ?)",
+                     ((i + 1, start) for i in range(sessions)))
+    asked = [(topic, rng.randrange(3)) for topic in topics]
+
+    def rows():
+        clock = start
+        for i, (topic, template) in enumerate(asked):
+            clock += timedelta(seconds=2)
+            yield i // 50 + 1, "user", TEMPLATES[template].format(s=topic), clock
+            yield i // 50 + 1, "dk_chat", f"Resposta sobre {topic}.", clock + timedelta(seconds=1)
+
+    conn.executemany("INSERT INTO chat_messages (session_id, sender, text, timestamp) VALUES (?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+    models.ensure_db_ready()
+    return asked
+
+def run(workdir: str, pairs: int, queries: int, batch: int, threshold: float, dim: int) -> dict:
+    from core.semantic_cache import SemanticCache
+
+    rng = random.Random(pairs)
+    asked = populate(os.path.join(workdir, "dk_chat_history.db"), subjects(rng, pairs), rng)
+    started = time.perf_counter()
+    # Índice vazio: o construtor já dispara a reconstrução, e `rebuild()` espera por ela
+    cache = SemanticCache(os.path.join(workdir, "index"), dim=dim, threshold=threshold, listen=False)
+    cache.rebuild()
+    rebuild_s = time.perf_counter() - started
+    index_mb = sum(os.path.getsize(os.path.join(workdir, "index", name))
+                   for name in os.listdir(os.path.join(workdir, "index"))) / 1e6
+
+    sample = rng.sample(asked, min(queries, len(asked)))
+    paraphrases = [(rng.choice(PARAPHRASES).format(s=topic), f"Resposta sobre {topic}.") for topic, _ in sample]
+    novel = [rng.choice(PARAPHRASES).format(s=topic) for topic in subjects(rng, len(sample), offset=pairs)]
+
+    single_ms = []
+    correct = wrong = 0
+    for question, expected in paraphrases:
+        started = time.perf_counter()
+        answer = cache.lookup(question)
+        single_ms.append((time.perf_counter() - started) * 1000)
+        correct += answer == expected
+        wrong += answer is not None and answer != expected
+    false_hits = sum(match is not None for match in cache.lookup_many(novel))
+
+    batch_ms = []
+    questions = [question for question, _ in paraphrases]
+    for i in range(0, len(questions), batch):
+        started = time.perf_counter()
+        cache.lookup_many(questions[i:i + batch])
+        batch_ms.append((time.perf_counter() - started) * 1000 / len(questions[i:i + batch]))
+    return {
+        "pairs": cache.count,
+        "rebuild_s": rebuild_s,
+        "index_mb": index_mb,
+        "lookup_p50_ms": percentile(single_ms, 50),
+        "lookup_p95_ms": percentile(single_ms, 95),
+        "batched_ms_per_query": statistics.fmean(batch_ms),
+        "paraphrase_hit_rate": correct / len(paraphrases),
+        "wrong_answer_rate": wrong / len(paraphrases),
+        "novel_false_hit_rate": false_hits / len(novel),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pairs", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--threshold", type=float, default=None)
+    parser.add_argument("--dim", type=int, default=None)
+    args = parser.parse_args()
+
+    if len(args.pairs) > 1:
+        # O banco vem de variável de ambiente lida na importação de core.models: um processo por tamanho
+        for pairs in args.pairs:
+            command = [sys.executable, __file__, "--pairs", str(pairs), "--queries", str(args.queries), "--batch", str(args.batch)]
+            if args.threshold is not None:
+                command += ["--threshold", str(args.threshold)]
+            if args.dim is not None:
+                command += ["--dim", str(args.dim)]
+            subprocess.run(command, check=True)
+        return
+
+    workdir = tempfile.mkdtemp(prefix="dk_chat_semantic_bench_")
+    os.environ["DK_CHAT_DATABASE_URL"] = f"sqlite:///{os.path.join(workdir, 'dk_chat_history.db')}"
+    from core import semantic_cache
+    threshold = semantic_cache.SEMANTIC_CACHE_THRESHOLD if args.threshold is None else args.threshold
+    dim = semantic_cache.SEMANTIC_CACHE_DIM if args.dim is None else args.dim
+    try:
+        result = run(workdir, args.pairs[0], args.queries, args.batch, threshold, dim)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n=== {result['pairs']:,} pares (limiar {threshold}, dim {dim}) ===")
+    print(f"reconstrução: {result['rebuild_s']:.2f} s   índice: {result['index_mb']:.1f} MB")
+    print(f"consulta: p50 {result['lookup_p50_ms']:.2f} ms  p95 {result['lookup_p95_ms']:.2f} ms   "
+          f"em lote: {result['batched_ms_per_query']:.3f} ms/pergunta")
+    print(f"paráfrases servidas corretamente: {result['paraphrase_hit_rate']:.1%}   "
+          f"resposta errada: {result['wrong_answer_rate']:.1%}   "
+          f"acerto falso (assunto novo): {result['novel_false_hit_rate']:.1%}")
+
+if __name__ == "__main__":
+    main()
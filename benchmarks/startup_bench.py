@@ -0,0 +1,114 @@
+"""
+Benchmark da inicialização do app (sem abrir janela).
+
+Roda o caminho de inicialização em subprocessos limpos e mede:
+- tempo até a tela inicial: importar `main` (Flet + SplashScreen);
+- tempo até o primeiro chat: importar a tela do chat, criar a lógica compartilhada,
+  abrir o banco, criar a sessão e carregar o modelo do Gemini;
+- no cenário "com aquecimento", o aquecimento de core.warmup roda entre as duas marcas
+  (como acontece enquanto a tela inicial é exibida) e o tempo do clique em "Iniciar Chat"
+  é medido separadamente.
+Uma execução extra com `python -X importtime` lista as importações mais caras de cada fase.
+O banco é criado em um diretório temporário e a DeepSeek fica desativada (sem rede).
+
+Uso: python benchmarks/startup_bench.py [--runs 5] [--top 10]
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+SCRIPT = r'''
+import sys, time
+t0 = time.perf_counter()
+def mark(label):
+    print(f"@@mark {label} {(time.perf_counter() - t0) * 1000:.1f}", file=sys.stderr, flush=True)
+
+import main
+mark("splash")
+if {warm}:
+    from core.warmup import warm_up
+    warm_up([("tela do chat", lambda: __import__("ui.chat_screen"))])
+    mark("warm")
+from ui.chat_screen import ChatScreen
+from core.chat_logic import get_chat_logic
+from core.conversation import get_conversation_state
+from core.db_manager import get_db, create_chat_session
+from core.registry import get_provider
+get_chat_logic()
+with get_db() as db:
+    session_id = create_chat_session(db).id
+get_conversation_state(session_id)
+get_provider("gemini")
+mark("first_chat")
+'''
+
+def run_once(warm: bool, importtime: bool) -> tuple[dict[str, float], str]:
+    tmpdir = tempfile.mkdtemp(prefix="dk_chat_startup_")
+    env = dict(os.environ)
+    env["DK_CHAT_DATABASE_URL"] = f"sqlite:///{os.path.join(tmpdir, 'bench.db')}"
+    env["DEEPSEEK_API_KEY"] = ""
+    env.setdefault("GEMINI_API_KEY", "benchmark") # configure/GenerativeModel não acessam a rede
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", SCRIPT.replace("{warm}", str(warm))]
+    try:
+        result = subprocess.run(args, cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    marks = {}
+    for line in result.stderr.splitlines():
+        if line.startswith("@@mark "):
+            _, label, ms = line.split()
+            marks[label] = float(ms)
+    return marks, result.stderr
+
+def top_imports(stderr: str, top: int) -> dict[str, list[tuple[int, str]]]:
+    """Importações dos dois primeiros níveis de cada fase, ordenadas pelo tempo acumulado (µs)."""
+    phases, phase = {}, "splash"
+    for line in stderr.splitlines():
+        if line.startswith("@@mark "):
+            if line.split()[1] == "splash":
+                phase = "chat"
+            continue
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name[1:]
+        level = (len(name) - len(name.lstrip())) // 2
+        if level > 1:  # Importações mais profundas já estão contadas nas de cima
+            continue
+        phases.setdefault(phase, []).append((int(cumulative), "  " * level + name.strip()))
+    return {p: sorted(entries, reverse=True)[:top] for p, entries in phases.items()}
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"{'cenário':<18} {'tela inicial (ms)':>18} {'aquecimento (ms)':>17} {'clique → chat (ms)':>19} {'total (ms)':>11}")
+    for warm in (False, True):
+        runs = [run_once(warm, importtime=False)[0] for _ in range(args.runs)]
+        splash = statistics.median(r["splash"] for r in runs)
+        first_chat = statistics.median(r["first_chat"] for r in runs)
+        if warm:
+            warm_ms = statistics.median(r["warm"] - r["splash"] for r in runs)
+            click = statistics.median(r["first_chat"] - r["warm"] for r in runs)
+        else:
+            warm_ms, click = 0.0, first_chat - splash
+        label = "com aquecimento" if warm else "sem aquecimento"
+        print(f"{label:<18} {splash:>18.1f} {warm_ms:>17.1f} {click:>19.1f} {first_chat:>11.1f}")
+
+    _, stderr = run_once(False, importtime=True)
+    for phase, entries in top_imports(stderr, args.top).items():
+        title = "até a tela inicial" if phase == "splash" else "da tela inicial ao primeiro chat"
+        print(f"\nImportações mais caras {title} (-X importtime, acumulado):")
+        for cumulative, name in entries:
+            print(f"  {cumulative / 1000:>8.1f} ms  {name}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+"""
+Benchmark da exportação/importação do histórico (core/transfer.py, manage.py export/import), sem rede.
+
+Gera um histórico sintético (por padrão 1M de mensagens, parte das sessões no arquivo comprimido)
+em um diretório temporário e mede, cada etapa em um processo separado:
+- exportação NDJSON simples e com gzip: mensagens/s, MB/s e tamanho do arquivo;
+- importação em um banco vazio: mensagens/s;
+- memória de pico (RSS anônimo) de cada processo, comparada com a de um processo que só abre o banco;
+- retomada: uma importação interrompida (SIGKILL) no meio e executada de novo termina com o
+  mesmo conteúdo do banco de origem (conferido por um hash das mensagens, ignorando os ids).
+
+Uso: python benchmarks/transfer_bench.py [--messages 1000000] [--archived 0.1]
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import resource
+import shutil
+import signal
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+WORDS = ("mercado preço taxa juros inflação governo empresa resultado trimestre análise projeto código "
+         "função servidor banco consulta exemplo tabela campo valor usuário sistema memória processo "
+         "arquivo dados modelo resposta pergunta notícia semana ano mês dia hoje **importante** `código` "
+         "ação câmbio dólar real").split()
+
+def populate(path: str, messages: int, session_size: int, rng: random.Random) -> int:
+    from core import models
+    models.ensure_db_ready()
+
+    sessions = (messages + session_size - 1) // session_size
+    start = datetime(2024, 1, 1)
+    conn = sqlite3.connect(path)
+    conn.executemany(
+        "INSERT INTO chat_sessions (id, start_time, title, message_count, last_activity, preview) VALUES (?, ?, ?, ?, ?, ?)",
+        ((i, start + timedelta(hours=i), f"Pergunta {i}", min(session_size, messages - (i - 1) * session_size),
+          start + timedelta(hours=i, minutes=30), "Resposta") for i in range(1, sessions + 1)))
+
+    def rows():
+        for i in range(messages):
+            session_id = i // session_size + 1
+            words = rng.randint(6, 20) if i % 2 == 0 else rng.randint(40, 160)
+            yield (i + 1, session_id, "user" if i % 2 == 0 else "dk_chat", " ".join(rng.choices(WORDS, k=words)),
+                   start + timedelta(hours=session_id, seconds=i % session_size, microseconds=rng.randrange(1000000)))
+
+    conn.executemany("INSERT INTO chat_messages (id, session_id, sender, text, timestamp) VALUES (?, ?, ?, ?, ?)", rows())
+    conn.commit()
+    conn.close()
+    return sessions
+
+def content_hash(database_url: str) -> tuple[int, str]:
+    """(mensagens, sha256) do histórico na ordem da exportação, sem os ids (que a importação troca)."""
+    result = run_child(database_url, "hash")
+    return result["messages"], result["sha256"]
+
+def run_child(database_url: str, *args: str, kill_when=None) -> dict:
+    """Roda uma etapa em outro processo (memória medida isoladamente) e devolve o JSON que ela imprime."""
+    env = dict(os.environ, DK_CHAT_DATABASE_URL=database_url, GEMINI_API_KEY="", DEEPSEEK_API_KEY="")
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), "--child", *args], env=env,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+    if kill_when is not None:
+        while process.poll() is None and not kill_when():
+            time.sleep(0.05)
+        if process.poll() is None:
+            process.send_signal(signal.SIGKILL)
+            process.wait()
+            return {"killed": True}
+    output, _ = process.communicate()
+    if process.returncode:
+        raise RuntimeError(f"Etapa {args} falhou (código {process.returncode})")
+    return json.loads(output.strip().splitlines()[-1])
+
+def anon_rss_mb() -> float:
+    """Memória anônima do processo (Linux). O RSS total inclui as páginas do banco mapeadas pelo mmap do SQLite."""
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("RssAnon:"):
+                return int(line.split()[1]) / 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def child(args: list[str]):
+    from core.models import ensure_db_ready
+    ensure_db_ready()
+    peak = [anon_rss_mb()]
+
+    def sample():
+        while True:
+            peak[0] = max(peak[0], anon_rss_mb())
+            time.sleep(0.02)
+
+    threading.Thread(target=sample, daemon=True).start()
+    command = args[0]
+    result = {}
+    started = time.perf_counter()
+    if command == "export":
+        from core.transfer import export_history
+        result = export_history(args[1])
+    elif command == "import":
+        from core.transfer import import_history
+        result = import_history(args[1])
+    elif command == "hash":
+        from core.transfer import iter_export_lines
+        digest = hashlib.sha256()
+        for line in iter_export_lines():
+            record = json.loads(line)
+            if record["type"] == "message":
+                result["messages"] = result.get("messages", 0) + 1
+                digest.update(f"{record['sender']}\0{record['text']}\0{record['timestamp']}\n".encode())
+        result["sha256"] = digest.hexdigest()
+    result["seconds"] = time.perf_counter() - started
+    result["rss_mb"] = max(peak[0], anon_rss_mb())
+    print(json.dumps(result))
+
+def imported_messages(path: str) -> int:
+    try:
+        conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=1)
+        try:
+            return conn.execute("SELECT COALESCE(MAX(messages), 0) FROM chat_imports").fetchone()[0]
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return 0
+
+def main():
+    if "--child" in sys.argv:
+        child(sys.argv[sys.argv.index("--child") + 1:])
+        return
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--session-size", type=int, default=40)
+    parser.add_argument("--archived", type=float, default=0.1, help="Fração das sessões no arquivo comprimido")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="dk_chat_transfer_bench_")
+    source = os.path.join(workdir, "source.db")
+    os.environ["DK_CHAT_DATABASE_URL"] = source_url = f"sqlite:///{source}"
+    try:
+        from core import archive
+
+        rng = random.Random(3)
+        started = time.perf_counter()
+        sessions = populate(source, args.messages, args.session_size, rng)
+        print(f"Histórico sintético: {args.messages:,} mensagens em {sessions:,} sessões em {time.perf_counter() - started:.1f}s")
+        if args.archived > 0:
+            archived = archive.archive_idle_sessions(0, limit=int(sessions * args.archived))
+            print(f"Arquivadas: {archived['sessions']:,} sessões ({archived['messages']:,} mensagens)")
+        with archive.engine.connect() as conn:
+            conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+        expected = content_hash(source_url)
+
+        baseline = run_child(source_url, "noop")
+        print(f"\nRSS anônimo de um processo que só abre o banco: {baseline['rss_mb']:.0f} MB")
+        for name in ("history.ndjson", "history.ndjson.gz"):
+            result = run_child(source_url, "export", os.path.join(workdir, name))
+            print(f"export {name:<18} {result['messages'] / result['seconds']:>9,.0f} msg/s  "
+                  f"{result['bytes'] / 1e6 / result['seconds']:>6.1f} MB/s  {result['bytes'] / 1e6:>7.1f} MB  "
+                  f"{result['seconds']:>5.1f}s  RSS {result['rss_mb']:.0f} MB")
+
+        dump = os.path.join(workdir, "history.ndjson.gz")
+        target = os.path.join(workdir, "target.db")
+        result = run_child(f"sqlite:///{target}", "import", dump)
+        print(f"import {'(banco vazio)':<18} {result['messages'] / result['seconds']:>9,.0f} msg/s  "
+              f"{'':>14}  {'':>10}{result['seconds']:>5.1f}s  RSS {result['rss_mb']:.0f} MB")
+        assert content_hash(f"sqlite:///{target}") == expected, "importação diferente da origem"
+
+        # Retomada: interrompe no meio e roda de novo
+        resumed = os.path.join(workdir, "resumed.db")
+        half = args.messages // 2
+        run_child(f"sqlite:///{resumed}", "import", dump, kill_when=lambda: imported_messages(resumed) >= half)
+        interrupted_at = imported_messages(resumed)
+        result = run_child(f"sqlite:///{resumed}", "import", dump)
+        print(f"\nRetomada: interrompida (SIGKILL) com {interrupted_at:,} mensagens confirmadas; "
+              f"a segunda execução importou mais {result['imported_now']:,} em {result['seconds']:.1f}s")
+        assert content_hash(f"sqlite:///{resumed}") == expected, "importação retomada diferente da origem"
+        print(f"Conferência: {expected[0]:,} mensagens idênticas à origem nas duas importações")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,346 @@
+"""
+Camada de arquivo das conversas antigas.
+
+Sessões sem atividade há mais de DK_CHAT_ARCHIVE_AFTER_DAYS dias saem de chat_messages e viram
+uma única linha em chat_session_archives: as mensagens codificadas por colunas (ids e horários
+como diferenças, remetentes e textos em listas) e comprimidas com zstd (se o pacote `zstandard`
+estiver instalado) ou zlib. A lista de conversas não muda (as estatísticas ficam em chat_sessions).
+
+Ao abrir uma sessão arquivada, as leituras do db_manager descomprimem o blob sob demanda (com
+um pequeno cache em memória); ao gravar uma mensagem nova nela, a sessão volta inteira para
+chat_messages. Mensagens arquivadas ficam fora da busca textual (FTS5) até a sessão ser restaurada.
+
+Depois de arquivar, as páginas liberadas são devolvidas ao sistema com PRAGMA incremental_vacuum,
+em passos curtos (DK_CHAT_VACUUM_STEP_PAGES) para não segurar o banco por muito tempo.
+"""
+import json
+import os
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, text
+
+from .models import ChatMessage, ChatSession, ChatSessionArchive, DATABASE_URL, FTS_TABLE, engine, ensure_db_ready
+
+try:
+    import zstandard
+except ImportError:  # Dependência opcional: sem ela, os arquivos usam zlib
+    zstandard = None
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("DK_CHAT_ARCHIVE_AFTER_DAYS", "90"))  # 0 desativa o arquivamento automático
+ARCHIVE_CODEC = os.getenv("DK_CHAT_ARCHIVE_CODEC", "zstd" if zstandard is not None else "zlib")
+ARCHIVE_ZLIB_LEVEL = int(os.getenv("DK_CHAT_ARCHIVE_ZLIB_LEVEL", "9"))
+ARCHIVE_ZSTD_LEVEL = int(os.getenv("DK_CHAT_ARCHIVE_ZSTD_LEVEL", "12"))
+ARCHIVE_CACHE_SESSIONS = int(os.getenv("DK_CHAT_ARCHIVE_CACHE_SESSIONS", "8"))  # Sessões descomprimidas em memória
+VACUUM_STEP_PAGES = int(os.getenv("DK_CHAT_VACUUM_STEP_PAGES", "2048"))
+ARCHIVE_FORMAT_VERSION = 1
+
+# Mesmo formato das linhas de get_message_rows_for_session / get_messages_page
+ArchivedMessage = namedtuple("ArchivedMessage", "id sender text timestamp")
+
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+# --- Codificação ---
+
+def _deltas(values: list[int]) -> list[int]:
+    return [value - previous for previous, value in zip([0] + values, values)]
+
+def _undeltas(deltas: list[int]) -> list[int]:
+    values, total = [], 0
+    for delta in deltas:
+        total += delta
+        values.append(total)
+    return values
+
+def encode_messages(rows) -> bytes:
+    """Mensagens (id, sender, text, timestamp), em ordem, como JSON por colunas (antes da compressão)."""
+    payload = {
+        "v": ARCHIVE_FORMAT_VERSION,
+        "ids": _deltas([row.id for row in rows]),
+        # Microssegundos desde 1970 (horários UTC sem fuso, como no banco)
+        "ts": _deltas([(row.timestamp - _EPOCH) // _MICROSECOND for row in rows]),
+        "senders": [row.sender for row in rows],
+        "texts": [row.text for row in rows],
+    }
+    return json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def decode_messages(raw: bytes) -> list[ArchivedMessage]:
+    payload = json.loads(raw)
+    ids = _undeltas(payload["ids"])
+    timestamps = [_EPOCH + value * _MICROSECOND for value in _undeltas(payload["ts"])]
+    return [ArchivedMessage(*fields) for fields in zip(ids, payload["senders"], payload["texts"], timestamps)]
+
+def compress(raw: bytes, codec: str = ARCHIVE_CODEC) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("O codec zstd precisa do pacote zstandard (pip install zstandard).")
+        return zstandard.ZstdCompressor(level=ARCHIVE_ZSTD_LEVEL).compress(raw)
+    if codec == "zlib":
+        return zlib.compress(raw, ARCHIVE_ZLIB_LEVEL)
+    raise ValueError(f"Codec de arquivo desconhecido: {codec}")
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Esta sessão foi arquivada com zstd; instale o pacote zstandard para abri-la.")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == "zlib":
+        return zlib.decompress(data)
+    raise ValueError(f"Codec de arquivo desconhecido: {codec}")
+
+
+# --- Leitura sob demanda ---
+
+_cache: OrderedDict[int, list[ArchivedMessage]] = OrderedDict()
+_cache_lock = threading.Lock()
+
+def _invalidate(session_id: int):
+    with _cache_lock:
+        _cache.pop(session_id, None)
+
+def get_archived_messages(conn, session_id: int) -> list[ArchivedMessage] | None:
+    """Mensagens da sessão arquivada, em ordem cronológica, ou None se a sessão não está no arquivo."""
+    with _cache_lock:
+        messages = _cache.get(session_id)
+        if messages is not None:
+            _cache.move_to_end(session_id)
+            return messages
+    row = conn.execute(
+        select(ChatSessionArchive.codec, ChatSessionArchive.data).where(ChatSessionArchive.session_id == session_id)
+    ).first()
+    if row is None:
+        return None
+    messages = decode_messages(decompress(row.data, row.codec))
+    with _cache_lock:
+        _cache[session_id] = messages
+        while len(_cache) > ARCHIVE_CACHE_SESSIONS:
+            _cache.popitem(last=False)
+    return messages
+
+def page_archived_messages(messages: list[ArchivedMessage], before=None, after=None, limit: int = 50) -> list[ArchivedMessage]:
+    """Mesma paginação keyset de db_manager.get_messages_page, sobre a lista descomprimida."""
+    if after is not None:
+        return [message for message in messages if (message.timestamp, message.id) > tuple(after)][:limit]
+    if before is not None:
+        messages = [message for message in messages if (message.timestamp, message.id) < tuple(before)]
+    return messages[-limit:] if limit else []
+
+
+# --- Arquivamento e restauração ---
+
+def archive_session(conn, session_id: int, codec: str = ARCHIVE_CODEC) -> tuple[int, int, int] | None:
+    """
+    Move as mensagens da sessão para o arquivo (na transação de `conn`).
+    Retorna (mensagens, bytes antes, bytes depois da compressão), ou None se não havia mensagens.
+    """
+    rows = conn.execute(
+        select(ChatMessage.id, ChatMessage.sender, ChatMessage.text, ChatMessage.timestamp).where(
+            ChatMessage.session_id == session_id
+        ).order_by(ChatMessage.timestamp, ChatMessage.id)
+    ).all()
+    if not rows:
+        return None
+    previous = get_archived_messages(conn, session_id)
+    if previous:  # Não deveria acontecer (gravar restaura a sessão), mas nada se perde
+        rows = sorted(previous + [ArchivedMessage(*row) for row in rows], key=lambda message: (message.timestamp, message.id))
+    raw = encode_messages(rows)
+    data = compress(raw, codec)
+    conn.execute(delete(ChatSessionArchive).where(ChatSessionArchive.session_id == session_id))
+    conn.execute(insert(ChatSessionArchive).values(
+        session_id=session_id, codec=codec, message_count=len(rows), raw_bytes=len(raw), data=data,
+        archived_at=datetime.utcnow(),
+    ))
+    conn.execute(delete(ChatMessage).where(ChatMessage.session_id == session_id))
+    _invalidate(session_id)
+    return len(rows), len(raw), len(data)
+
+def restore_session(conn, session_id: int) -> int:
+    """
+    Devolve as mensagens arquivadas da sessão para chat_messages (na transação de `conn`), antes de
+    uma gravação nova. Os ids originais são mantidos, a não ser que algum já tenha sido reutilizado
+    (sem AUTOINCREMENT, o SQLite pode reaproveitar ids acima do maior existente); nesse caso a sessão
+    recebe ids novos. Retorna quantas mensagens voltaram (0 se a sessão não estava arquivada).
+    """
+    exists = conn.execute(
+        select(ChatSessionArchive.session_id).where(ChatSessionArchive.session_id == session_id)
+    ).first()
+    if exists is None:
+        return 0
+    _invalidate(session_id)
+    messages = get_archived_messages(conn, session_id)
+    _invalidate(session_id)
+    ids = [message.id for message in messages]
+    reused = any(
+        conn.execute(select(ChatMessage.id).where(ChatMessage.id.in_(ids[i:i + 900])).limit(1)).first()
+        for i in range(0, len(ids), 900)
+    )
+    rows = [
+        {"session_id": session_id, "sender": message.sender, "text": message.text, "timestamp": message.timestamp}
+        | ({} if reused else {"id": message.id})
+        for message in messages
+    ]
+    if rows:
+        conn.execute(insert(ChatMessage.__table__), rows)
+    conn.execute(delete(ChatSessionArchive).where(ChatSessionArchive.session_id == session_id))
+    print(f"DK Chat: Sessão {session_id} restaurada do arquivo ({len(rows)} mensagens).")
+    return len(rows)
+
+def delete_archive(conn, session_id: int):
+    conn.execute(delete(ChatSessionArchive).where(ChatSessionArchive.session_id == session_id))
+    _invalidate(session_id)
+
+def archive_idle_sessions(older_than_days: int = ARCHIVE_AFTER_DAYS, codec: str = ARCHIVE_CODEC,
+                          limit: int | None = None) -> dict:
+    """Arquiva as sessões sem atividade há mais de `older_than_days` dias, uma transação por sessão."""
+    ensure_db_ready()
+    cutoff = datetime.utcnow() - timedelta(days=older_than_days)
+    with engine.connect() as conn:
+        query = select(ChatSession.id).where(
+            ChatSession.last_activity < cutoff,
+            ChatSession.message_count > 0,
+            ~select(ChatSessionArchive.session_id).where(ChatSessionArchive.session_id == ChatSession.id).exists(),
+        ).order_by(ChatSession.last_activity)
+        if limit is not None:
+            query = query.limit(limit)
+        session_ids = conn.execute(query).scalars().all()
+
+    from .db_manager import notify_session_removed
+
+    result = {"sessions": 0, "messages": 0, "raw_bytes": 0, "stored_bytes": 0}
+    started = time.perf_counter()
+    for session_id in session_ids:
+        # Transações curtas: o app pode continuar gravando entre uma sessão e outra
+        with engine.begin() as conn:
+            archived = archive_session(conn, session_id, codec)
+        if archived is not None:
+            notify_session_removed(session_id)
+            result["sessions"] += 1
+            result["messages"] += archived[0]
+            result["raw_bytes"] += archived[1]
+            result["stored_bytes"] += archived[2]
+    if result["sessions"]:
+        # As remoções deixam marcas de exclusão no índice FTS5, que deixam a busca mais lenta até uma fusão
+        with engine.begin() as conn:
+            conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+    result["seconds"] = time.perf_counter() - started
+    return result
+
+
+# --- Espaço em disco ---
+
+def incremental_vacuum(max_steps: int | None = None, step_pages: int = VACUUM_STEP_PAGES) -> dict:
+    """
+    Devolve páginas livres ao sistema em passos de `step_pages` (cada passo é uma transação curta).
+    Só funciona com auto_vacuum=INCREMENTAL; bancos criados antes disso precisam de um VACUUM completo.
+    """
+    ensure_db_ready()
+    with engine.connect() as conn:
+        mode = conn.exec_driver_sql("PRAGMA auto_vacuum").scalar()
+        free_before = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    result = {"incremental": mode == 2, "free_pages_before": free_before, "steps": 0}
+    if mode == 2:
+        while free_before and (max_steps is None or result["steps"] < max_steps):
+            with engine.connect() as conn:
+                # executescript roda o pragma até o fim; execute() do sqlite3 só libera uma página por chamada
+                conn.connection.driver_connection.executescript(f"PRAGMA incremental_vacuum({step_pages})")
+                free_now = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+            result["steps"] += 1
+            if free_now >= free_before:
+                break  # Nada mais a devolver (ex.: outra conexão segurando páginas)
+            free_before = free_now
+            time.sleep(0)  # Deixa outras transações entrarem entre os passos
+    with engine.connect() as conn:
+        result["free_pages_after"] = conn.exec_driver_sql("PRAGMA freelist_count").scalar()
+    return result
+
+def full_vacuum():
+    """VACUUM completo: reescreve o arquivo e, em bancos antigos, ativa o auto_vacuum incremental."""
+    ensure_db_ready()
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.exec_driver_sql("VACUUM")
+        conn.exec_driver_sql("PRAGMA wal_checkpoint(TRUNCATE)")
+
+def database_path() -> str | None:
+    prefix = "sqlite:///"
+    return DATABASE_URL[len(prefix):] if DATABASE_URL.startswith(prefix) else None
+
+def storage_report(measure_latency: bool = True) -> dict:
+    """Tamanho do banco, das mensagens e do arquivo e, opcionalmente, latência das consultas comuns."""
+    ensure_db_ready()
+    report = {}
+    path = database_path()
+    if path:
+        report["file_bytes"] = sum(os.path.getsize(path + suffix) for suffix in ("", "-wal") if os.path.exists(path + suffix))
+    with engine.connect() as conn:
+        for pragma in ("page_size", "page_count", "freelist_count", "auto_vacuum"):
+            report[pragma] = conn.exec_driver_sql(f"PRAGMA {pragma}").scalar()
+        hot = conn.execute(select(func.count(), func.coalesce(func.sum(func.length(ChatMessage.text)), 0))).one()
+        report["hot_messages"], report["hot_text_chars"] = hot
+        archived = conn.execute(select(
+            func.count(), func.coalesce(func.sum(ChatSessionArchive.message_count), 0),
+            func.coalesce(func.sum(ChatSessionArchive.raw_bytes), 0), func.coalesce(func.sum(func.length(ChatSessionArchive.data)), 0),
+        )).one()
+        report["archived_sessions"], report["archived_messages"], report["archived_raw_bytes"], report["archived_bytes"] = archived
+    if measure_latency:
+        report["latency_ms"] = _measure_latency()
+    return report
+
+def _measure_latency(repeat: int = 20) -> dict:
+    """Mediana (ms) das leituras que a interface faz ao abrir a lista de conversas e uma conversa."""
+    from .db_manager import get_db, get_messages_page, get_sessions_page, search_messages
+
+    def median_ms(fn) -> float:
+        samples = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            with get_db() as db:
+                fn(db)
+            samples.append((time.perf_counter() - started) * 1000)
+        return sorted(samples)[len(samples) // 2]
+
+    latency = {}
+    with get_db() as db:
+        recent = get_sessions_page(db, limit=1)
+        oldest = db.execute(select(ChatSessionArchive.session_id).limit(1)).scalar()
+    latency["sessions_page"] = median_ms(lambda db: get_sessions_page(db))
+    if recent:
+        latency["recent_session_page"] = median_ms(lambda db: get_messages_page(db, recent[0].id))
+    latency["search"] = median_ms(lambda db: search_messages(db, "como"))
+    if oldest is not None:
+        def open_archived(db):
+            _invalidate(oldest)  # Mede a descompressão, não o cache
+            get_messages_page(db, oldest)
+        latency["archived_session_open"] = median_ms(open_archived)
+    return latency
+
+
+# --- Manutenção em segundo plano ---
+
+def run_maintenance(older_than_days: int = ARCHIVE_AFTER_DAYS) -> dict:
+    """Arquiva as sessões inativas e devolve o espaço liberado (incremental_vacuum)."""
+    archived = archive_idle_sessions(older_than_days)
+    if archived["sessions"]:
+        print(f"DK Chat: {archived['sessions']} sessões inativas arquivadas ({archived['messages']:,} mensagens, "
+              f"{archived['raw_bytes'] / 1e6:.1f} MB -> {archived['stored_bytes'] / 1e6:.1f} MB).")
+    vacuum = incremental_vacuum()
+    return {"archive": archived, "vacuum": vacuum}
+
+def start_maintenance() -> threading.Thread | None:
+    """Roda `run_maintenance` uma vez, em segundo plano (início do app/servidor), se o arquivamento estiver ativo."""
+    if ARCHIVE_AFTER_DAYS <= 0:
+        return None
+
+    def run():
+        try:
+            run_maintenance()
+        except Exception as e:
+            print(f"DK Chat: Erro na manutenção do arquivo de conversas: {e}")
+
+    thread = threading.Thread(target=run, daemon=True, name="dk-chat-archive")
+    thread.start()
+    return thread
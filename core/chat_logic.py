@@ -1,206 +1,757 @@
+import contextvars
 import os
+import queue
+import threading
+import time
 import requests
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
-from datetime import datetime
-import google.generativeai as genai # Adicionado
+from datetime import datetime, timedelta
+from typing import Iterator, Generator, TYPE_CHECKING
+from .deepseek_client import DeepSeekClient
+from .context_window import ContextWindowManager
+from .router import IntentRouter, normalize_query
+from .registry import get_provider, register_provider
+from .llm_providers import DEFAULT_SYSTEM_PROMPT, LLMProvider, ProviderUnavailable, get_llm_provider, provider_chain
+from .tracing import current_trace, event, set_route, stage
+from .turn_pipeline import MAX_TURN_WORKERS, total_turn_workers
+from .db_manager import (
+    get_db, get_news_cache_entry, save_news_cache_entry, delete_news_cache_entry, purge_expired_news_cache
+)
+
+if TYPE_CHECKING:
+    from .conversation import ConversationState
 
 load_dotenv()
 
 DEEPSEEK_API_KEY = os.getenv("DEEPSEEK_API_KEY")
-DEEPSEEK_API_URL = "https://api.deepseek.com/v1/chat/completions"
+DEEPSEEK_API_URL = os.getenv("DEEPSEEK_API_URL", "https://api.deepseek.com/v1/chat/completions")
 
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") # Adicionado
+# Endpoint alternativo da API do Gemini (ex.: benchmarks/fake_llm_server.py); usa o transporte REST
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
 
-NEWS_KEYWORDS = [
-    "notícia", "notícias", "hoje", "agora", "recente", "últimas",
-    "o que aconteceu", "qual a novidade", "aconteceu com", "previsão do tempo",
-    "cotação", "dólar", "bolsa de valores", "resultado de jogo", "quem ganhou"
-]
+SEARCH_SYSTEM_PROMPT = "Você é um assistente prestativo que busca informações atualizadas na web sobre o seguinte tópico."
 
-class DKChatLogic:
-    def __init__(self):
-        self.gemini_model = None
-        if not DEEPSEEK_API_KEY:
-            print("AVISO: Chave da API DeepSeek não configurada. O modo de busca complementar não funcionará.")
-        
-        if GEMINI_API_KEY:
+# Orçamento (em segundos) para a resposta com busca online aparecer antes de usarmos a resposta direta do Gemini
+NEWS_TURN_BUDGET = float(os.getenv("DK_CHAT_NEWS_TURN_BUDGET", "8"))
+# Threads das pernas dos turnos de notícias; 0 = duas por worker de turno (core.turn_pipeline),
+# para que uma perna nunca espere na fila do executor enquanto o orçamento do turno corre
+NEWS_LEG_WORKERS = int(os.getenv("DK_CHAT_NEWS_LEG_WORKERS", "0"))
+
+# Tempo de vida (em segundos) das respostas em cache, por classe da regra de roteamento (core.router)
+NEWS_CACHE_TTLS = {
+    "mercado": int(os.getenv("DK_CHAT_NEWS_CACHE_TTL_MERCADO", "60")),
+    "esportes": int(os.getenv("DK_CHAT_NEWS_CACHE_TTL_ESPORTES", "300")),
+    "noticias": int(os.getenv("DK_CHAT_NEWS_CACHE_TTL_NOTICIAS", "600")),
+    "clima": int(os.getenv("DK_CHAT_NEWS_CACHE_TTL_CLIMA", "900")),
+}
+NEWS_CACHE_MAX_ENTRIES = int(os.getenv("DK_CHAT_NEWS_CACHE_MAX_ENTRIES", "512"))
+NEWS_CACHE_PERSIST = os.getenv("DK_CHAT_NEWS_CACHE_PERSIST", "0") == "1"
+
+# Cache semântico das respostas gerais (core.semantic_cache); desligado por padrão
+SEMANTIC_CACHE_ENABLED = os.getenv("DK_CHAT_SEMANTIC_CACHE", "0") == "1"
+# Memória de longo prazo entre sessões (core.memory_index); desligada por padrão
+MEMORY_ENABLED = os.getenv("DK_CHAT_MEMORY", "0") == "1"
+MEMORY_SYSTEM_PROMPT = (
+    DEFAULT_SYSTEM_PROMPT + " Abaixo estão trechos de conversas anteriores com este usuário que podem ser "
+    "relevantes. Use-os apenas se ajudarem a responder e não os mencione sem necessidade.\n\n{snippets}"
+)
+
+class NewsCache:
+    """
+    Cache LRU com TTL das respostas a perguntas de notícias (rota DeepSeek).
+    Opcionalmente persiste as entradas na tabela `news_cache` do banco do histórico,
+    para que sobrevivam a reinícios.
+    """
+    def __init__(self, max_entries: int = NEWS_CACHE_MAX_ENTRIES, persist: bool = NEWS_CACHE_PERSIST):
+        self.max_entries = max_entries
+        self.persist = persist
+        self._entries: OrderedDict[str, tuple[str, float]] = OrderedDict()  # chave -> (resposta, expira_em)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if self.persist:
             try:
-                genai.configure(api_key=GEMINI_API_KEY)
-                # Usaremos o gemini-1.5-flash-latest que é rápido e eficiente para chat.
-                # Outras opções: 'gemini-pro', 'gemini-1.5-pro-latest'
-                self.gemini_model = genai.GenerativeModel('gemini-1.5-flash-latest')
-                print("DK Chat: API do Gemini configurada e modelo carregado.")
+                with get_db() as db:
+                    purge_expired_news_cache(db)
             except Exception as e:
-                print(f"DK Chat: Erro ao configurar API do Gemini: {e}")
-                self.gemini_model = None
+                print(f"DK Chat: Erro ao limpar o cache de notícias persistido: {e}")
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                answer, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return answer
+                del self._entries[key]
+                self.expirations += 1
+
+        if self.persist:
+            entry = self._load_persisted(key, now)
+            if entry is not None:
+                with self._lock:
+                    self._store(key, *entry)
+                    self.hits += 1
+                return entry[0]
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key: str, answer: str, ttl: int):
+        expires_at = time.time() + ttl
+        with self._lock:
+            self._store(key, answer, expires_at)
+        if self.persist:
+            try:
+                with get_db() as db:
+                    save_news_cache_entry(db, key, answer, datetime.utcfromtimestamp(expires_at))
+            except Exception as e:
+                print(f"DK Chat: Erro ao persistir o cache de notícias: {e}")
+
+    def _store(self, key: str, answer: str, expires_at: float):
+        self._entries[key] = (answer, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def _load_persisted(self, key: str, now: float) -> tuple[str, float] | None:
+        try:
+            with get_db() as db:
+                db_entry = get_news_cache_entry(db, key)
+                if db_entry is None:
+                    return None
+                expires_at = (db_entry.expires_at - datetime(1970, 1, 1)) / timedelta(seconds=1)
+                if expires_at <= now:
+                    delete_news_cache_entry(db, key)
+                    return None
+                return db_entry.answer, expires_at
+        except Exception as e:
+            print(f"DK Chat: Erro ao ler o cache de notícias persistido: {e}")
+            return None
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+            }
+
+
+def _recording(stream: Generator[str, None, bool], chunks: list[str]) -> Generator[str, None, bool]:
+    """Repassa os trechos de `stream`, guardando-os em `chunks`; retorna o valor de retorno do stream."""
+    try:
+        while True:
+            try:
+                chunk = next(stream)
+            except StopIteration as stop:
+                return stop.value
+            chunks.append(chunk)
+            yield chunk
+    finally:
+        stream.close()
+
+class _StreamLeg:
+    """
+    Executa um stream de resposta em segundo plano, guardando os trechos em uma fila.
+    Usado para disparar em paralelo as duas "pernas" de um turno de notícias e
+    escolher a vencedora sem perder o que a outra já gerou. Registra os tempos da perna.
+    """
+    _END = object()
+
+    def __init__(self, name: str, stream_factory, executor: ThreadPoolExecutor):
+        self.name = name
+        self.cancel_event = threading.Event()
+        self.started = threading.Event()  # Sinalizado quando a perna sai da fila do executor
+        self.first_chunk = threading.Event()  # Sinalizado no primeiro trecho ou ao terminar
+        self.has_content = False
+        self.completed = False
+        self.started_at: float | None = None
+        self.first_chunk_at: float | None = None
+        self.finished_at: float | None = None
+        self._queue: queue.Queue = queue.Queue()
+        # A perna roda em outra thread, mas suas etapas continuam no trace do turno
+        executor.submit(contextvars.copy_context().run, self._run, stream_factory)
+
+    def _run(self, stream_factory):
+        self.started_at = time.monotonic()
+        self.started.set()
+        stream = None
+        try:
+            stream = stream_factory(self.cancel_event)
+            while not self.cancel_event.is_set():
+                try:
+                    chunk = next(stream)
+                except StopIteration as stop:
+                    self.completed = bool(stop.value)
+                    break
+                if self.first_chunk_at is None:
+                    self.first_chunk_at = time.monotonic()
+                self.has_content = True
+                self._queue.put(chunk)
+                self.first_chunk.set()
+        except Exception as e:
+            print(f"DK Chat: Erro na etapa '{self.name}' do turno: {e}")
+        finally:
+            if stream is not None:
+                stream.close()
+            self.finished_at = time.monotonic()
+            self._queue.put(self._END)
+            self.first_chunk.set()
+
+    def wait_first_chunk(self, budget: float) -> bool:
+        """
+        Espera o primeiro trecho (ou o fim) por até `budget` segundos contados a partir do início da
+        execução: com o executor ocupado, o tempo na fila não consome o orçamento do turno.
+        """
+        self.started.wait()
+        return self.first_chunk.wait(timeout=max(0.0, self.started_at + budget - time.monotonic()))
+
+    def chunks(self) -> Iterator[str]:
+        while True:
+            chunk = self._queue.get()
+            if chunk is self._END:
+                return
+            yield chunk
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def describe(self) -> str:
+        def elapsed(t):
+            return f"{t - self.started_at:.2f}s" if t is not None and self.started_at is not None else "-"
+        status = "concluída" if self.completed else ("cancelada" if self.cancel_event.is_set() else "em andamento/falhou")
+        return f"{self.name}: primeiro trecho {elapsed(self.first_chunk_at)}, fim {elapsed(self.finished_at)} ({status})"
+
+
+class _Flight:
+    """Uma chamada em andamento: guarda os trechos já gerados para quem entrar depois."""
+    def __init__(self, key):
+        self.key = key
+        self.cond = threading.Condition()
+        self.cancel_event = threading.Event()
+        self.chunks: list[str] = []
+        self.done = False
+        self.result = False
+        self.error: Exception | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Deduplica chamadas idênticas simultâneas: o primeiro pedido de uma chave dispara o stream
+    em uma thread própria e os demais, enquanto ele estiver em andamento, apenas o acompanham
+    (desde o primeiro trecho). Todos recebem os mesmos trechos, o mesmo valor de retorno ou a
+    mesma exceção. Um pedido que desiste só se desliga; a chamada é cancelada quando não resta
+    ninguém esperando. Nada é guardado depois do fim (isso é papel do NewsCache).
+    """
+    WAIT_POLL = 0.05  # Intervalo (s) em que quem espera confere o próprio cancelamento
+
+    def __init__(self):
+        self._flights: dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.joined = 0
+        self.cancelled = 0
+
+    def stream(self, key: str, stream_factory, cancel_event: threading.Event = None) -> Generator[str, None, bool]:
+        """`stream_factory(cancel_event)` cria o stream compartilhado; só é chamada se não houver outro em andamento."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is None:
+                flight = self._flights[key] = _Flight(key)
+                self.leaders += 1
+                leader = True
+            else:
+                self.joined += 1
+                leader = False
+            flight.waiters += 1
+        if leader:
+            threading.Thread(target=contextvars.copy_context().run, args=(self._run, flight, stream_factory),
+                             daemon=True, name="dk-chat-flight").start()
         else:
-            print("AVISO: Chave da API Gemini não configurada. O chat principal usará respostas genéricas.")
+            print("DK Chat: Pergunta idêntica já em andamento; compartilhando a mesma chamada.")
+            event("single_flight_joined")
+
+        try:
+            position = 0
+            while True:
+                with flight.cond:
+                    while position == len(flight.chunks) and not flight.done:
+                        if cancel_event is not None and cancel_event.is_set():
+                            return False
+                        flight.cond.wait(timeout=self.WAIT_POLL)
+                    new_chunks = flight.chunks[position:]
+                    finished = flight.done
+                position += len(new_chunks)
+                yield from new_chunks
+                if finished and position == len(flight.chunks):
+                    break
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        finally:
+            self._leave(flight)
+
+    def _leave(self, flight: _Flight):
+        with self._lock:
+            flight.waiters -= 1
+            if flight.waiters or flight.done:
+                return
+            # Ninguém mais espera: cancela e libera a chave para um pedido novo
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            self.cancelled += 1
+        flight.cancel_event.set()
+
+    def _run(self, flight: _Flight, stream_factory):
+        stream = None
+        try:
+            stream = stream_factory(flight.cancel_event)
+            while not flight.cancel_event.is_set():
+                try:
+                    chunk = next(stream)
+                except StopIteration as stop:
+                    flight.result = bool(stop.value)
+                    break
+                with flight.cond:
+                    flight.chunks.append(chunk)
+                    flight.cond.notify_all()
+        except Exception as e:
+            flight.error = e
+        finally:
+            if stream is not None:
+                stream.close()
+            with self._lock:
+                if self._flights.get(flight.key) is flight:
+                    del self._flights[flight.key]
+            with flight.cond:
+                flight.done = True
+                flight.cond.notify_all()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "joined": self.joined,
+                "cancelled": self.cancelled,
+            }
+
+
+def _create_deepseek_client() -> DeepSeekClient | None:
+    if not DEEPSEEK_API_KEY:
+        print("AVISO: Chave da API DeepSeek não configurada. O modo de busca complementar não funcionará.")
+        return None
+    # Sessão HTTP persistente: evita refazer DNS/TCP/TLS a cada consulta
+    return DeepSeekClient(DEEPSEEK_API_KEY, DEEPSEEK_API_URL)
+
+def _create_gemini_model():
+    if not GEMINI_API_KEY:
+        print("AVISO: Chave da API Gemini não configurada. O chat principal usará respostas genéricas.")
+        return None
+    try:
+        # Importado só aqui: o SDK do Gemini é a dependência mais pesada do app
+        import google.generativeai as genai
+        if GEMINI_API_ENDPOINT:
+            genai.configure(api_key=GEMINI_API_KEY, transport="rest", client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+        else:
+            genai.configure(api_key=GEMINI_API_KEY)
+        # Usaremos o gemini-1.5-flash-latest que é rápido e eficiente para chat.
+        # Outras opções: 'gemini-pro', 'gemini-1.5-pro-latest'
+        model = genai.GenerativeModel('gemini-1.5-flash-latest')
+        print("DK Chat: API do Gemini configurada e modelo carregado.")
+        return model
+    except Exception as e:
+        print(f"DK Chat: Erro ao configurar API do Gemini: {e}")
+        return None
+
+def _create_semantic_cache():
+    if not SEMANTIC_CACHE_ENABLED:
+        return None
+    try:
+        # Importado só aqui: o numpy não é carregado com o cache desligado
+        from .semantic_cache import SemanticCache
+        return SemanticCache()
+    except Exception as e:
+        print(f"DK Chat: Erro ao abrir o cache semântico: {e}")
+        return None
+
+def _create_memory_index():
+    if not MEMORY_ENABLED:
+        return None
+    try:
+        from .memory_index import MemoryIndex
+        return MemoryIndex()
+    except Exception as e:
+        print(f"DK Chat: Erro ao abrir o índice de memória: {e}")
+        return None
+
+register_provider("deepseek", _create_deepseek_client)
+register_provider("gemini", _create_gemini_model)
+register_provider("semantic_cache", _create_semantic_cache)
+register_provider("memory_index", _create_memory_index)
+
+
+class DKChatLogic:
+    """
+    Lógica de conversa. Uma única instância é compartilhada pelo processo (`get_chat_logic`);
+    os clientes das APIs vêm do registro de provedores e só são criados no primeiro uso.
+    """
+    def __init__(self):
+        # Limita o histórico enviado aos modelos, resumindo os turnos antigos
+        self.context_window = ContextWindowManager(self._summarize_messages)
+        self.router = IntentRouter()
+        self.news_cache = NewsCache()
+        # Perguntas de notícias idênticas e simultâneas compartilham a mesma busca (chave: normalize_query)
+        self.single_flight = SingleFlight()
+        self._leg_executor: ThreadPoolExecutor | None = None  # Criado no primeiro turno de notícias
+        self._leg_executor_lock = threading.Lock()
+        # Aberto já aqui para que o índice acompanhe as mensagens gravadas desde o início
+        get_provider("semantic_cache")
+        get_provider("memory_index")  # Inicia a indexação em segundo plano
+
+    @property
+    def gemini_model(self):
+        return get_provider("gemini")
+
+    @property
+    def deepseek_client(self) -> DeepSeekClient | None:
+        return get_provider("deepseek")
+
+    @property
+    def semantic_cache(self):
+        return get_provider("semantic_cache")
+
+    @property
+    def memory_index(self):
+        return get_provider("memory_index")
+
+    def _legs(self) -> ThreadPoolExecutor:
+        # Dimensionado só no primeiro uso, quando os pipelines de turnos (app, server.py) já existem
+        with self._leg_executor_lock:
+            if self._leg_executor is None:
+                workers = NEWS_LEG_WORKERS or 2 * (total_turn_workers() or MAX_TURN_WORKERS)
+                self._leg_executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dk-chat-leg")
+            return self._leg_executor
 
     def _should_use_deepseek(self, user_message: str) -> bool:
+        return self._news_class(user_message) is not None
+
+    def _news_class(self, user_message: str) -> str | None:
+        """Classe da regra de notícias que a mensagem aciona (define o TTL do cache), ou None."""
         if not DEEPSEEK_API_KEY:
-            return False
-        message_lower = user_message.lower()
-        for keyword in NEWS_KEYWORDS:
-            if keyword in message_lower:
-                return True
-        current_year = str(datetime.now().year)
-        if "?" in user_message and (current_year in message_lower or "ontem" in message_lower or "esta semana" in message_lower):
-            if any(kw in message_lower for kw in ["quando", "quem", "onde", "qual foi"]):
-                 return True
-        return False
+            return None
+        with stage("route"):
+            decision = self.router.route(user_message)
+        if decision.use_deepseek:
+            print(f"DK Chat: Roteado para DeepSeek pela regra '{decision.rule}' ('{decision.keyword}').")
+            return decision.news_class
+        return None
 
     def _query_deepseek(self, query: str) -> str:
-        # (Esta função permanece a mesma de antes)
-        if not DEEPSEEK_API_KEY:
-            return "Desculpe, não consigo buscar informações online no momento (API DeepSeek não configurada)."
-        headers = {
-            "Authorization": f"Bearer {DEEPSEEK_API_KEY}",
-            "Content-Type": "application/json"
-        }
-        payload = {
-            "model": "deepseek-chat",
-            "messages": [
-                {"role": "system", "content": "Você é um assistente prestativo que busca informações atualizadas na web sobre o seguinte tópico."},
-                {"role": "user", "content": query}
-            ]
-        }
+        return self._lookup_deepseek(query)[0]
+
+    def _lookup_deepseek(self, query: str, cancel_event: threading.Event = None) -> tuple[str, bool]:
+        """
+        Busca na DeepSeek; retorna (texto, sucesso). Falha na hora se o disjuntor estiver aberto.
+        A resposta é lida em streaming: se `cancel_event` for sinalizado (ex.: a perna perdeu para a
+        resposta direta), a requisição é fechada no trecho seguinte e a conexão volta ao pool.
+        """
         try:
-            response = requests.post(DEEPSEEK_API_URL, headers=headers, json=payload, timeout=20)
-            response.raise_for_status()
-            data = response.json()
-            if data.get("choices") and len(data["choices"]) > 0 and data["choices"][0].get("message"):
-                return data["choices"][0]["message"]["content"].strip()
-            return "Não consegui obter uma resposta da DeepSeek."
+            with stage("deepseek_lookup"):
+                chunks = []
+                stream = _recording(get_llm_provider("deepseek").stream_chat(
+                    query, system=SEARCH_SYSTEM_PROMPT, cancel_event=cancel_event), chunks)
+                try:
+                    while True:
+                        next(stream)
+                except StopIteration as stop:
+                    completed = bool(stop.value)
+                if not completed:
+                    return "Desculpe, não consegui obter informações online com DeepSeek.", False
+                return "".join(chunks).strip(), True
+        except ProviderUnavailable as e:
+            print(f"DK Chat: {e}")
+            return "Desculpe, não consigo buscar informações online no momento.", False
         except requests.exceptions.RequestException as e:
             print(f"Erro ao chamar a API DeepSeek: {e}")
-            return f"Desculpe, tive um problema ao tentar buscar informações online com DeepSeek: {e}"
+            return f"Desculpe, tive um problema ao tentar buscar informações online com DeepSeek: {e}", False
         except Exception as e:
             print(f"Erro inesperado ao processar resposta da DeepSeek: {e}")
-            return "Desculpe, ocorreu um erro inesperado ao processar a busca online com DeepSeek."
-
-    def _query_gemini(self, user_message: str, conversation_history: list[dict]) -> str:
-        if not self.gemini_model:
-            return "API do Gemini não está configurada ou falhou ao carregar. Usando resposta padrão."
-
-        # Formatar histórico para a API do Gemini
-        # A API espera uma lista de dicts: {'role': 'user'/'model', 'parts': [{'text': '...'}]}
-        # O histórico deve alternar entre 'user' e 'model'.
-        gemini_history = []
-        for msg in conversation_history:
-            role = "user" if msg["sender"] == "user" else "model"
-            gemini_history.append({"role": role, "parts": [{"text": msg["text"]}]})
-        
-        # Adiciona a mensagem atual do usuário ao final do histórico para o Gemini
-        # gemini_history.append({"role": "user", "parts": [{"text": user_message}]}) 
-        # A mensagem atual já estará no final de `gemini_history` se `conversation_history` incluir ela.
-        # Se `conversation_history` for o histórico *antes* da mensagem atual, então adicione-a.
-        # No nosso caso, ChatScreen já está salvando a mensagem do usuário e depois pegando o histórico todo.
-
-        # Opcional: Adicionar uma mensagem de sistema (prompt)
-        # system_instruction = "Você é o DK Chat, um assistente prestativo e amigável."
-        # Ou, para um chat contínuo, o histórico já serve como contexto.
+            return "Desculpe, ocorreu um erro inesperado ao processar a busca online com DeepSeek.", False
 
+    def _stream_chat(self, message: str, history: list[dict] = (), conversation: "ConversationState" = None,
+                     system: str | None = None, cancel_event: threading.Event = None,
+                     providers: list[LLMProvider] | None = None, report_errors: bool = True) -> Generator[str, None, bool]:
+        """
+        Transmite a resposta do primeiro provedor da cadeia (`provider_chain`) que puder atender.
+        Um provedor não configurado, com o disjuntor aberto ou sem cota é pulado na hora; se um
+        provedor falhar antes do primeiro trecho, o próximo é tentado. Sem nenhum provedor, emite
+        uma mensagem de erro (se `report_errors`). Retorna True se a resposta veio completa.
+        """
+        if conversation is not None:
+            with stage("context_prepare"):
+                self.context_window.prepare(conversation)
         try:
-            # Para conversas, é melhor iniciar uma sessão de chat
-            chat_session = self.gemini_model.start_chat(history=gemini_history)
-            response = chat_session.send_message(
-                user_message, # Envia apenas a nova mensagem, o histórico já está na sessão
-                # safety_settings={ # Opcional: Ajustar configurações de segurança
-                #    'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
-                #    'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE',
-                #    'HARM_CATEGORY_SEXUALLY_EXPLICIT': 'BLOCK_NONE',
-                #    'HARM_CATEGORY_DANGEROUS_CONTENT': 'BLOCK_NONE',
-                # }
-            )
+            last_error = None
+            for provider in providers if providers is not None else provider_chain():
+                chunks = []
+                try:
+                    return (yield from _recording(
+                        provider.stream_chat(message, history, conversation, system, cancel_event), chunks
+                    ))
+                except ProviderUnavailable as e:
+                    if provider.configured:
+                        print(f"DK Chat: {e}; tentando o próximo provedor.")
+                        event("provider_failover")
+                except Exception as e:
+                    print(f"Erro ao chamar a API {provider.name}: {e}")
+                    if chunks: # A resposta já começou a ser exibida; apenas sinaliza a interrupção
+                        yield f"\n\n(Resposta interrompida: {e})"
+                        return False
+                    event("provider_failover")
+                    last_error = (provider, e)
+            if report_errors:
+                yield self._unavailable_message(message, last_error)
+            return False
+        finally:
+            if conversation is not None:
+                # Depois do turno, fora do caminho da resposta; os próximos usam o resumo quando ficar pronto
+                self.context_window.schedule_summary(conversation)
+
+    def _complete(self, prompt: str, system: str | None = None) -> str | None:
+        """Resposta completa do primeiro provedor da cadeia que puder atender, ou None."""
+        for provider in provider_chain():
+            try:
+                return provider.complete(prompt, system=system) or None
+            except ProviderUnavailable:
+                continue
+            except Exception as e:
+                print(f"Erro ao chamar a API {provider.name}: {e}")
+        return None
 
-            if not response.candidates: # Resposta pode ter sido bloqueada
-                block_reason = response.prompt_feedback.block_reason if response.prompt_feedback else "Não especificado"
-                block_reason_message = response.prompt_feedback.block_reason_message if response.prompt_feedback else ""
-                print(f"Resposta do Gemini bloqueada. Razão: {block_reason} - {block_reason_message}")
-                for candidate in response.candidates: # Para debug, se houver candidatos mesmo com bloqueio
-                    print(f"  Candidato finish_reason: {candidate.finish_reason}, safety_ratings: {candidate.safety_ratings}")
-
-                return f"Minha resposta foi bloqueada pelas políticas de segurança (Razão: {block_reason}). Por favor, reformule sua pergunta ou tente um tópico diferente."
-            
-            # Para respostas de texto simples
-            if response.text:
-                return response.text
-            else: # Caso inesperado
-                return "Recebi uma resposta vazia do Gemini."
+    def _unavailable_message(self, user_message: str, last_error: tuple[LLMProvider, Exception] | None) -> str:
+        if last_error is not None:
+            provider, e = last_error
+            if provider.name == "gemini" and "API_KEY" in str(e).upper():
+                return "A chave da API do Gemini parece ser inválida ou está com problemas. Verifique suas configurações."
+            return f"Desculpe, tive um problema ao tentar me comunicar com o {provider.name.capitalize()}: {e}"
+        if any(provider.configured for provider in provider_chain()):
+            return "Os serviços de IA estão sobrecarregados ou indisponíveis no momento. Tente novamente em instantes."
+        # Fallback se nenhuma API estiver configurada
+        print("DK Chat: Nenhuma API de IA configurada. Usando respostas de fallback simples.")
+        if "olá" in user_message.lower() or "oi" in user_message.lower():
+            return "Olá! Como posso ajudar você hoje? (APIs não configuradas)"
+        return "Desculpe, minhas capacidades de IA não estão configuradas no momento."
 
-        except Exception as e:
-            print(f"Erro ao chamar a API Gemini: {e}")
-            # Adicionar tratamento para erros específicos de API Key se necessário
-            if "API_KEY" in str(e).upper():
-                 return "A chave da API do Gemini parece ser inválida ou está com problemas. Verifique suas configurações."
-            return f"Desculpe, tive um problema ao tentar me comunicar com o Gemini: {e}"
+    def _summarize_messages(self, previous_summary: str, messages: list[dict]) -> str | None:
+        """Atualiza o resumo contínuo da conversa com as mensagens que saíram da janela de contexto."""
+        transcript = "\n".join(
+            f"{'Usuário' if msg['sender'] == 'user' else 'DK Chat'}: {msg['text']}" for msg in messages
+        )
+        prompt = (
+            "Você mantém um resumo conciso de uma conversa entre um usuário e o assistente DK Chat.\n"
+            f"Resumo atual: {previous_summary or '(vazio)'}\n\n"
+            f"Novas mensagens:\n{transcript}\n\n"
+            "Reescreva o resumo incorporando as novas mensagens. Preserve fatos, preferências e "
+            "decisões do usuário; omita saudações e detalhes irrelevantes. Responda apenas com o resumo."
+        )
+        return self._complete(prompt)
 
-    def get_response(self, user_message: str, conversation_history: list[dict] = None) -> str:
+    def get_response(self, user_message: str, conversation_history: list[dict] = None, stream: bool = False,
+                     conversation: "ConversationState" = None) -> str | Iterator[str]:
         """
         Obtém uma resposta para a mensagem do usuário.
         `conversation_history` é uma lista de dicts: [{"sender": "user/dk_chat", "text": "..."}]
         A última mensagem em `conversation_history` é a mensagem atual do usuário.
+        Se `conversation` for informado, o histórico vem do estado em memória da sessão
+        e o chat do Gemini é reaproveitado entre os turnos.
+        Com `stream=True` retorna um iterador de trechos de texto, à medida que o modelo os gera;
+        caso contrário, retorna a resposta completa.
         """
+        if conversation is not None:
+            conversation_history = conversation.messages
         if conversation_history is None:
             conversation_history = []
 
-        if self._should_use_deepseek(user_message):
-            print("DK Chat: Usando DeepSeek para buscar informação complementar.")
-            deepseek_info = self._query_deepseek(user_message)
-            
-            # Agora, podemos passar essa informação para o Gemini contextualizar
-            if self.gemini_model:
-                print("DK Chat: Contextualizando informação do DeepSeek com Gemini.")
-                # Criar um prompt para o Gemini usar a informação do DeepSeek
-                prompt_with_context = (
-                    f"Com base na seguinte informação de busca: '{deepseek_info}'.\n\n"
-                    f"Responda à pergunta do usuário: '{user_message}'"
-                )
-                # Para esta chamada específica, não usamos o histórico de chat, apenas a info da busca.
-                # Ou, poderíamos adicionar a info da busca ao histórico antes de chamar Gemini.
-                # Vamos tentar uma chamada direta ao Gemini com o contexto da busca:
-                
-                # Formatando para Gemini: o histórico aqui será a informação de busca como contexto do modelo
-                # e a pergunta original do usuário.
-                contextual_history_for_gemini = [
-                    {"role": "user", "parts": [{"text": f"Contexto de busca: {deepseek_info}\n\nPergunta original: {user_message}"}]}
-                ]
-                # Ou uma forma mais "conversacional" para o Gemini:
-                # contextual_history_for_gemini = [
-                #    {"role": "model", "parts": [{"text": f"Ok, encontrei esta informação: {deepseek_info}"}]},
-                #    {"role": "user", "parts": [{"text": f"Baseado nisso, {user_message}"}]} # Requer que user_message seja uma pergunta sobre o contexto
-                # ]
-                # Simplesmente passar a info para o Gemini responder é mais direto:
+        if stream:
+            return self._traced(self._stream_response(user_message, conversation_history, conversation))
+        return self._get_full_response(user_message, conversation_history, conversation)
 
-                try:
-                    chat_session = self.gemini_model.start_chat(history=[]) # Sem histórico de chat para esta chamada específica
-                    response = chat_session.send_message(prompt_with_context)
-                    if response.text:
-                        return response.text
-                    else:
-                        return f"(Informação da busca: {deepseek_info})\n\nNão consegui contextualizar com Gemini. Tente perguntar diretamente."
-                except Exception as e:
-                    print(f"Erro ao contextualizar com Gemini: {e}")
-                    return f"(Informação da busca: {deepseek_info})\n\nOcorreu um erro ao tentar usar Gemini para contextualizar."
-            else: # Se Gemini não estiver configurado, retorna apenas a info do DeepSeek
-                return deepseek_info
-        
-        # Se não for usar DeepSeek, ou se Gemini for usado para contextualizar
-        elif self.gemini_model:
-            print("DK Chat: Usando Gemini para resposta geral.")
-            # O histórico completo (incluindo a última mensagem do usuário) é passado.
-            # Gemini _query_gemini espera o histórico completo e a última mensagem separada.
-            # Ajuste: passar o histórico *sem* a última mensagem, e a última mensagem separada.
-            
-            history_up_to_last_user_msg = []
-            if conversation_history and len(conversation_history) > 1: # Se houver mais que a msg atual do usuário
-                history_up_to_last_user_msg = conversation_history[:-1]
-
-            return self._query_gemini(user_message, history_up_to_last_user_msg)
-        
+    def _traced(self, stream: Iterator[str]) -> Iterator[str]:
+        """Mede a resposta como a etapa `get_response` e registra o primeiro trecho e o tamanho no trace do turno."""
+        trace = current_trace()
+        with stage("get_response"):
+            for chunk in stream:
+                if trace is not None:
+                    trace.mark_chunk(chunk)
+                yield chunk
+
+    def _stream_response(self, user_message: str, conversation_history: list[dict], conversation: "ConversationState" = None) -> Iterator[str]:
+        news_class = self._news_class(user_message)
+        set_route("geral" if news_class is None else f"noticias:{news_class}")
+        if news_class is not None:
+            yield from self._stream_news(user_message, news_class, conversation_history, conversation)
+            return
+        cached_answer = self._semantic_lookup(user_message)
+        if cached_answer is not None:
+            if conversation is not None:
+                self.semantic_cache.mark_served(conversation.session_id)
+            set_route("geral:semantic_cache")
+            yield cached_answer
+        elif conversation is not None:
+            system = self._memory_prompt(user_message, conversation.session_id)
+            yield from self._stream_chat(user_message, conversation=conversation, system=system)
         else:
-            # Fallback se nenhuma API estiver configurada
-            print("DK Chat: Nenhuma API de IA configurada. Usando respostas de fallback simples.")
-            if "olá" in user_message.lower() or "oi" in user_message.lower():
-                return "Olá! Como posso ajudar você hoje? (APIs não configuradas)"
-            return "Desculpe, minhas capacidades de IA não estão configuradas no momento."
\ No newline at end of file
+            yield from self._stream_chat(user_message, conversation_history[:-1])
+
+    def _memory_prompt(self, user_message: str, session_id: int) -> str | None:
+        """Instruções com os trechos de outras sessões relevantes para a mensagem, ou None."""
+        memory_index = self.memory_index
+        if memory_index is None:
+            return None
+        try:
+            with stage("memory_retrieval") as attrs:
+                snippets = memory_index.retrieve(user_message, exclude_session_id=session_id)
+                attrs["snippets"] = len(snippets)
+        except Exception as e:
+            print(f"DK Chat: Erro ao consultar a memória de longo prazo: {e}")
+            return None
+        if not snippets:
+            return None
+        event("memory_injected")
+        lines = [
+            f"- [{snippet['timestamp']:%d/%m/%Y}] {'Usuário' if snippet['sender'] == 'user' else 'DK Chat'}: {snippet['text']}"
+            for snippet in snippets
+        ]
+        return MEMORY_SYSTEM_PROMPT.format(snippets="\n".join(lines))
+
+    def _semantic_lookup(self, user_message: str) -> str | None:
+        semantic_cache = self.semantic_cache
+        if semantic_cache is None:
+            return None
+        try:
+            with stage("semantic_cache"):
+                answer = semantic_cache.lookup(user_message)
+        except Exception as e:
+            print(f"DK Chat: Erro ao consultar o cache semântico: {e}")
+            return None
+        event("semantic_cache_hit" if answer is not None else "semantic_cache_miss")
+        if answer is not None:
+            print("DK Chat: Resposta geral servida do cache semântico.")
+        return answer
+
+    def _stream_news(self, user_message: str, news_class: str, conversation_history: list[dict],
+                     conversation: "ConversationState" = None) -> Iterator[str]:
+        """
+        Turno de notícias. A busca na DeepSeek (seguida da contextualização por outro provedor) e
+        uma resposta direta, com o histórico, começam ao mesmo tempo. A resposta com busca vence se
+        começar a chegar dentro de NEWS_TURN_BUDGET; caso contrário, a resposta direta é usada e
+        marcada como não verificada. A perna perdedora é cancelada.
+        """
+        cache_key = normalize_query(user_message)
+        with stage("news_cache"):
+            cached_answer = self.news_cache.get(cache_key)
+        if cached_answer is not None:
+            print("DK Chat: Resposta de notícia servida do cache.")
+            event("news_cache_hit")
+            set_route(f"noticias:{news_class}:cache")
+            yield cached_answer
+            return
+        event("news_cache_miss")
+
+        history = [] if conversation is not None else conversation_history[:-1]
+        deepseek = get_llm_provider("deepseek")
+        if not deepseek.available(): # Disjuntor aberto: nem tenta a busca
+            print("DK Chat: Busca online indisponível no momento; respondendo sem busca.")
+            yield "(Resposta sem verificação online: a busca está indisponível no momento.)\n\n"
+            yield from self._stream_chat(user_message, history, conversation)
+            return
+
+        chunks = []
+        answerers = [provider for provider in provider_chain() if provider is not deepseek]
+        if not any(provider.available() for provider in answerers):
+            # Sem outro provedor, a resposta da DeepSeek é a resposta final e pode ser transmitida diretamente
+            print("DK Chat: Usando DeepSeek para buscar informação complementar (streaming).")
+            completed = yield from _recording(self.single_flight.stream(
+                f"search:{cache_key}",
+                lambda cancel_event: self._stream_chat(user_message, system=SEARCH_SYSTEM_PROMPT, cancel_event=cancel_event,
+                                                       providers=[deepseek]),
+            ), chunks)
+            if completed:
+                self.news_cache.put(cache_key, "".join(chunks), NEWS_CACHE_TTLS[news_class])
+            return
+
+        def shared_grounded_stream(cancel_event: threading.Event):
+            deepseek_info, found = self._lookup_deepseek(user_message, cancel_event)
+            if not found or cancel_event.is_set():
+                return False
+            prompt_with_context = (
+                f"Com base na seguinte informação de busca: '{deepseek_info}'.\n\n"
+                f"Responda à pergunta do usuário: '{user_message}'"
+            )
+            return (yield from self._stream_chat(prompt_with_context, cancel_event=cancel_event, report_errors=False))
+
+        def grounded_stream(cancel_event: threading.Event):
+            # Não depende do histórico: pode ser compartilhada por todas as sessões com a mesma pergunta
+            return (yield from self.single_flight.stream(f"grounded:{cache_key}", shared_grounded_stream, cancel_event))
+
+        def plain_stream(cancel_event: threading.Event):
+            return (yield from self._stream_chat(user_message, history, conversation, cancel_event=cancel_event))
+
+        print("DK Chat: Usando DeepSeek para buscar informação complementar (em paralelo com a resposta direta).")
+        grounded = _StreamLeg("busca DeepSeek + resposta", grounded_stream, self._legs())
+        plain = _StreamLeg("resposta direta", plain_stream, self._legs())
+
+        grounded.wait_first_chunk(NEWS_TURN_BUDGET)
+        if grounded.has_content:
+            winner, loser = grounded, plain
+            event("news_grounded")
+        else:
+            winner, loser = plain, grounded
+            event("news_unverified")
+            if grounded.finished_at is not None:
+                print("DK Chat: A busca online falhou; usando a resposta direta.")
+                yield "(Resposta sem verificação online: a busca falhou.)\n\n"
+            else:
+                print("DK Chat: A busca online não respondeu dentro do orçamento; usando a resposta direta.")
+                yield "(Resposta sem verificação online: a busca não respondeu a tempo.)\n\n"
+        loser.cancel()
+        if loser is plain and conversation is not None:
+            # O chat vivo pode ter recebido a resposta direta, que não será a resposta salva
+            conversation.invalidate_gemini_chat()
+
+        try:
+            yield from _recording(winner.chunks(), chunks)
+        finally:
+            winner.cancel() # Sem efeito se já terminou; interrompe a perna se o turno for cancelado
+            print(f"DK Chat: Tempos do turno de notícias: {grounded.describe()}; {plain.describe()}.")
+
+        # Só respostas com busca, completas e bem-sucedidas vão para o cache
+        if winner is grounded and grounded.completed:
+            self.news_cache.put(cache_key, "".join(chunks), NEWS_CACHE_TTLS[news_class])
+
+    def _get_full_response(self, user_message: str, conversation_history: list[dict], conversation: "ConversationState" = None) -> str:
+        # Mesmo fluxo da versão em streaming (provedores com failover, cache e busca em paralelo)
+        return "".join(self._traced(self._stream_response(user_message, conversation_history, conversation)))
+
+register_provider("chat_logic", DKChatLogic)
+
+def get_chat_logic() -> DKChatLogic:
+    """Instância de DKChatLogic compartilhada por todas as páginas e sessões."""
+    return get_provider("chat_logic")
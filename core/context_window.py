@@ -0,0 +1,117 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .conversation import ConversationState
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("DK_CHAT_CONTEXT_TOKEN_BUDGET", "8000"))
+CONTEXT_KEEP_LAST_TURNS = int(os.getenv("DK_CHAT_CONTEXT_KEEP_LAST_TURNS", "6"))
+# Turnos extras tolerados antes de resumir; resumir em lotes evita recriar o chat do Gemini a cada turno
+CONTEXT_SUMMARY_BATCH_TURNS = int(os.getenv("DK_CHAT_CONTEXT_SUMMARY_BATCH_TURNS", "4"))
+# Threads que atualizam os resumos depois dos turnos (fora do caminho da resposta)
+CONTEXT_SUMMARY_WORKERS = int(os.getenv("DK_CHAT_CONTEXT_SUMMARY_WORKERS", "2"))
+
+
+def estimate_tokens(text: str) -> int:
+    # Aproximação local (~4 caracteres por token): boa o bastante para orçamento e sem chamar a API
+    return (len(text) + 3) // 4
+
+
+class ContextWindowManager:
+    """
+    Limita o contexto enviado ao Gemini: mantém os últimos turnos na íntegra e substitui
+    os mais antigos por um resumo contínuo, persistido por sessão e atualizado de forma
+    incremental (resumo anterior + mensagens que acabaram de sair da janela), em segundo plano.
+    `summarizer(resumo_anterior, mensagens)` deve retornar o novo resumo, ou None em caso de falha.
+    """
+    def __init__(
+        self,
+        summarizer: Callable[[str, list[dict]], str | None],
+        token_budget: int = CONTEXT_TOKEN_BUDGET,
+        keep_last_turns: int = CONTEXT_KEEP_LAST_TURNS,
+        summary_batch_turns: int = CONTEXT_SUMMARY_BATCH_TURNS,
+    ):
+        self.summarizer = summarizer
+        self.token_budget = token_budget
+        self.keep_last_messages = keep_last_turns * 2
+        self.summary_batch_messages = summary_batch_turns * 2
+        self._executor: ThreadPoolExecutor | None = None  # Criado no primeiro resumo
+        self._pending: set[int] = set()  # Sessões com um resumo em andamento
+        self._pending_lock = threading.Lock()
+
+    def prepare(self, conversation: "ConversationState"):
+        """
+        Chamado antes de cada turno (a última mensagem é a do usuário). Não chama o modelo: o
+        turno usa o resumo que já existe, e a atualização do resumo fica para depois do turno
+        (`schedule_summary`). Só registra o tamanho do contexto.
+        """
+        with conversation.lock:
+            prior = len(conversation.messages) - 1
+            if prior < 0:
+                return
+            current_tokens = estimate_tokens(conversation.messages[-1]["text"])
+            tokens_before = conversation.tokens_between(0, prior)
+            tokens_after = estimate_tokens(conversation.summary) + conversation.tokens_between(conversation.summary_covers, prior)
+            print(
+                f"DK Chat: Contexto da sessão {conversation.session_id}: ~{tokens_before + current_tokens} tokens antes, "
+                f"~{tokens_after + current_tokens} depois do corte ({prior - conversation.summary_covers} mensagens na íntegra)."
+            )
+
+    def schedule_summary(self, conversation: "ConversationState"):
+        """
+        Chamado ao fim de cada turno: se a janela passou do limite de turnos ou do orçamento de
+        tokens, incorpora as mensagens mais antigas ao resumo da sessão em segundo plano. Uma
+        atualização por sessão de cada vez; até ela terminar, os turnos usam o resumo anterior.
+        """
+        with self._pending_lock:
+            if conversation.session_id in self._pending:
+                return
+            self._pending.add(conversation.session_id)
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=CONTEXT_SUMMARY_WORKERS, thread_name_prefix="dk-chat-summary")
+        self._executor.submit(self._update_summary, conversation)
+
+    def _update_summary(self, conversation: "ConversationState"):
+        try:
+            self._summarize_window(conversation)
+        except Exception as e:
+            print(f"DK Chat: Erro ao atualizar o resumo da sessão {conversation.session_id}: {e}")
+        finally:
+            with self._pending_lock:
+                self._pending.discard(conversation.session_id)
+
+    def _summarize_window(self, conversation: "ConversationState"):
+        # O resumo é uma chamada ao modelo: roda fora do lock da conversa, sobre uma cópia das
+        # mensagens, e só é aplicado se ninguém mudou o resumo (ou limpou a conversa) nesse meio-tempo
+        with conversation.lock:
+            messages = conversation.messages
+            end = len(messages)
+            start = conversation.summary_covers
+            generation = conversation.generation
+            previous_summary = conversation.summary
+            window_budget = self.token_budget - estimate_tokens(previous_summary)
+            over_turns = end - start > self.keep_last_messages + self.summary_batch_messages
+            over_budget = conversation.tokens_between(start, end) > window_budget
+            if not (over_turns or over_budget):
+                return
+            new_start = max(start, end - self.keep_last_messages)
+            while new_start < end and conversation.tokens_between(new_start, end) > window_budget:
+                new_start += 1
+            # A janela deve começar em uma mensagem do usuário para manter a alternância user/model
+            while new_start < end and messages[new_start]["sender"] != "user":
+                new_start += 1
+            if new_start <= start:
+                return
+            to_summarize = messages[start:new_start]
+
+        new_summary = self.summarizer(previous_summary, to_summarize)
+        if not new_summary:
+            print(f"DK Chat: Não foi possível atualizar o resumo da sessão {conversation.session_id}; mantendo o histórico completo.")
+            return
+        with conversation.lock:
+            if conversation.generation == generation and conversation.summary_covers == start:
+                conversation.update_summary(new_summary, new_start)
+            else:
+                print(f"DK Chat: Resumo da sessão {conversation.session_id} descartado (a conversa mudou durante o resumo).")
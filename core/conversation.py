@@ -0,0 +1,193 @@
+import os
+import threading
+from collections import OrderedDict
+from .context_window import estimate_tokens
+from .db_manager import (
+    get_db, get_message_rows_for_session, get_session_summary, save_session_summary,
+    add_message_saved_listener, add_history_cleared_listener, add_session_removed_listener
+)
+from .models import ChatMessage
+
+
+class ConversationState:
+    """
+    Estado em memória de uma sessão de chat.
+    Carregado do banco uma única vez e mantido só por acréscimo à medida que as mensagens
+    são gravadas por `db_manager.save_message`. Também guarda um `ChatSession` do Gemini
+    vivo, reaproveitado entre os turnos e reconstruído apenas após uma limpeza, um erro
+    ou uma atualização do resumo das mensagens antigas (`summary`).
+    """
+    def __init__(self, session_id: int):
+        self.session_id = session_id
+        self.lock = threading.RLock()
+        self.messages: list[dict] = []
+        self._last_message_id = 0
+        # Somas acumuladas da estimativa de tokens: _token_prefix[i] = tokens de messages[:i]
+        self._token_prefix = [0]
+        # Resumo das mensagens antigas; messages[:summary_covers] estão representadas só por ele
+        self.summary = ""
+        self.summary_covers = 0
+        # Incrementado a cada limpeza: quem trabalha fora do lock (ex.: o resumo) detecta que a conversa mudou
+        self.generation = 0
+        self._gemini_chat = None
+        # Quantas mensagens de `messages` já estão refletidas no histórico do chat do Gemini
+        self._gemini_synced = 0
+        # Sinalizado quando `load` termina (com ou sem erro); `load_error` guarda a falha
+        self.loaded = threading.Event()
+        self.load_error: BaseException | None = None
+
+    def load(self):
+        with self.lock:
+            generation = self.generation
+        with get_db() as db:
+            rows = get_message_rows_for_session(db, self.session_id)
+            db_summary = get_session_summary(db, self.session_id)
+        with self.lock:
+            if generation != self.generation:  # Histórico limpo durante a leitura
+                return
+            # Mensagens gravadas durante a leitura podem já ter chegado por `append_message`
+            pending = self.messages
+            self.messages = []
+            self._token_prefix = [0]
+            self._last_message_id = 0
+            for row in rows:
+                self._append(row.id, row.sender, row.text, row.timestamp)
+            for msg in pending:
+                self._append(msg["id"], msg["sender"], msg["text"], msg["timestamp"])
+            if db_summary is not None and db_summary.summary:
+                self.summary = db_summary.summary
+                self.summary_covers = sum(1 for msg in self.messages if msg["id"] <= db_summary.covered_until_message_id)
+
+    def _append(self, message_id: int, sender: str, text: str, timestamp):
+        # Ignora mensagens já vistas (ex.: gravadas durante o carregamento inicial)
+        if message_id <= self._last_message_id:
+            return
+        self._last_message_id = message_id
+        self.messages.append({"id": message_id, "sender": sender, "text": text, "timestamp": timestamp})
+        self._token_prefix.append(self._token_prefix[-1] + estimate_tokens(text))
+
+    def tokens_between(self, start: int, end: int) -> int:
+        """Estimativa de tokens de messages[start:end], em O(1)."""
+        return self._token_prefix[end] - self._token_prefix[start]
+
+    def append_message(self, message: ChatMessage):
+        with self.lock:
+            self._append(message.id, message.sender, message.text, message.timestamp)
+
+    def reset(self):
+        with self.lock:
+            self.messages.clear()
+            self._token_prefix = [0]
+            # O SQLite pode reaproveitar ids depois de uma exclusão
+            self._last_message_id = 0
+            self.summary = ""
+            self.summary_covers = 0
+            self.generation += 1
+            self.invalidate_gemini_chat()
+
+    def update_summary(self, summary: str, covers: int):
+        """Persiste o novo resumo, que passa a representar messages[:covers]."""
+        with self.lock:
+            with get_db() as db:
+                save_session_summary(db, self.session_id, summary, self.messages[covers - 1]["id"])
+            self.summary = summary
+            self.summary_covers = covers
+            self.invalidate_gemini_chat()
+
+    def context_messages(self) -> list[dict]:
+        """
+        Histórico a enviar ao modelo no turno atual (a última mensagem é a do usuário e fica de fora):
+        o resumo das mensagens antigas, como um par de mensagens, seguido da janela de contexto.
+        """
+        with self.lock:
+            prior_count = max(0, len(self.messages) - 1)
+            history = self.messages[self.summary_covers:prior_count]
+            if self.summary:
+                history = [
+                    {"sender": "user", "text": f"Resumo da nossa conversa até aqui: {self.summary}"},
+                    {"sender": "dk_chat", "text": "Entendido, vou considerar esse contexto."},
+                ] + history
+            return history
+
+    def get_gemini_chat(self, gemini_model, to_gemini_history):
+        """
+        Retorna o chat do Gemini para o turno atual (a última mensagem é a do usuário).
+        O chat só é recriado se não existir ou se estiver fora de sincronia com `messages`
+        (por exemplo, depois de um turno respondido pela DeepSeek).
+        """
+        with self.lock:
+            prior_count = max(0, len(self.messages) - 1)
+            if self._gemini_chat is None or self._gemini_synced != prior_count:
+                self._gemini_chat = gemini_model.start_chat(history=to_gemini_history(self.context_messages()))
+                self._gemini_synced = prior_count
+            return self._gemini_chat
+
+    def commit_gemini_turn(self):
+        # O chat do Gemini agora contém a mensagem do usuário e a resposta do modelo
+        with self.lock:
+            self._gemini_synced += 2
+
+    def invalidate_gemini_chat(self):
+        with self.lock:
+            self._gemini_chat = None
+            self._gemini_synced = 0
+
+
+# Conversas mantidas em memória (as usadas mais recentemente); cada uma guarda todas as mensagens,
+# as somas de tokens e um chat do Gemini vivo. Uma conversa descartada é recarregada do banco.
+CONVERSATION_CACHE_SESSIONS = int(os.getenv("DK_CHAT_CONVERSATION_CACHE_SESSIONS", "256"))
+
+_states: OrderedDict[int, ConversationState] = OrderedDict()
+_states_lock = threading.Lock()
+
+def get_conversation_state(session_id: int) -> ConversationState:
+    # O estado entra no cache antes de ser carregado: a leitura do banco acontece fora de _states_lock
+    # (sem travar as outras sessões nem o listener de gravação) e quem pedir a mesma sessão espera por ela
+    while True:
+        with _states_lock:
+            state = _states.get(session_id)
+            loader = state is None
+            if loader:
+                state = _states[session_id] = ConversationState(session_id)
+                while len(_states) > CONVERSATION_CACHE_SESSIONS:
+                    _states.popitem(last=False)
+            else:
+                _states.move_to_end(session_id)
+        if loader:
+            try:
+                state.load()
+            except BaseException as e:
+                state.load_error = e
+                with _states_lock:
+                    if _states.get(session_id) is state:
+                        del _states[session_id]
+                raise
+            finally:
+                state.loaded.set()
+            return state
+        state.loaded.wait()
+        if state.load_error is None:
+            return state
+        # O carregamento falhou e o estado saiu do cache: tenta de novo
+
+def _on_message_saved(message: ChatMessage):
+    with _states_lock:
+        state = _states.get(message.session_id)
+        if state is not None:
+            _states.move_to_end(message.session_id)
+    if state is not None:
+        state.append_message(message)
+
+def _on_history_cleared(session_id: int):
+    with _states_lock:
+        state = _states.get(session_id)
+    if state is not None:
+        state.reset()
+
+def _on_session_removed(session_id: int):
+    with _states_lock:
+        _states.pop(session_id, None)
+
+add_message_saved_listener(_on_message_saved)
+add_history_cleared_listener(_on_history_cleared)
+add_session_removed_listener(_on_session_removed)
@@ -1,13 +1,49 @@
+import re
+from sqlalchemy import tuple_, text, update, func, DateTime, Float
 from sqlalchemy.orm import Session
-from .models import ChatMessage, ChatSession, SessionLocal, create_db_and_tables
+from .models import (
+    ChatMessage, ChatSession, ChatSessionSummary, NewsCacheEntry, SessionLocal, ensure_db_ready, FTS_TABLE,
+    SESSION_TITLE_LENGTH, SESSION_PREVIEW_LENGTH,
+)
 from datetime import datetime
 from contextlib import contextmanager # ADICIONADO
+from typing import Callable
+from .tracing import stage
+from .archive import (
+    delete_archive, get_archived_messages, page_archived_messages, restore_session,
+)
 
-# Garante que as tabelas sejam criadas quando este módulo for importado pela primeira vez
-create_db_and_tables()
+# Observadores notificados após cada gravação/limpeza (ex.: estado em memória das conversas)
+_message_saved_listeners: list[Callable[[ChatMessage], None]] = []
+_history_cleared_listeners: list[Callable[[int], None]] = []
+_session_removed_listeners: list[Callable[[int], None]] = []
+
+def add_message_saved_listener(listener: Callable[[ChatMessage], None]):
+    _message_saved_listeners.append(listener)
+
+def add_history_cleared_listener(listener: Callable[[int], None]):
+    _history_cleared_listeners.append(listener)
+
+def add_session_removed_listener(listener: Callable[[int], None]):
+    # Sessão excluída ou arquivada: estados em memória dela podem ser descartados
+    _session_removed_listeners.append(listener)
+
+def notify_message_saved(message: ChatMessage):
+    for listener in _message_saved_listeners:
+        listener(message)
+
+def _notify_history_cleared(session_id: int):
+    for listener in _history_cleared_listeners:
+        listener(session_id)
+
+def notify_session_removed(session_id: int):
+    for listener in _session_removed_listeners:
+        listener(session_id)
 
 @contextmanager # ADICIONADO
 def get_db():
+    # O esquema é verificado no primeiro uso (e não na importação), para não atrasar a abertura do app
+    ensure_db_ready()
     db = SessionLocal()
     try:
         yield db
@@ -15,32 +51,201 @@ def get_db():
         db.close()
 
 def create_chat_session(db: Session) -> ChatSession:
-    db_session = ChatSession(start_time=datetime.utcnow())
+    now = datetime.utcnow()
+    db_session = ChatSession(start_time=now, last_activity=now, message_count=0)
     db.add(db_session)
     db.commit()
     db.refresh(db_session)
     return db_session
 
+def _single_line(text: str, length: int) -> str:
+    return " ".join(text.split())[:length]
+
+def session_stats_update(session_id: int, messages: list[tuple[str, str, datetime]]):
+    """
+    UPDATE incremental das estatísticas de ChatSession para mensagens novas da sessão,
+    dadas em ordem como (sender, text, timestamp). Serve tanto para `save_message` quanto
+    para os lotes do gravador em segundo plano (core.write_behind).
+    """
+    _, last_text, last_timestamp = messages[-1]
+    values = {
+        "message_count": ChatSession.message_count + len(messages),
+        "last_activity": last_timestamp,
+        "preview": _single_line(last_text, SESSION_PREVIEW_LENGTH),
+    }
+    first_user_text = next((text for sender, text, _ in messages if sender == "user"), None)
+    if first_user_text is not None:
+        values["title"] = func.coalesce(ChatSession.title, _single_line(first_user_text, SESSION_TITLE_LENGTH))
+    return update(ChatSession).where(ChatSession.id == session_id).values(**values).execution_options(
+        synchronize_session=False
+    )
+
+def get_chat_session(db: Session, session_id: int) -> ChatSession | None:
+    return db.get(ChatSession, session_id)
+
+def get_message_text(db: Session, message_id: int, session_id: int | None = None) -> str | None:
+    """
+    Texto da mensagem. Com `session_id`, confere a sessão (ids de mensagens apagadas ou arquivadas
+    podem ser reaproveitados) e procura também nas sessões arquivadas.
+    """
+    query = db.query(ChatMessage.text).filter(ChatMessage.id == message_id)
+    if session_id is None:
+        return query.scalar()
+    text_ = query.filter(ChatMessage.session_id == session_id).scalar()
+    if text_ is None:
+        archived = get_archived_messages(db, session_id)
+        text_ = next((message.text for message in archived or () if message.id == message_id), None)
+    return text_
+
 def save_message(db: Session, session_id: int, sender: str, text: str):
-    db_message = ChatMessage(session_id=session_id, sender=sender, text=text)
-    db.add(db_message)
-    db.commit()
-    db.refresh(db_message)
+    # O id vem do próprio INSERT e, com expire_on_commit=False, não é preciso um refresh (SELECT extra)
+    db_message = ChatMessage(session_id=session_id, sender=sender, text=text, timestamp=datetime.utcnow())
+    with stage("db_save_message"):
+        restore_session(db, session_id)  # Conversa arquivada voltando a ser usada
+        db.add(db_message)
+        db.execute(session_stats_update(session_id, [(sender, text, db_message.timestamp)]))
+        db.commit()
+    notify_message_saved(db_message)
     return db_message
 
+# As leituras abaixo consultam o arquivo (core.archive) só quando a sessão não tem mensagens em
+# chat_messages: uma sessão arquivada não tem nenhuma, e gravar nela a restaura por inteiro.
+
 def get_messages_for_session(db: Session, session_id: int):
-    return db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(ChatMessage.timestamp).all()
+    messages = db.query(ChatMessage).filter(ChatMessage.session_id == session_id).order_by(ChatMessage.timestamp).all()
+    if not messages:
+        messages = [
+            ChatMessage(id=row.id, session_id=session_id, sender=row.sender, text=row.text, timestamp=row.timestamp)
+            for row in get_archived_messages(db, session_id) or ()
+        ]
+    return messages
+
+def get_message_rows_for_session(db: Session, session_id: int):
+    # Apenas as colunas necessárias, sem materializar objetos ORM
+    rows = db.query(ChatMessage.id, ChatMessage.sender, ChatMessage.text, ChatMessage.timestamp).filter(
+        ChatMessage.session_id == session_id
+    ).order_by(ChatMessage.timestamp).all()
+    return rows or get_archived_messages(db, session_id) or []
+
+def get_messages_page(db: Session, session_id: int, before: tuple[datetime, int] | None = None,
+                      after: tuple[datetime, int] | None = None, limit: int = 50):
+    """
+    Uma página de mensagens da sessão em ordem cronológica, por paginação keyset em
+    (timestamp, id): `before` traz as `limit` mensagens imediatamente anteriores à chave
+    (ou as mais recentes, se nenhuma chave for dada); `after`, as imediatamente posteriores.
+    """
+    query = db.query(ChatMessage.id, ChatMessage.sender, ChatMessage.text, ChatMessage.timestamp).filter(
+        ChatMessage.session_id == session_id
+    )
+    if after is not None:
+        rows = query.filter(tuple_(ChatMessage.timestamp, ChatMessage.id) > tuple_(*after)).order_by(
+            ChatMessage.timestamp, ChatMessage.id
+        ).limit(limit).all()
+    else:
+        if before is not None:
+            query = query.filter(tuple_(ChatMessage.timestamp, ChatMessage.id) < tuple_(*before))
+        rows = query.order_by(ChatMessage.timestamp.desc(), ChatMessage.id.desc()).limit(limit).all()
+        rows.reverse()
+    if not rows:
+        archived = get_archived_messages(db, session_id)
+        if archived:
+            return page_archived_messages(archived, before, after, limit)
+    return rows
+
+_SEARCH_TERM_RE = re.compile(r"\w+")
+
+def _fts_query(query: str) -> str | None:
+    # Cada palavra vira um termo entre aspas (sem operadores do FTS5 vindos do usuário),
+    # com busca por prefixo; todos os termos precisam aparecer
+    terms = _SEARCH_TERM_RE.findall(query)
+    return " ".join(f'"{term}"*' for term in terms) or None
+
+def search_messages(db: Session, query: str, session_id: int | None = None, limit: int = 20, offset: int = 0,
+                    highlight: tuple[str, str] = ("«", "»")):
+    """
+    Busca textual (FTS5) no histórico, ignorando acentos e maiúsculas. Retorna linhas com
+    id, session_id, sender, timestamp, snippet (trecho com os termos destacados) e score,
+    das mais relevantes (bm25) para as menos.
+    """
+    fts_query = _fts_query(query)
+    if fts_query is None:
+        return []
+    session_filter = "AND m.session_id = :session_id" if session_id is not None else ""
+    statement = text(f"""
+        SELECT m.id, m.session_id, m.sender, m.timestamp,
+               snippet({FTS_TABLE}, 0, :open, :close, '…', 12) AS snippet,
+               bm25({FTS_TABLE}) AS score
+        FROM {FTS_TABLE} JOIN chat_messages AS m ON m.id = {FTS_TABLE}.rowid
+        WHERE {FTS_TABLE} MATCH :query {session_filter}
+        ORDER BY score
+        LIMIT :limit OFFSET :offset
+    """).columns(timestamp=DateTime, score=Float)
+    params = {"query": fts_query, "open": highlight[0], "close": highlight[1], "limit": limit, "offset": offset}
+    if session_id is not None:
+        params["session_id"] = session_id
+    return db.execute(statement, params).all()
+
+def get_sessions_page(db: Session, before: tuple[datetime, int] | None = None, limit: int = 30):
+    """
+    Conversas com mensagens, da atividade mais recente para a mais antiga, por paginação
+    keyset em (last_activity, id). Lê só as colunas denormalizadas de ChatSession.
+    """
+    query = db.query(
+        ChatSession.id, ChatSession.title, ChatSession.message_count, ChatSession.last_activity, ChatSession.preview
+    ).filter(ChatSession.message_count > 0)
+    if before is not None:
+        query = query.filter(tuple_(ChatSession.last_activity, ChatSession.id) < tuple_(*before))
+    return query.order_by(ChatSession.last_activity.desc(), ChatSession.id.desc()).limit(limit).all()
 
 def get_last_session(db: Session) -> ChatSession | None:
     return db.query(ChatSession).order_by(ChatSession.start_time.desc()).first()
 
+def get_session_summary(db: Session, session_id: int) -> ChatSessionSummary | None:
+    return db.get(ChatSessionSummary, session_id)
+
+def save_session_summary(db: Session, session_id: int, summary: str, covered_until_message_id: int) -> ChatSessionSummary:
+    db_summary = db.get(ChatSessionSummary, session_id)
+    if db_summary is None:
+        db_summary = ChatSessionSummary(session_id=session_id)
+        db.add(db_summary)
+    db_summary.summary = summary
+    db_summary.covered_until_message_id = covered_until_message_id
+    db.commit()
+    return db_summary
+
+def get_news_cache_entry(db: Session, key: str) -> NewsCacheEntry | None:
+    return db.get(NewsCacheEntry, key)
+
+def save_news_cache_entry(db: Session, key: str, answer: str, expires_at: datetime):
+    db.merge(NewsCacheEntry(key=key, answer=answer, expires_at=expires_at))
+    db.commit()
+
+def delete_news_cache_entry(db: Session, key: str):
+    db.query(NewsCacheEntry).filter(NewsCacheEntry.key == key).delete()
+    db.commit()
+
+def purge_expired_news_cache(db: Session) -> int:
+    deleted = db.query(NewsCacheEntry).filter(NewsCacheEntry.expires_at <= datetime.utcnow()).delete()
+    db.commit()
+    return deleted
+
 def clear_chat_history_for_session(db: Session, session_id: int):
     db.query(ChatMessage).filter(ChatMessage.session_id == session_id).delete()
+    delete_archive(db, session_id)
+    db.query(ChatSessionSummary).filter(ChatSessionSummary.session_id == session_id).delete()
+    db.execute(update(ChatSession).where(ChatSession.id == session_id).values(
+        message_count=0, title=None, preview=None, last_activity=datetime.utcnow(),
+    ).execution_options(synchronize_session=False))
     db.commit()
+    _notify_history_cleared(session_id)
 
 def delete_session_and_messages(db: Session, session_id: int):
     # Primeiro, exclui as mensagens associadas
     db.query(ChatMessage).filter(ChatMessage.session_id == session_id).delete(synchronize_session=False)
+    db.query(ChatSessionSummary).filter(ChatSessionSummary.session_id == session_id).delete(synchronize_session=False)
+    delete_archive(db, session_id)
     # Depois, exclui a sessão
     db.query(ChatSession).filter(ChatSession.id == session_id).delete(synchronize_session=False)
-    db.commit()
\ No newline at end of file
+    db.commit()
+    _notify_history_cleared(session_id)
+    notify_session_removed(session_id)
\ No newline at end of file
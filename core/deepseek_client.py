@@ -0,0 +1,155 @@
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .tracing import event
+
+DEEPSEEK_POOL_SIZE = int(os.getenv("DEEPSEEK_POOL_SIZE", "10"))
+DEEPSEEK_CONNECT_TIMEOUT = float(os.getenv("DEEPSEEK_CONNECT_TIMEOUT", "5"))
+DEEPSEEK_READ_TIMEOUT = float(os.getenv("DEEPSEEK_READ_TIMEOUT", "20"))
+DEEPSEEK_MAX_RETRIES = int(os.getenv("DEEPSEEK_MAX_RETRIES", "3"))
+
+# Status que valem uma nova tentativa: limite de taxa e falhas transitórias do servidor
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+class _PoolStatsAdapter(HTTPAdapter):
+    """HTTPAdapter que expõe as estatísticas dos pools de conexão do urllib3."""
+
+    def pool_stats(self) -> tuple[int, int]:
+        """Retorna (requisições, conexões abertas) somando todos os pools ativos."""
+        pools = self.poolmanager.pools
+        num_requests = num_connections = 0
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is not None:
+                num_requests += pool.num_requests
+                num_connections += pool.num_connections
+        return num_requests, num_connections
+
+
+class DeepSeekClient:
+    """
+    Cliente HTTP da API DeepSeek com conexões keep-alive reaproveitadas (pool),
+    timeouts separados de conexão/leitura e novas tentativas com backoff exponencial
+    (com jitter) que respeitam o cabeçalho `Retry-After`.
+    """
+    def __init__(
+        self,
+        api_key: str,
+        api_url: str,
+        pool_size: int = DEEPSEEK_POOL_SIZE,
+        connect_timeout: float = DEEPSEEK_CONNECT_TIMEOUT,
+        read_timeout: float = DEEPSEEK_READ_TIMEOUT,
+        max_retries: int = DEEPSEEK_MAX_RETRIES,
+        backoff_base: float = 0.5,
+        backoff_max: float = 8.0,
+    ):
+        self.api_url = api_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._adapter = _PoolStatsAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.session = requests.Session()
+        self.session.mount("https://", self._adapter)
+        self.session.mount("http://", self._adapter)
+        self.session.headers.update({
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json",
+        })
+
+        self._stats_lock = threading.Lock()
+        self.retries = 0
+
+    def post_chat(self, payload: dict, stream: bool = False, cancel_event: threading.Event | None = None) -> requests.Response:
+        """
+        Envia `payload` para o endpoint de chat, repetindo em caso de erro de conexão,
+        timeout ou status 429/5xx. Levanta `requests.exceptions.RequestException` se
+        todas as tentativas falharem. Com `stream=True`, o chamador deve fechar a resposta.
+        Se `cancel_event` for sinalizado, não há novas tentativas.
+        """
+        attempt = 0
+        while True:
+            try:
+                response = self.session.post(self.api_url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self._backoff_delay(attempt)
+                print(f"DK Chat: Falha de conexão com a DeepSeek ({e}). Nova tentativa em {delay:.2f}s.")
+            else:
+                if response.status_code not in RETRYABLE_STATUS or attempt >= self.max_retries:
+                    response.raise_for_status()
+                    return response
+                delay = self._backoff_delay(attempt, response.headers.get("Retry-After"))
+                print(f"DK Chat: DeepSeek respondeu {response.status_code}. Nova tentativa em {delay:.2f}s.")
+                response.close()
+
+            if cancel_event is not None and cancel_event.wait(delay):
+                raise requests.exceptions.RequestException("Requisição cancelada.")
+            elif cancel_event is None:
+                time.sleep(delay)
+            with self._stats_lock:
+                self.retries += 1
+            event("deepseek_retry")
+            attempt += 1
+
+    def _backoff_delay(self, attempt: int, retry_after: str | None = None) -> float:
+        # "Full jitter": espera aleatória entre 0 e o limite exponencial da tentativa
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+        server_delay = self._parse_retry_after(retry_after)
+        if server_delay is not None:
+            delay = max(delay, min(server_delay, self.backoff_max * 4))
+        return delay
+
+    @staticmethod
+    def _parse_retry_after(value: str | None) -> float | None:
+        # Retry-After pode vir em segundos ou como data HTTP
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(value)
+        except (TypeError, ValueError):
+            return None
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+    def warm_up(self) -> bool:
+        """
+        Abre uma conexão (DNS + TCP + TLS) com o servidor da API e a deixa no pool,
+        para que a primeira consulta real não pague o handshake. Falhas são ignoradas.
+        """
+        parts = urlsplit(self.api_url)
+        try:
+            self.session.head(f"{parts.scheme}://{parts.netloc}/", timeout=self.timeout).close()
+            return True
+        except requests.exceptions.RequestException as e:
+            print(f"DK Chat: Não foi possível pré-conectar à DeepSeek: {e}")
+            return False
+
+    def stats(self) -> dict:
+        """Conexões novas x reaproveitadas e número de novas tentativas."""
+        num_requests, num_connections = self._adapter.pool_stats()
+        return {
+            "requests": num_requests,
+            "new_connections": num_connections,
+            "reused_connections": max(0, num_requests - num_connections),
+            "retries": self.retries,
+        }
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,524 @@
+"""
+Provedores de modelo de linguagem (Gemini, DeepSeek e um provedor local de eco para testes).
+
+Todo acesso às APIs passa por `LLMProvider`, que aplica, por provedor:
+- limite de taxa em balde de fichas (requisições e tokens por minuto);
+- limite de chamadas simultâneas (semáforo);
+- disjuntor (circuit breaker): depois de falhas seguidas, o provedor é pulado na hora
+  (`ProviderUnavailable`) até o fim do período de espera, quando uma única chamada de teste é liberada.
+A cadeia de provedores (`provider_chain`, ordem em DK_CHAT_PROVIDER_ORDER) é usada por
+`DKChatLogic` para passar ao próximo provedor quando um deles não pode atender.
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Generator, Iterator, TYPE_CHECKING
+
+from .context_window import estimate_tokens
+from .registry import get_provider, get_provider_registry, register_provider
+from .tracing import event, record_stage
+
+if TYPE_CHECKING:
+    from .conversation import ConversationState
+
+GEMINI_REQUEST_TIMEOUT = float(os.getenv("GEMINI_REQUEST_TIMEOUT", "60"))
+
+# Ordem em que os provedores são tentados nas respostas gerais ("echo" só para testes)
+PROVIDER_ORDER = [name.strip() for name in os.getenv("DK_CHAT_PROVIDER_ORDER", "gemini,deepseek").split(",") if name.strip()]
+# Tempo máximo (s) que uma chamada espera por cota ou por uma vaga antes de passar ao próximo provedor
+PROVIDER_QUEUE_TIMEOUT = float(os.getenv("DK_CHAT_PROVIDER_QUEUE_TIMEOUT", "2"))
+# Falhas seguidas que abrem o disjuntor e por quanto tempo (s) ele fica aberto
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("DK_CHAT_BREAKER_FAILURE_THRESHOLD", "5"))
+BREAKER_RESET_TIMEOUT = float(os.getenv("DK_CHAT_BREAKER_RESET_TIMEOUT", "30"))
+
+def _provider_limits(name: str, rpm: str, tpm: str, max_in_flight: str) -> dict:
+    # Ex.: DK_CHAT_GEMINI_RPM, DK_CHAT_GEMINI_TPM, DK_CHAT_GEMINI_MAX_IN_FLIGHT; 0 desativa o limite
+    prefix = f"DK_CHAT_{name.upper()}"
+    return {
+        "rpm": float(os.getenv(f"{prefix}_RPM", rpm)),
+        "tpm": float(os.getenv(f"{prefix}_TPM", tpm)),
+        "max_in_flight": int(os.getenv(f"{prefix}_MAX_IN_FLIGHT", max_in_flight)),
+    }
+
+PROVIDER_LIMITS = {
+    "gemini": _provider_limits("gemini", "1000", "4000000", "32"),
+    "deepseek": _provider_limits("deepseek", "600", "1000000", "16"),
+    "echo": _provider_limits("echo", "0", "0", "0"),
+}
+
+# Atraso (s) entre as palavras do provedor de eco, para simular uma resposta em streaming
+ECHO_DELAY = float(os.getenv("DK_CHAT_ECHO_DELAY", "0"))
+
+DEFAULT_SYSTEM_PROMPT = "Você é o DK Chat, um assistente prestativo e amigável."
+
+
+class ProviderUnavailable(Exception):
+    """O provedor não pode atender agora (não configurado, disjuntor aberto ou sem cota); tente o próximo."""
+    def __init__(self, provider: str, reason: str):
+        super().__init__(f"Provedor {provider} indisponível: {reason}")
+        self.provider = provider
+        self.reason = reason
+
+
+class ProviderError(Exception):
+    """Resposta inválida de um provedor (conta como falha para o disjuntor)."""
+
+
+class TokenBucket:
+    """
+    Balde de fichas com capacidade `per_minute`, reposto continuamente ao longo de um minuto.
+    `per_minute` igual a 0 desativa o limite.
+    """
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._tokens = per_minute
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Retira `amount` fichas e retorna 0, ou retorna quantos segundos faltam para haver fichas."""
+        if not self.capacity:
+            return 0.0
+        # Um pedido maior que o balde nunca caberia; ele só precisa do balde cheio
+        amount = min(amount, self.capacity)
+        with self._lock:
+            self._refill()
+            if self._tokens >= amount:
+                self._tokens -= amount
+                return 0.0
+            return (amount - self._tokens) / self.rate
+
+    def refund(self, amount: float):
+        if self.capacity:
+            with self._lock:
+                self._tokens = min(self.capacity, self._tokens + amount)
+
+    def charge(self, amount: float):
+        """Debita sem esperar (ex.: tokens da resposta, conhecidos só no fim); o saldo pode ficar negativo."""
+        if self.capacity:
+            with self._lock:
+                self._refill()
+                self._tokens -= amount
+
+    def available(self) -> float | None:
+        if not self.capacity:
+            return None
+        with self._lock:
+            self._refill()
+            return self._tokens
+
+
+class CircuitBreaker:
+    """
+    Disjuntor: fechado -> aberto após `failure_threshold` falhas seguidas; aberto -> meio aberto
+    após `reset_timeout` segundos, liberando uma única chamada de teste, que fecha o disjuntor
+    se der certo ou o reabre se falhar.
+    """
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = BREAKER_FAILURE_THRESHOLD, reset_timeout: float = BREAKER_RESET_TIMEOUT):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.times_opened = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def _retry_in(self) -> float:
+        return max(0.0, self._opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == self.OPEN:
+                if self._retry_in() > 0:
+                    return False
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def is_open(self) -> bool:
+        """True enquanto as chamadas estão sendo recusadas (não altera o estado)."""
+        with self._lock:
+            if self.state == self.OPEN:
+                return self._retry_in() > 0
+            return self.state == self.HALF_OPEN and self._probe_in_flight
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.times_opened += 1
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def release(self):
+        """A chamada terminou sem resultado (ex.: cancelada ou sem cota): não conta como sucesso nem falha."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "times_opened": self.times_opened,
+                "retry_in": self._retry_in() if self.state == self.OPEN else 0.0,
+            }
+
+
+def to_gemini_history(messages: list[dict]) -> list[dict]:
+    return [
+        {"role": "user" if msg["sender"] == "user" else "model", "parts": [{"text": msg["text"]}]}
+        for msg in messages
+    ]
+
+
+class LLMProvider:
+    """
+    Interface comum dos provedores. As subclasses implementam `_stream_chat` e `_complete`;
+    os métodos públicos `stream_chat` e `complete` aplicam limites e disjuntor e levantam
+    `ProviderUnavailable` (antes de qualquer chamada à API) quando o provedor deve ser pulado.
+    Outras exceções vêm da própria API e contam como falha.
+    """
+    name = "base"
+
+    def __init__(self, rpm: float = 0, tpm: float = 0, max_in_flight: int = 0,
+                 breaker: CircuitBreaker | None = None, queue_timeout: float = PROVIDER_QUEUE_TIMEOUT):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight) if max_in_flight else None
+        self.breaker = breaker or CircuitBreaker()
+        self.queue_timeout = queue_timeout
+        self._stats_lock = threading.Lock()
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.rejected = {"circuit_open": 0, "rate_limited": 0, "max_in_flight": 0}
+
+    @property
+    def configured(self) -> bool:
+        return True
+
+    def available(self) -> bool:
+        """Configurado e com o disjuntor fechado (ou pronto para a chamada de teste)."""
+        return self.configured and not self.breaker.is_open()
+
+    def _reject(self, kind: str, reason: str) -> ProviderUnavailable:
+        with self._stats_lock:
+            self.rejected[kind] += 1
+        event(f"{self.name}_rejected_{kind}")
+        return ProviderUnavailable(self.name, reason)
+
+    def _wait_for_quota(self, prompt_tokens: int, deadline: float):
+        while True:
+            wait = self.requests.reserve(1)
+            if not wait:
+                wait = self.tokens.reserve(prompt_tokens)
+                if not wait:
+                    return
+                self.requests.refund(1)
+            if time.monotonic() + wait > deadline:
+                raise self._reject("rate_limited", "limite de requisições/tokens por minuto atingido")
+            time.sleep(wait)
+
+    @contextmanager
+    def _admitted(self, prompt_tokens: int):
+        if not self.configured:
+            raise ProviderUnavailable(self.name, "não configurado")
+        if not self.breaker.allow():
+            raise self._reject("circuit_open", "disjuntor aberto após falhas seguidas")
+        deadline = time.monotonic() + self.queue_timeout
+        try:
+            self._wait_for_quota(prompt_tokens, deadline)
+            if self._slots is not None and not self._slots.acquire(timeout=max(0.0, deadline - time.monotonic())):
+                raise self._reject("max_in_flight", f"{self.max_in_flight} chamadas em andamento")
+        except BaseException:
+            self.breaker.release()
+            raise
+
+        with self._stats_lock:
+            self.in_flight += 1
+            self.calls += 1
+        try:
+            yield
+        except Exception:
+            with self._stats_lock:
+                self.failures += 1
+            self.breaker.record_failure()
+            raise
+        except BaseException: # Stream fechado antes do fim (turno cancelado ou perna perdedora)
+            self.breaker.release()
+            raise
+        else:
+            self.breaker.record_success()
+        finally:
+            with self._stats_lock:
+                self.in_flight -= 1
+            if self._slots is not None:
+                self._slots.release()
+
+    def stream_chat(self, message: str, history: list[dict] = (), conversation: "ConversationState" = None,
+                    system: str | None = None, cancel_event: threading.Event = None) -> Generator[str, None, bool]:
+        """
+        Transmite a resposta a `message`. O histórico (`[{"sender", "text"}]`, sem a mensagem atual)
+        vem de `history` ou, se informado, da janela de contexto de `conversation`.
+        Retorna True se a resposta foi recebida por completo.
+        """
+        context = conversation.context_messages() if conversation is not None else list(history)
+        prompt_tokens = estimate_tokens(message) + sum(estimate_tokens(msg["text"]) for msg in context)
+        if system:
+            prompt_tokens += estimate_tokens(system)
+        start = time.perf_counter()
+        attrs = {"prompt_tokens": prompt_tokens}
+        try:
+            with self._admitted(prompt_tokens):
+                attrs["admitted_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                stream = self._stream_chat(message, context, conversation, system, cancel_event)
+                output_chars = 0
+                try:
+                    while True:
+                        try:
+                            chunk = next(stream)
+                        except StopIteration as stop:
+                            attrs["completed"] = bool(stop.value)
+                            return bool(stop.value)
+                        if "first_chunk_ms" not in attrs:
+                            attrs["first_chunk_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                        output_chars += len(chunk)
+                        yield chunk
+                except Exception as e:
+                    attrs["error"] = type(e).__name__
+                    raise
+                finally:
+                    stream.close()
+                    attrs["output_chars"] = output_chars
+                    self.tokens.charge(output_chars / 4)
+        finally:
+            if "admitted_ms" in attrs: # Chamadas recusadas aparecem só como eventos
+                record_stage(f"llm_{self.name}", start, attrs)
+
+    def complete(self, prompt: str, system: str | None = None, cancel_event: threading.Event = None) -> str:
+        """Resposta completa (sem streaming) a um prompt isolado."""
+        prompt_tokens = estimate_tokens(prompt) + (estimate_tokens(system) if system else 0)
+        start = time.perf_counter()
+        attrs = {"prompt_tokens": prompt_tokens, "mode": "complete"}
+        try:
+            with self._admitted(prompt_tokens):
+                attrs["admitted_ms"] = round((time.perf_counter() - start) * 1000, 2)
+                try:
+                    text = self._complete(prompt, system, cancel_event)
+                except Exception as e:
+                    attrs["error"] = type(e).__name__
+                    raise
+        finally:
+            if "admitted_ms" in attrs:
+                record_stage(f"llm_{self.name}", start, attrs)
+        attrs["output_chars"] = len(text)
+        self.tokens.charge(estimate_tokens(text))
+        return text
+
+    def _stream_chat(self, message: str, context: list[dict], conversation: "ConversationState",
+                     system: str | None, cancel_event: threading.Event) -> Generator[str, None, bool]:
+        raise NotImplementedError
+
+    def _complete(self, prompt: str, system: str | None, cancel_event: threading.Event) -> str:
+        raise NotImplementedError
+
+    def metrics(self) -> dict:
+        requests_available = self.requests.available()
+        tokens_available = self.tokens.available()
+        with self._stats_lock:
+            return {
+                "provider": self.name,
+                "configured": self.configured,
+                "circuit": self.breaker.snapshot(),
+                "requests_per_minute": self.requests.capacity,
+                "requests_available": requests_available,
+                "tokens_per_minute": self.tokens.capacity,
+                "tokens_available": tokens_available,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "calls": self.calls,
+                "failures": self.failures,
+                "rejected": dict(self.rejected),
+            }
+
+
+class GeminiProvider(LLMProvider):
+    """
+    Gemini. Com `conversation` e sem `system`, reaproveita o chat vivo da sessão
+    (ConversationState.get_gemini_chat); com `system` (ex.: trechos da memória de longo prazo),
+    monta um chat só para o turno, para que as instruções não fiquem no histórico do chat vivo.
+    """
+    name = "gemini"
+
+    @property
+    def model(self):
+        return get_provider("gemini")
+
+    @property
+    def configured(self) -> bool:
+        return self.model is not None
+
+    def _stream_chat(self, message, context, conversation, system, cancel_event):
+        model = self.model
+        live_chat = conversation is not None and not system
+        if live_chat:
+            chat_session = conversation.get_gemini_chat(model, to_gemini_history)
+        else:
+            if system:
+                context = [{"sender": "user", "text": system}, {"sender": "dk_chat", "text": "Entendido."}] + context
+            chat_session = model.start_chat(history=to_gemini_history(context))
+
+        completed = False
+        try:
+            response = chat_session.send_message(message, stream=True, request_options={"timeout": GEMINI_REQUEST_TIMEOUT})
+            received_any = False
+            for chunk in response:
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                try:
+                    text = chunk.text
+                except ValueError: # Chunk sem texto (ex.: bloqueado ou só com metadados)
+                    continue
+                if text:
+                    received_any = True
+                    yield text
+
+            completed = received_any
+            if not received_any:
+                if response.prompt_feedback and response.prompt_feedback.block_reason:
+                    block_reason = response.prompt_feedback.block_reason
+                    print(f"Resposta do Gemini bloqueada. Razão: {block_reason}")
+                    yield f"Minha resposta foi bloqueada pelas políticas de segurança (Razão: {block_reason}). Por favor, reformule sua pergunta ou tente um tópico diferente."
+                else:
+                    yield "Recebi uma resposta vazia do Gemini."
+            return completed
+        finally:
+            # Stream cancelado, com erro ou vazio: o chat vivo não reflete mais o histórico salvo
+            if live_chat:
+                if completed:
+                    conversation.commit_gemini_turn()
+                else:
+                    conversation.invalidate_gemini_chat()
+
+    def _complete(self, prompt, system, cancel_event):
+        if system:
+            prompt = f"{system}\n\n{prompt}"
+        response = self.model.generate_content(prompt, request_options={"timeout": GEMINI_REQUEST_TIMEOUT})
+        return response.text.strip() if response.text else ""
+
+
+class DeepSeekProvider(LLMProvider):
+    """DeepSeek (API compatível com a da OpenAI), via o cliente HTTP com pool de conexões."""
+    name = "deepseek"
+    model = "deepseek-chat"
+
+    @property
+    def client(self):
+        return get_provider("deepseek")
+
+    @property
+    def configured(self) -> bool:
+        return self.client is not None
+
+    def _messages(self, message: str, context: list[dict], system: str | None) -> list[dict]:
+        messages = [{"role": "system", "content": system or DEFAULT_SYSTEM_PROMPT}]
+        messages.extend(
+            {"role": "user" if msg["sender"] == "user" else "assistant", "content": msg["text"]} for msg in context
+        )
+        messages.append({"role": "user", "content": message})
+        return messages
+
+    def _stream_chat(self, message, context, conversation, system, cancel_event):
+        payload = {"model": self.model, "messages": self._messages(message, context, system), "stream": True}
+        received_any = False
+        with self.client.post_chat(payload, stream=True, cancel_event=cancel_event) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                if cancel_event is not None and cancel_event.is_set():
+                    return False
+                # Formato SSE: "data: {...}", terminando com "data: [DONE]"
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or []
+                delta = choices[0].get("delta", {}).get("content") if choices else None
+                if delta:
+                    received_any = True
+                    yield delta
+        if not received_any:
+            yield "Não consegui obter uma resposta da DeepSeek."
+        return received_any
+
+    def _complete(self, prompt, system, cancel_event):
+        payload = {"model": self.model, "messages": self._messages(prompt, [], system)}
+        data = self.client.post_chat(payload, cancel_event=cancel_event).json()
+        choices = data.get("choices") or []
+        if choices and choices[0].get("message"):
+            return choices[0]["message"]["content"].strip()
+        raise ProviderError("resposta da DeepSeek sem conteúdo")
+
+
+class EchoProvider(LLMProvider):
+    """Provedor local, sem rede, para testes e testes de carga: devolve a mensagem palavra por palavra."""
+    name = "echo"
+
+    def _words(self, text: str) -> Iterator[str]:
+        for i, word in enumerate(text.split(" ")):
+            yield word if i == 0 else f" {word}"
+
+    def _stream_chat(self, message, context, conversation, system, cancel_event):
+        for word in self._words(f"Eco: {message}"):
+            if cancel_event is not None and cancel_event.is_set():
+                return False
+            if ECHO_DELAY:
+                time.sleep(ECHO_DELAY)
+            yield word
+        return True
+
+    def _complete(self, prompt, system, cancel_event):
+        # Limitado: o resumo da conversa reenviaria o prompt inteiro a cada atualização
+        return f"Eco: {prompt[:200]}"
+
+
+PROVIDER_CLASSES = {"gemini": GeminiProvider, "deepseek": DeepSeekProvider, "echo": EchoProvider}
+
+for _name, _cls in PROVIDER_CLASSES.items():
+    register_provider(f"llm:{_name}", lambda cls=_cls, name=_name: cls(**PROVIDER_LIMITS[name]))
+
+def get_llm_provider(name: str) -> LLMProvider:
+    return get_provider(f"llm:{name}")
+
+def provider_chain() -> list[LLMProvider]:
+    """Provedores das respostas gerais, na ordem de DK_CHAT_PROVIDER_ORDER."""
+    return [get_llm_provider(name) for name in PROVIDER_ORDER if name in PROVIDER_CLASSES]
+
+def provider_metrics() -> list[dict]:
+    """Estado dos limites e disjuntores dos provedores já criados."""
+    registry = get_provider_registry()
+    providers = (registry.peek(f"llm:{name}") for name in PROVIDER_CLASSES)
+    return [provider.metrics() for provider in providers if provider is not None]
@@ -0,0 +1,437 @@
+"""
+Memória de longo prazo entre sessões (opcional: DK_CHAT_MEMORY=1).
+
+Todas as mensagens do histórico são divididas em trechos de até DK_CHAT_MEMORY_CHUNK_WORDS
+palavras e indexadas em um índice invertido guardado em arrays NumPy (.npy, abertos com mmap):
+cada termo (palavra ou par de palavras de normalize_query, com hashing) aponta para os trechos
+em que aparece, com o peso BM25 da frequência no trecho. A consulta soma idf x peso nas listas
+dos termos da pergunta (np.bincount) e devolve os melhores trechos de outras sessões, que vão
+para o prompt do modelo dentro de DK_CHAT_MEMORY_TOKEN_BUDGET.
+
+O índice é construído fora do caminho das respostas, por uma thread que a cada
+DK_CHAT_MEMORY_INDEX_INTERVAL segundos indexa as mensagens novas (id acima da marca d'água)
+em um segmento novo. Segmentos pequenos são fundidos quando passam de DK_CHAT_MEMORY_MAX_SEGMENTS.
+
+Arquivos em DK_CHAT_MEMORY_DIR:
+  manifest.json       versão do formato, marca d'água (último id indexado) e lista de segmentos
+  seg_XXXXXXXX/       um segmento:
+    terms.npy         termos (int32, ordenados) com ao menos um trecho
+    offsets.npy       início de cada termo em docs/weights (int64, len(terms) + 1)
+    docs.npy          trecho de cada ocorrência, local ao segmento (int32)
+    weights.npy       peso BM25 da ocorrência, sem o idf (float16)
+    chunks.npy        (id da mensagem, id da sessão, início, fim, crc32 do texto) de cada trecho (int64, n x 5)
+O texto não é copiado: os trechos são lidos do banco pelo id da mensagem; mensagens apagadas
+simplesmente deixam de aparecer nos resultados, e o crc32 descarta trechos cujo id foi
+reaproveitado pelo SQLite para outra mensagem.
+"""
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import time
+import zlib
+from collections import Counter, deque
+
+import numpy as np
+from sqlalchemy import func
+
+from .archive import get_archived_messages
+from .db_manager import get_db, add_history_cleared_listener, add_session_removed_listener
+from .models import ChatMessage
+from .router import normalize_query
+from .semantic_cache import UNCACHEABLE_MARKERS
+
+MEMORY_DIR = os.getenv("DK_CHAT_MEMORY_DIR", "dk_chat_memory_index")
+MEMORY_TOP_K = int(os.getenv("DK_CHAT_MEMORY_TOP_K", "4"))
+MEMORY_TOKEN_BUDGET = int(os.getenv("DK_CHAT_MEMORY_TOKEN_BUDGET", "600"))
+# Fração mínima da pontuação da pergunta (soma dos idf dos seus termos) que um trecho precisa
+# atingir; evita injetar trechos que só compartilham uma palavra com a pergunta
+MEMORY_MIN_MATCH = float(os.getenv("DK_CHAT_MEMORY_MIN_MATCH", "0.3"))
+MEMORY_CHUNK_WORDS = int(os.getenv("DK_CHAT_MEMORY_CHUNK_WORDS", "80"))
+MEMORY_INDEX_INTERVAL = float(os.getenv("DK_CHAT_MEMORY_INDEX_INTERVAL", "30"))
+MEMORY_INDEX_BATCH = int(os.getenv("DK_CHAT_MEMORY_INDEX_BATCH", "50000"))  # Mensagens por segmento novo
+MEMORY_MAX_SEGMENTS = int(os.getenv("DK_CHAT_MEMORY_MAX_SEGMENTS", "8"))
+# Limite de ocorrências lidas por consulta: os termos mais raros (mais informativos) entram primeiro
+MEMORY_MAX_POSTINGS = int(os.getenv("DK_CHAT_MEMORY_MAX_POSTINGS", "200000"))
+
+INDEX_FORMAT_VERSION = 2
+HASH_BITS = 22
+HASH_MASK = (1 << HASH_BITS) - 1
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+_WORDS = re.compile(r"\S+")
+
+
+def chunk_spans(text: str, words: int = MEMORY_CHUNK_WORDS) -> list[tuple[int, int]]:
+    """Intervalos (início, fim) de `text` com até `words` palavras cada."""
+    spans = [match.span() for match in _WORDS.finditer(text)]
+    return [(spans[i][0], spans[min(i + words, len(spans)) - 1][1]) for i in range(0, len(spans), words)]
+
+def text_checksum(text: str) -> int:
+    return zlib.crc32(text.encode())
+
+def hash_terms(text: str) -> list[int]:
+    """Termos do texto (palavras e pares de palavras normalizados), como inteiros de HASH_BITS bits."""
+    words = normalize_query(text).split()
+    features = words + [f"{first} {second}" for first, second in zip(words, words[1:])]
+    return [zlib.crc32(feature.encode()) & HASH_MASK for feature in features]
+
+
+class _Segment:
+    """Segmento imutável do índice, mapeado do disco."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.name = os.path.basename(path)
+        self.terms = np.load(os.path.join(path, "terms.npy"), mmap_mode="r")
+        self.offsets = np.load(os.path.join(path, "offsets.npy"), mmap_mode="r")
+        self.docs = np.load(os.path.join(path, "docs.npy"), mmap_mode="r")
+        self.weights = np.load(os.path.join(path, "weights.npy"), mmap_mode="r")
+        self.chunks = np.load(os.path.join(path, "chunks.npy"), mmap_mode="r")
+        self.size = len(self.chunks)
+
+    def ranges(self, terms: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """Início e fim, em docs/weights, das ocorrências de cada termo (vazio se o termo não aparece)."""
+        positions = np.minimum(np.searchsorted(self.terms, terms), len(self.terms) - 1)
+        found = self.terms[positions] == terms
+        return np.where(found, self.offsets[positions], 0), np.where(found, self.offsets[positions + 1], 0)
+
+    def expanded(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Todas as ocorrências como (termo, trecho, peso), para a fusão de segmentos (cópias, fora do mmap)."""
+        return np.repeat(np.asarray(self.terms), np.diff(self.offsets)), np.array(self.docs), np.array(self.weights)
+
+    def close(self):
+        # O mmap de cada arquivo é fechado quando a última referência ao array some; no Windows,
+        # o diretório só pode ser apagado depois disso
+        self.terms = self.offsets = self.docs = self.weights = self.chunks = None
+
+
+def _write_segment(path: str, terms: np.ndarray, docs: np.ndarray, weights: np.ndarray, chunks: np.ndarray):
+    """Grava um segmento a partir das ocorrências (termo, trecho, peso), em qualquer ordem."""
+    order = np.lexsort((docs, terms))
+    terms, docs, weights = terms[order], docs[order], weights[order]
+    unique_terms, starts = np.unique(terms, return_index=True)
+    tmp_path = path + ".tmp"
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    np.save(os.path.join(tmp_path, "terms.npy"), unique_terms.astype(np.int32))
+    np.save(os.path.join(tmp_path, "offsets.npy"), np.append(starts, len(terms)).astype(np.int64))
+    np.save(os.path.join(tmp_path, "docs.npy"), docs.astype(np.int32))
+    np.save(os.path.join(tmp_path, "weights.npy"), weights.astype(np.float16))
+    np.save(os.path.join(tmp_path, "chunks.npy"), chunks.astype(np.int64).reshape(-1, 5))
+    os.replace(tmp_path, path)
+
+
+class MemoryIndex:
+    def __init__(self, directory: str = MEMORY_DIR, background: bool = True):
+        self.directory = directory
+        self._index_lock = threading.Lock()  # Uma indexação/fusão por vez
+        self._lock = threading.Lock()
+        self._segments: list[_Segment] = []
+        # Buscas em andamento por versão da lista de segmentos; um segmento fundido só é fechado e
+        # apagado depois que as buscas que ainda podem lê-lo terminam
+        self._version = 0
+        self._readers: Counter[int] = Counter()
+        self._readers_done = threading.Condition(self._lock)
+        self._lookup_ms: deque[float] = deque(maxlen=1000)
+        self.queries = 0
+        self.indexed_messages = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        # Menor id máximo visto depois de uma exclusão desde a última indexação (ver _on_messages_removed)
+        self._rewind_to: int | None = None
+
+        os.makedirs(directory, exist_ok=True)
+        self._load()
+        add_history_cleared_listener(self._on_messages_removed)
+        add_session_removed_listener(self._on_messages_removed)
+        if background:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="dk-chat-memory-index")
+            self._thread.start()
+
+    # --- Arquivos ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _load(self):
+        manifest = {}
+        if os.path.exists(self._path("manifest.json")):
+            with open(self._path("manifest.json"), encoding="utf-8") as f:
+                manifest = json.load(f)
+        if (manifest.get("version"), manifest.get("hash_bits"), manifest.get("chunk_words")) != (
+                INDEX_FORMAT_VERSION, HASH_BITS, MEMORY_CHUNK_WORDS):
+            if manifest:
+                print("DK Chat: Formato do índice de memória mudou; o histórico será reindexado.")
+            manifest = {}
+        self.watermark = manifest.get("watermark", 0)
+        self._next_segment = manifest.get("next_segment", 0)
+        self._segments = [_Segment(self._path(name)) for name in manifest.get("segments", [])]
+        # Segmentos órfãos (fusões interrompidas, formato antigo)
+        known = set(manifest.get("segments", []))
+        for name in os.listdir(self.directory):
+            if name.startswith("seg_") and name not in known:
+                shutil.rmtree(self._path(name), ignore_errors=True)
+
+    def _commit(self, segments: list[_Segment], watermark: int):
+        manifest = {
+            "version": INDEX_FORMAT_VERSION, "hash_bits": HASH_BITS, "chunk_words": MEMORY_CHUNK_WORDS,
+            "watermark": watermark, "next_segment": self._next_segment,
+            "segments": [segment.name for segment in segments],
+        }
+        tmp_path = self._path("manifest.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._path("manifest.json"))
+        with self._lock:
+            self._segments = segments
+            self._version += 1
+            self.watermark = watermark
+
+    def _new_segment_path(self) -> str:
+        path = self._path(f"seg_{self._next_segment:08d}")
+        self._next_segment += 1
+        return path
+
+    # --- Indexação ---
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.index_pending()
+            except Exception as e:
+                print(f"DK Chat: Erro ao indexar a memória de longo prazo: {e}")
+            self._stop.wait(MEMORY_INDEX_INTERVAL)
+
+    def stop(self):
+        self._stop.set()
+
+    def _on_messages_removed(self, session_id: int):
+        # Guarda o maior id logo após a exclusão: se as mensagens mais novas foram apagadas, o SQLite
+        # reaproveita os ids acima dele, possivelmente antes da próxima indexação
+        with get_db() as db:
+            max_id = db.query(func.max(ChatMessage.id)).scalar() or 0
+        with self._lock:
+            self._rewind_to = max_id if self._rewind_to is None else min(self._rewind_to, max_id)
+
+    def index_pending(self) -> int:
+        """Indexa as mensagens gravadas depois da marca d'água; retorna quantas foram lidas."""
+        total = 0
+        with self._index_lock:
+            with get_db() as db:
+                max_id = db.query(func.max(ChatMessage.id)).scalar() or 0
+            with self._lock:
+                if self._rewind_to is not None:
+                    max_id = min(max_id, self._rewind_to)
+                    self._rewind_to = None
+            if max_id < self.watermark:
+                # As mensagens mais novas foram apagadas ou arquivadas e o SQLite vai reaproveitar os ids
+                # acima do maior existente: sem recuar a marca d'água, as próximas nunca seriam indexadas
+                self._commit(list(self._segments), max_id)
+            while not self._stop.is_set():
+                with get_db() as db:
+                    rows = db.query(ChatMessage.id, ChatMessage.session_id, ChatMessage.sender, ChatMessage.text).filter(
+                        ChatMessage.id > self.watermark
+                    ).order_by(ChatMessage.id).limit(MEMORY_INDEX_BATCH).all()
+                if not rows:
+                    break
+                segments = list(self._segments)
+                segment = self._build_segment(rows)
+                if segment is not None:
+                    segments.append(segment)
+                self._commit(segments, rows[-1].id)
+                total += len(rows)
+                self.indexed_messages += len(rows)
+                if len(self._segments) > MEMORY_MAX_SEGMENTS:
+                    self._merge_smallest()
+        return total
+
+    def _build_segment(self, rows) -> _Segment | None:
+        terms, docs, tfs, lengths, chunks = [], [], [], [], []
+        for row in rows:
+            if not row.text or (row.sender != "user" and any(marker in row.text for marker in UNCACHEABLE_MARKERS)):
+                continue
+            for start, end in chunk_spans(row.text):
+                chunk_terms = hash_terms(row.text[start:end])
+                if len(chunk_terms) < 2:
+                    continue
+                doc = len(chunks)
+                counts = Counter(chunk_terms)
+                terms.extend(counts.keys())
+                tfs.extend(counts.values())
+                docs.extend([doc] * len(counts))
+                lengths.append(len(chunk_terms))
+                chunks.append((row.id, row.session_id, start, end, text_checksum(row.text[start:end])))
+        if not chunks:
+            return None
+        docs = np.array(docs, dtype=np.int32)
+        tf = np.array(tfs, dtype=np.float32)
+        lengths = np.array(lengths, dtype=np.float32)
+        # Parte do BM25 que não depende do idf (o idf é calculado na consulta, com todos os segmentos)
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[docs] / lengths.mean())
+        weights = tf * (BM25_K1 + 1) / (tf + norm)
+        path = self._new_segment_path()
+        _write_segment(path, np.array(terms, dtype=np.int32), docs, weights, np.array(chunks, dtype=np.int64))
+        return _Segment(path)
+
+    def _merge_smallest(self):
+        """Funde os segmentos menores até sobrarem MEMORY_MAX_SEGMENTS / 2."""
+        segments = sorted(self._segments, key=lambda segment: segment.size)
+        merge_count = len(segments) - MEMORY_MAX_SEGMENTS // 2 + 1
+        to_merge, kept = segments[:merge_count], segments[merge_count:]
+        parts, chunks, base = [], [], 0
+        for segment in to_merge:
+            terms, docs, weights = segment.expanded()
+            parts.append((terms, docs.astype(np.int64) + base, weights))
+            chunks.append(np.array(segment.chunks))
+            base += segment.size
+        path = self._new_segment_path()
+        _write_segment(path, *(np.concatenate(column) for column in zip(*parts)), np.concatenate(chunks))
+        del parts, chunks
+        self._commit(kept + [_Segment(path)], self.watermark)
+        self._retire(to_merge)
+
+    def _retire(self, segments: list[_Segment]):
+        """Fecha e apaga segmentos que saíram da lista, depois que as buscas que os viam terminarem."""
+        with self._lock:
+            version = self._version
+            while any(reader_version < version for reader_version in self._readers):
+                self._readers_done.wait()
+            for segment in segments:
+                segment.close()
+        for segment in segments:
+            shutil.rmtree(segment.path, ignore_errors=True)
+
+    # --- Consulta ---
+
+    def search(self, query: str, exclude_session_id: int | None = None, top_k: int = MEMORY_TOP_K,
+               min_match: float = MEMORY_MIN_MATCH) -> list[tuple[float, int, int, int, int, int]]:
+        """
+        Melhores trechos para `query` como (pontuação, id da mensagem, id da sessão, início, fim, crc32).
+        A pontuação é o BM25 dividido pela soma dos idf dos termos da pergunta.
+        """
+        started = time.perf_counter()
+        with self._lock:
+            segments, version = self._segments, self._version
+            self._readers[version] += 1
+        try:
+            results = self._search(query, segments, exclude_session_id, top_k, min_match)
+        finally:
+            with self._lock:
+                self._readers[version] -= 1
+                if not self._readers[version]:
+                    del self._readers[version]
+                    self._readers_done.notify_all()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self.queries += 1
+            self._lookup_ms.append(elapsed_ms)
+        return results
+
+    def _search(self, query: str, segments: list[_Segment], exclude_session_id, top_k, min_match):
+        terms = np.array(sorted(set(hash_terms(query))), dtype=np.int32)
+        results = []
+        if len(terms) and segments:
+            ranges = [segment.ranges(terms) for segment in segments]
+            df = sum(ends - starts for starts, ends in ranges)
+            total = sum(segment.size for segment in segments)
+            idf = np.log(1 + (total - df + 0.5) / (df + 0.5))
+            min_score = min_match * float(idf.sum())  # Termos ausentes do índice também contam
+            # Termos mais raros primeiro, até o limite de ocorrências lidas
+            selected = np.zeros(len(terms), dtype=bool)
+            budget = MEMORY_MAX_POSTINGS
+            for i in np.argsort(df):
+                if df[i] and df[i] <= budget:
+                    selected[i] = True
+                    budget -= df[i]
+            for segment, (starts, ends) in zip(segments, ranges):
+                results.extend(self._search_segment(segment, starts[selected], ends[selected], idf[selected],
+                                                    exclude_session_id, top_k, min_score))
+            results.sort(reverse=True)
+            # Uma mensagem reindexada depois de recuar a marca d'água pode estar em dois segmentos
+            seen = set()
+            results = [hit for hit in results if hit[1:4] not in seen and not seen.add(hit[1:4])]
+            results = [(score / float(idf.sum()), *hit) for score, *hit in results[:top_k]]
+        return results
+
+    @staticmethod
+    def _search_segment(segment: _Segment, starts, ends, idf, exclude_session_id, top_k, min_score):
+        docs = [segment.docs[start:end] for start, end in zip(starts, ends) if end > start]
+        if not docs:
+            return []
+        weights = [segment.weights[start:end].astype(np.float32) * term_idf
+                   for start, end, term_idf in zip(starts, ends, idf) if end > start]
+        docs = np.concatenate(docs)
+        weights = np.concatenate(weights)
+        if len(docs) * 8 < segment.size:
+            candidates, inverse = np.unique(docs, return_inverse=True)
+            scores = np.bincount(inverse, weights=weights)
+        else:
+            scores = np.bincount(docs, weights=weights)
+            candidates = np.arange(len(scores))
+        # Folga para os trechos da sessão atual, descartados a seguir
+        keep = min(len(scores), top_k * 4)
+        best = np.argpartition(-scores, keep - 1)[:keep]
+        results = []
+        for i in best:
+            if scores[i] < min_score:
+                continue
+            message_id, session_id, start, end, checksum = segment.chunks[candidates[i]]
+            if session_id != exclude_session_id:
+                results.append((float(scores[i]), int(message_id), int(session_id), int(start), int(end), int(checksum)))
+        return results
+
+    def retrieve(self, query: str, exclude_session_id: int | None = None, top_k: int = MEMORY_TOP_K,
+                 token_budget: int = MEMORY_TOKEN_BUDGET) -> list[dict]:
+        """
+        Trechos de outras sessões relevantes para `query`, do mais para o menos relevante, como
+        `{"sender", "text", "timestamp", "session_id", "score"}`, somando até `token_budget` tokens.
+        """
+        hits = self.search(query, exclude_session_id, top_k)
+        if not hits:
+            return []
+        with get_db() as db:
+            messages = {(row.id, row.session_id): row for row in db.query(
+                ChatMessage.id, ChatMessage.session_id, ChatMessage.sender, ChatMessage.text, ChatMessage.timestamp
+            ).filter(ChatMessage.id.in_({hit[1] for hit in hits}))}
+            # Sessões arquivadas (core.archive) saem de chat_messages; o id pode até ter sido reaproveitado.
+            # Cada sessão é descomprimida uma vez, mesmo com vários trechos dela nos resultados
+            missing = {}
+            for hit in hits:
+                if (hit[1], hit[2]) not in messages:
+                    missing.setdefault(hit[2], set()).add(hit[1])
+            for session_id, message_ids in missing.items():
+                for message in get_archived_messages(db, session_id) or ():
+                    if message.id in message_ids:
+                        messages[message.id, session_id] = message
+        snippets, budget = [], token_budget
+        for score, message_id, session_id, start, end, checksum in hits:
+            message = messages.get((message_id, session_id))
+            if message is None:  # Mensagem apagada depois de indexada
+                continue
+            text = message.text[start:end]
+            if text_checksum(text) != checksum:  # Id reaproveitado por outra mensagem na mesma sessão
+                continue
+            if len(text) > budget * 4:  # ~4 caracteres por token, como em context_window.estimate_tokens
+                text = text[:budget * 4].rsplit(" ", 1)[0] + "..."
+            budget -= math.ceil(len(text) / 4)
+            snippets.append({"sender": message.sender, "text": text, "timestamp": message.timestamp,
+                             "session_id": session_id, "score": score})
+            if budget <= 0:
+                break
+        return snippets
+
+    def stats(self) -> dict:
+        with self._lock:
+            latencies = sorted(self._lookup_ms)
+            return {
+                "chunks": sum(segment.size for segment in self._segments),
+                "segments": len(self._segments),
+                "watermark": self.watermark,
+                "queries": self.queries,
+                "lookup_p50_ms": latencies[len(latencies) // 2] if latencies else 0.0,
+                "lookup_p95_ms": latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else None,
+            }
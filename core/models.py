@@ -1,9 +1,23 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey
+from sqlalchemy import create_engine, event, text, Column, Integer, String, DateTime, ForeignKey, Index, LargeBinary
 from sqlalchemy.orm import declarative_base, relationship, sessionmaker
 from datetime import datetime
 import os
+import threading
 
-DATABASE_URL = "sqlite:///./dk_chat_history.db"
+DATABASE_URL = os.getenv("DK_CHAT_DATABASE_URL", "sqlite:///./dk_chat_history.db")
+
+# Perfil de desempenho do SQLite (aplicado em cada conexão nova)
+SQLITE_PRAGMAS = {
+    # Páginas livres são devolvidas ao sistema aos poucos (core.archive.incremental_vacuum). Em bancos
+    # novos vale desde a criação; bancos antigos passam a usar depois de um VACUUM (manage.py vacuum).
+    "auto_vacuum": "INCREMENTAL",
+    "journal_mode": "WAL",          # Leitores não bloqueiam o escritor
+    "synchronous": "NORMAL",        # Seguro com WAL; evita um fsync por commit
+    "cache_size": -64000,           # ~64 MB de cache de páginas (valor negativo = KiB)
+    "mmap_size": 268435456,         # 256 MB mapeados em memória para leituras
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,           # Espera (ms) em vez de falhar com "database is locked"
+}
 
 Base = declarative_base()
 
@@ -11,6 +25,12 @@ class ChatSession(Base):
     __tablename__ = "chat_sessions"
     id = Column(Integer, primary_key=True, index=True)
     start_time = Column(DateTime, default=datetime.utcnow)
+    # Estatísticas denormalizadas, mantidas a cada gravação/limpeza (core.db_manager), para
+    # que a lista de conversas não precise agregar chat_messages
+    title = Column(String)  # Início da primeira mensagem do usuário
+    message_count = Column(Integer, nullable=False, default=0, server_default="0")
+    last_activity = Column(DateTime, index=True)
+    preview = Column(String)  # Início da última mensagem
     messages = relationship("ChatMessage", back_populates="session")
 
 class ChatMessage(Base):
@@ -22,9 +42,172 @@ class ChatMessage(Base):
     timestamp = Column(DateTime, default=datetime.utcnow)
     session = relationship("ChatSession", back_populates="messages")
 
-engine = create_engine(DATABASE_URL) # , connect_args={"check_same_thread": False} -> necessário se Flet usar threads diferentes para UI e DB, mas vamos tentar sem primeiro. Flet geralmente executa callbacks no mesmo thread.
+    __table_args__ = (
+        # Atende ao filtro por sessão + ordenação por horário (o id entra implicitamente como rowid)
+        Index("ix_chat_messages_session_timestamp", "session_id", "timestamp"),
+    )
+
+class ChatSessionSummary(Base):
+    # Resumo contínuo das mensagens antigas da sessão, que saíram da janela de contexto
+    __tablename__ = "chat_session_summaries"
+    session_id = Column(Integer, ForeignKey("chat_sessions.id"), primary_key=True)
+    summary = Column(String)
+    covered_until_message_id = Column(Integer)  # Última mensagem incorporada ao resumo
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class NewsCacheEntry(Base):
+    # Cache persistido das respostas a perguntas de notícias (rota DeepSeek)
+    __tablename__ = "news_cache"
+    key = Column(String, primary_key=True)  # Pergunta normalizada
+    answer = Column(String)
+    expires_at = Column(DateTime, index=True)
+
+class ChatSessionArchive(Base):
+    # Mensagens de uma sessão inativa, codificadas e comprimidas em um único blob (core.archive)
+    __tablename__ = "chat_session_archives"
+    session_id = Column(Integer, ForeignKey("chat_sessions.id"), primary_key=True)
+    codec = Column(String, nullable=False)  # "zlib" ou "zstd"
+    message_count = Column(Integer, nullable=False)
+    raw_bytes = Column(Integer, nullable=False)  # Tamanho antes da compressão
+    data = Column(LargeBinary, nullable=False)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+
+class ChatImport(Base):
+    # Progresso de cada importação de histórico (core.transfer), para retomar depois de uma interrupção
+    __tablename__ = "chat_imports"
+    export_id = Column(String, primary_key=True)  # Identificador gravado no cabeçalho da exportação
+    source = Column(String)  # Caminho do arquivo importado
+    lines_done = Column(Integer, nullable=False, default=0)  # Linhas já gravadas (em transações confirmadas)
+    sessions = Column(Integer, nullable=False, default=0)
+    messages = Column(Integer, nullable=False, default=0)
+    # Sessão em andamento no último lote: suas mensagens podem continuar no lote seguinte
+    current_source_session_id = Column(Integer)
+    current_session_id = Column(Integer)
+    started_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+# check_same_thread=False: os turnos rodam em workers (core.turn_pipeline), fora do thread da UI
+engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for pragma, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {pragma}={value}")
+    cursor.close()
+
+def _migration_1_session_timestamp_index(conn):
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_chat_messages_session_timestamp ON chat_messages (session_id, timestamp)"
+    ))
+
+# Índice de busca textual (FTS5) das mensagens. É uma tabela de "conteúdo externo": o texto fica
+# só em chat_messages e os gatilhos mantêm o índice em dia. remove_diacritics 2 faz "noticia" achar "notícia".
+FTS_TABLE = "chat_messages_fts"
+FTS_INSERT_TRIGGER = "chat_messages_fts_ai"
+# Recriado também pela importação em lote (core.transfer), que indexa cada lote de uma vez
+FTS_INSERT_TRIGGER_SQL = (
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_INSERT_TRIGGER} AFTER INSERT ON chat_messages BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); END"
+)
+
+def _migration_2_message_search(conn):
+    conn.execute(text(
+        f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+        "text, content='chat_messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2')"
+    ))
+    conn.execute(text(FTS_INSERT_TRIGGER_SQL))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS chat_messages_fts_ad AFTER DELETE ON chat_messages BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) VALUES ('delete', old.id, old.text); END"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS chat_messages_fts_au AFTER UPDATE OF text ON chat_messages BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, text) VALUES ('delete', old.id, old.text); "
+        f"INSERT INTO {FTS_TABLE}(rowid, text) VALUES (new.id, new.text); END"
+    ))
+    if conn.execute(text("SELECT EXISTS (SELECT 1 FROM chat_messages)")).scalar():
+        # O histórico precisa entrar no índice já aqui: com conteúdo externo, o gatilho de remoção manda
+        # um 'delete' para cada linha apagada, e apagar uma linha nunca indexada corrompe o índice
+        print("DK Chat: Indexando as mensagens anteriores para a busca (pode levar alguns segundos).")
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+def _add_column_if_missing(conn, table: str, column: str, ddl: str):
+    # Em bancos novos a coluna já vem do create_all
+    existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+    if column not in existing:
+        conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {ddl}"))
+
+SESSION_TITLE_LENGTH = 60
+SESSION_PREVIEW_LENGTH = 120
+
+def _migration_3_session_stats(conn):
+    _add_column_if_missing(conn, "chat_sessions", "title", "VARCHAR")
+    _add_column_if_missing(conn, "chat_sessions", "message_count", "INTEGER NOT NULL DEFAULT 0")
+    _add_column_if_missing(conn, "chat_sessions", "last_activity", "DATETIME")
+    _add_column_if_missing(conn, "chat_sessions", "preview", "VARCHAR")
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_chat_sessions_last_activity ON chat_sessions (last_activity)"))
+    # Preenchimento único a partir das mensagens existentes; depois disso os valores são incrementais
+    conn.execute(text(f"""
+        UPDATE chat_sessions SET
+            message_count = (SELECT COUNT(*) FROM chat_messages m WHERE m.session_id = chat_sessions.id),
+            last_activity = COALESCE(
+                (SELECT MAX(m.timestamp) FROM chat_messages m WHERE m.session_id = chat_sessions.id), start_time),
+            title = (SELECT substr(replace(m.text, char(10), ' '), 1, {SESSION_TITLE_LENGTH}) FROM chat_messages m
+                     WHERE m.session_id = chat_sessions.id AND m.sender = 'user'
+                     ORDER BY m.timestamp, m.id LIMIT 1),
+            preview = (SELECT substr(replace(m.text, char(10), ' '), 1, {SESSION_PREVIEW_LENGTH}) FROM chat_messages m
+                       WHERE m.session_id = chat_sessions.id ORDER BY m.timestamp DESC, m.id DESC LIMIT 1)
+    """))
+
+def _migration_4_search_index_repair(conn):
+    # Bancos que passaram pela versão 2 antes do preenchimento automático têm mensagens fora do índice
+    # (e remoções que já podem tê-lo corrompido); 'rebuild' descarta o índice e o refaz do zero
+    indexed = conn.execute(text(f"SELECT COUNT(*) FROM {FTS_TABLE}_docsize")).scalar()
+    if indexed != conn.execute(text("SELECT COUNT(*) FROM chat_messages")).scalar():
+        print("DK Chat: Reconstruindo o índice de busca (pode levar alguns segundos).")
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+
+def rebuild_search_index():
+    """Reconstrói o índice FTS5 a partir de chat_messages (backfill de bancos antigos ou reparo)."""
+    with engine.begin() as conn:
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+
+# Migrações de esquema para bancos já existentes, em ordem; a versão aplicada fica em PRAGMA user_version.
+# Tabelas novas são criadas por create_all; aqui entram índices, colunas e objetos que ele não cria.
+MIGRATIONS = [
+    (1, _migration_1_session_timestamp_index),
+    (2, _migration_2_message_search),
+    (3, _migration_3_session_stats),
+    (4, _migration_4_search_index_repair),
+]
+
+def run_migrations():
+    with engine.begin() as conn:
+        current_version = conn.execute(text("PRAGMA user_version")).scalar()
+        for version, migration in MIGRATIONS:
+            if version > current_version:
+                print(f"DK Chat: Aplicando migração do banco de dados (versão {version}).")
+                migration(conn)
+                conn.execute(text(f"PRAGMA user_version={version}"))
 
 def create_db_and_tables():
     Base.metadata.create_all(bind=engine)
+    run_migrations()
+
+_schema_ready = False
+_schema_lock = threading.Lock()
+
+def ensure_db_ready():
+    """Cria as tabelas e aplica as migrações uma única vez por processo (chamado no primeiro uso do banco)."""
+    global _schema_ready
+    if _schema_ready:
+        return
+    with _schema_lock:
+        if not _schema_ready:
+            create_db_and_tables()
+            _schema_ready = True
 
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
\ No newline at end of file
+# expire_on_commit=False: as sessões são curtas (get_db) e os objetos continuam legíveis após o commit
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
\ No newline at end of file
@@ -0,0 +1,66 @@
+import threading
+import time
+from typing import Any, Callable
+
+_MISSING = object()
+
+
+class ProviderRegistry:
+    """
+    Registro de objetos compartilhados pelo processo inteiro (clientes de API, DKChatLogic...).
+    Cada provedor é criado uma única vez, de forma preguiçosa, no primeiro `get`; a criação
+    usa um lock por provedor, então threads concorrentes esperam pela mesma instância.
+    A fábrica pode retornar None (ex.: chave de API ausente), e esse resultado também é guardado.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._factories: dict[str, Callable[[], Any]] = {}
+        self._instances: dict[str, Any] = {}
+        self._creation_locks: dict[str, threading.Lock] = {}
+
+    def register(self, name: str, factory: Callable[[], Any]):
+        with self._lock:
+            self._factories[name] = factory
+            self._creation_locks.setdefault(name, threading.Lock())
+
+    def get(self, name: str) -> Any:
+        instance = self._instances.get(name, _MISSING)
+        if instance is not _MISSING: # Caminho rápido, sem lock
+            return instance
+        with self._lock:
+            if name not in self._factories:
+                raise KeyError(f"Provedor não registrado: {name}")
+            factory, creation_lock = self._factories[name], self._creation_locks[name]
+        with creation_lock:
+            instance = self._instances.get(name, _MISSING)
+            if instance is _MISSING:
+                started = time.perf_counter()
+                instance = factory()
+                self._instances[name] = instance
+                print(f"DK Chat: Provedor '{name}' inicializado em {(time.perf_counter() - started) * 1000:.1f} ms.")
+            return instance
+
+    def peek(self, name: str) -> Any:
+        """A instância, se já tiver sido criada; não dispara a criação."""
+        instance = self._instances.get(name, _MISSING)
+        return None if instance is _MISSING else instance
+
+    def reset(self, name: str | None = None):
+        """Descarta instâncias (todas, ou só a informada); a próxima chamada a `get` as recria."""
+        with self._lock:
+            if name is None:
+                self._instances.clear()
+            else:
+                self._instances.pop(name, None)
+
+
+_registry = ProviderRegistry()
+
+def get_provider_registry() -> ProviderRegistry:
+    return _registry
+
+def register_provider(name: str, factory: Callable[[], Any]):
+    _registry.register(name, factory)
+
+def get_provider(name: str) -> Any:
+    return _registry.get(name)
@@ -0,0 +1,140 @@
+import re
+import unicodedata
+from dataclasses import dataclass
+from datetime import datetime
+
+YEAR_PLACEHOLDER = "{ano_atual}"
+
+
+_ACCENTED = "áàâãäéèêëíìîïóòôõöúùûüçñÁÀÂÃÄÉÈÊËÍÌÎÏÓÒÔÕÖÚÙÛÜÇÑ"
+_UNACCENTED = "aaaaaeeeeiiiiooooouuuucnAAAAAEEEEIIIIOOOOOUUUUCN"
+_ACCENT_TABLE = str.maketrans(_ACCENTED, _UNACCENTED)
+
+def strip_accents(text: str) -> str:
+    # Caminho rápido para o português (tabela de tradução); NFKD só para o que sobrar
+    if text.isascii():
+        return text
+    text = text.translate(_ACCENT_TABLE)
+    if text.isascii():
+        return text
+    text = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in text if not unicodedata.combining(ch))
+
+# Palavras ignoradas em normalize_query
+QUERY_STOPWORDS = {
+    "a", "o", "as", "os", "um", "uma", "de", "do", "da", "dos", "das", "em", "no", "na", "nos", "nas",
+    "e", "ou", "que", "por", "para", "pra", "com", "me", "voce", "sabe", "qual", "quais",
+    "esta", "sobre", "diga", "fale", "mostre", "favor", "pode", "poderia",
+}
+
+def normalize_query(text: str) -> str:
+    """Chave canônica de uma pergunta: minúsculas, sem acentos, pontuação ou palavras vazias."""
+    words = re.findall(r"\w+", strip_accents(text.lower()))
+    return " ".join(word for word in words if word not in QUERY_STOPWORDS)
+
+
+@dataclass(frozen=True)
+class RouterRule:
+    """
+    Regra de roteamento para a DeepSeek.
+    `keywords` são comparadas sem acentos e como palavras inteiras; `YEAR_PLACEHOLDER`
+    é substituído pelo ano atual. Com `requires_question=True`, a regra só vale quando
+    a mensagem é uma pergunta (termos temporais como "hoje" aparecem muito em conversa casual).
+    """
+    name: str
+    keywords: tuple[str, ...]
+    news_class: str = "noticias"
+    requires_question: bool = False
+
+
+@dataclass(frozen=True)
+class RoutingDecision:
+    use_deepseek: bool
+    rule: str | None = None
+    keyword: str | None = None
+    news_class: str | None = None
+
+
+DEFAULT_RULES = (
+    RouterRule("noticias", ("notícia", "notícias", "o que aconteceu", "qual a novidade", "aconteceu com")),
+    RouterRule("mercado", ("cotação", "dólar", "bolsa de valores"), news_class="mercado"),
+    RouterRule("clima", ("previsão do tempo",), news_class="clima"),
+    RouterRule("esportes", ("resultado de jogo", "quem ganhou"), news_class="esportes"),
+    RouterRule(
+        "temporal",
+        ("hoje", "agora", "recente", "últimas", "ontem", "esta semana", YEAR_PLACEHOLDER),
+        requires_question=True,
+    ),
+)
+
+GEMINI_ONLY = RoutingDecision(use_deepseek=False)
+
+_QUESTION_RE = re.compile(
+    r"\?|^\s*(?:quando|quem|onde|qual|quais|quanto|quanta|quantos|quantas|como|o que|por que)\b"
+)
+
+
+def _trie_pattern(keywords) -> str:
+    trie: dict = {}
+    for keyword in keywords:
+        node = trie
+        for ch in keyword:
+            node = node.setdefault(ch, {})
+        node[""] = True  # Fim de palavra-chave
+
+    def build(node: dict) -> str:
+        is_end = "" in node
+        branches = []
+        for ch in sorted(k for k in node if k):
+            # Espaços da palavra-chave aceitam qualquer sequência de espaços na mensagem
+            piece = r"\s+" if ch == " " else re.escape(ch)
+            branches.append(piece + build(node[ch]))
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if is_end:
+            body = "(?:" + body + ")?"
+        return body
+
+    return build(trie)
+
+
+class IntentRouter:
+    """
+    Decide se uma mensagem precisa de busca online (DeepSeek).
+    Todas as palavras-chave são compiladas em uma única expressão regular com limites de
+    palavra, então cada mensagem é varrida uma só vez, independentemente do número de regras.
+    """
+    def __init__(self, rules: tuple[RouterRule, ...] = DEFAULT_RULES):
+        self.rules = tuple(rules)
+        self._compiled_year: int | None = None
+        self._pattern: re.Pattern | None = None
+        self._keyword_rules: dict[str, RouterRule] = {}
+        self._compile()
+
+    def _compile(self):
+        year = datetime.now().year
+        self._keyword_rules = {}
+        for rule in self.rules:
+            for keyword in rule.keywords:
+                keyword = strip_accents(keyword.replace(YEAR_PLACEHOLDER, str(year)).lower())
+                self._keyword_rules.setdefault(" ".join(keyword.split()), rule)
+        # As palavras-chave viram uma trie em forma de regex: prefixos comuns são fatorados,
+        # o que deixa o motor de regex do Python bem mais rápido do que uma alternância simples
+        self._pattern = re.compile(r"\b(?:" + _trie_pattern(self._keyword_rules) + r")\b")
+        self._compiled_year = year
+
+    def route(self, message: str) -> RoutingDecision:
+        if self._compiled_year != datetime.now().year:
+            self._compile()
+        normalized = strip_accents(message.lower())
+        is_question = None
+        for match in self._pattern.finditer(normalized):
+            rule = self._keyword_rules[" ".join(match.group(0).split())]
+            if rule.requires_question:
+                if is_question is None:
+                    is_question = _QUESTION_RE.search(normalized) is not None
+                if not is_question:
+                    continue
+            return RoutingDecision(True, rule.name, match.group(0), rule.news_class)
+        return GEMINI_ONLY
@@ -0,0 +1,413 @@
+"""
+Cache semântico de respostas gerais (opcional: DK_CHAT_SEMANTIC_CACHE=1).
+
+Cada par pergunta do usuário -> resposta do DK Chat gravado no histórico vira um vetor TF-IDF
+de n-gramas com hashing (palavras, pares de palavras e trechos de 4 letras, sem acentos nem
+palavras vazias), calculado localmente, sem rede. Os vetores ficam em uma matriz float32
+contígua, mapeada do disco (np.memmap), e a busca é um produto escalar em blocos contra a
+matriz inteira. Uma pergunta nova recebe a resposta guardada se a similaridade de cosseno
+passar de DK_CHAT_SEMANTIC_CACHE_THRESHOLD e a pergunta não for sensível ao tempo (notícias,
+cotações...: as mesmas regras de roteamento da DeepSeek).
+
+Arquivos em DK_CHAT_SEMANTIC_CACHE_DIR:
+  vectors.f32  matriz (capacidade x dim) dos vetores, normalizados
+  rows.i64     matriz (capacidade x 3): id da pergunta, id da resposta, id da sessão
+  df.f64       frequência de documento de cada posição do hashing (para o IDF)
+  meta.json    dim, quantidade de pares e de documentos quando o IDF foi recalculado pela última vez
+O texto das respostas não é copiado: vem do banco, pelo id, no momento do acerto.
+"""
+import atexit
+import json
+import os
+import threading
+import time
+import zlib
+from collections import deque
+from contextlib import contextmanager
+
+import numpy as np
+
+from .db_manager import get_db, get_message_text, add_message_saved_listener, add_history_cleared_listener
+from .models import ChatMessage
+from .router import IntentRouter, normalize_query
+
+SEMANTIC_CACHE_DIR = os.getenv("DK_CHAT_SEMANTIC_CACHE_DIR", "dk_chat_semantic_cache")
+SEMANTIC_CACHE_DIM = int(os.getenv("DK_CHAT_SEMANTIC_CACHE_DIM", "1024"))
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("DK_CHAT_SEMANTIC_CACHE_THRESHOLD", "0.9"))
+# Perguntas muito curtas ("e depois?") dependem do contexto da conversa: nunca são servidas do cache
+SEMANTIC_CACHE_MIN_WORDS = int(os.getenv("DK_CHAT_SEMANTIC_CACHE_MIN_WORDS", "3"))
+# O IDF dos vetores guardados é o do momento da inserção; o índice é recalculado quando o número
+# de pares passa deste fator em relação ao último recálculo
+SEMANTIC_CACHE_REBUILD_GROWTH = float(os.getenv("DK_CHAT_SEMANTIC_CACHE_REBUILD_GROWTH", "2"))
+# Intervalo mínimo (s) entre as gravações do meta.json pelos pares novos; o restante vai no flush()
+# (também chamado ao sair). Pares que não chegaram ao meta.json antes de uma queda voltam na reconstrução
+SEMANTIC_CACHE_META_INTERVAL = float(os.getenv("DK_CHAT_SEMANTIC_CACHE_META_INTERVAL", "5"))
+LOOKUP_BLOCK_ROWS = 65536  # Linhas por bloco do produto escalar (limita a memória temporária)
+INITIAL_CAPACITY = 1024
+
+# Respostas que não devem ser reaproveitadas (erros, cancelamentos, respostas de fallback)
+UNCACHEABLE_MARKERS = (
+    "(Resposta cancelada.)", "(Resposta interrompida", "Ocorreu um erro crítico", "Recebi uma resposta vazia",
+    "Desculpe, tive um problema", "Os serviços de IA estão", "A chave da API", "Minha resposta foi bloqueada",
+    "(APIs não configuradas)", "capacidades de IA não estão configuradas",
+)
+
+
+class HashedTfidf:
+    """Vetorização TF-IDF com hashing (dimensão fixa, sem vocabulário)."""
+
+    def __init__(self, dim: int, df: np.ndarray):
+        self.dim = dim
+        self.df = df  # Frequência de documento por posição (pode ser um memmap)
+
+    def terms(self, text: str) -> tuple[np.ndarray, np.ndarray, int]:
+        """Posições do hashing e pesos TF (sublineares) de `text`, e o número de palavras úteis."""
+        words = normalize_query(text).split()
+        weights: dict[int, float] = {}
+
+        def add(feature: str, weight: float):
+            index = zlib.crc32(feature.encode()) % self.dim
+            weights[index] = weights.get(index, 0.0) + weight
+
+        for word in words:
+            add(f"w:{word}", 1.0)
+            for i in range(len(word) - 3):  # Tolera flexões e erros de digitação
+                add(f"c:{word[i:i + 4]}", 0.25)
+        for first, second in zip(words, words[1:]):
+            add(f"b:{first} {second}", 1.0)
+
+        indexes = np.fromiter(weights.keys(), dtype=np.int64, count=len(weights))
+        tf = np.fromiter(weights.values(), dtype=np.float64, count=len(weights))
+        # TF sublinear (1 + log tf) para termos repetidos; pesos menores que 1 (trechos) ficam como estão
+        return indexes, np.where(tf > 1, 1.0 + np.log(np.maximum(tf, 1.0)), tf), len(words)
+
+    def vector(self, indexes: np.ndarray, tf: np.ndarray, documents: int) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if len(indexes):
+            idf = np.log((1.0 + documents) / (1.0 + self.df[indexes])) + 1.0
+            vector[indexes] = tf * idf
+            norm = np.linalg.norm(vector)
+            if norm:
+                vector /= norm
+        return vector
+
+
+class SemanticCache:
+    def __init__(self, directory: str = SEMANTIC_CACHE_DIR, dim: int = SEMANTIC_CACHE_DIM,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD, listen: bool = True):
+        self.directory = directory
+        self.dim = dim
+        self.threshold = threshold
+        self.router = IntentRouter()
+        self._lock = threading.RLock()
+        # Buscas lendo os mapas fora do lock; a troca ou o redimensionamento dos arquivos espera por elas
+        self._readers = 0
+        self._readers_done = threading.Condition(self._lock)
+        self._remapping = False
+        self._meta_dirty = False
+        self._meta_written = 0.0
+        self._pending_questions: dict[int, tuple[int, str]] = {}  # sessão -> (id, texto) da última pergunta
+        self._served_sessions: set[int] = set()  # Sessões cuja próxima resposta veio do próprio cache
+        self._rebuilding = False
+        self._rebuild_thread: threading.Thread | None = None
+        self._replay: list[tuple] = []  # Pares recebidos durante uma reconstrução
+
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self._lookup_ms: deque[float] = deque(maxlen=1000)
+
+        os.makedirs(directory, exist_ok=True)
+        self._open()
+        if listen:
+            add_message_saved_listener(self._on_message_saved)
+            add_history_cleared_listener(self._on_history_cleared)
+            atexit.register(self.flush)
+        if self.count == 0:
+            self.start_rebuild()  # Primeiro uso: indexa o histórico existente em segundo plano
+
+    # --- Arquivos ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    def _open(self):
+        meta = {}
+        if os.path.exists(self._path("meta.json")):
+            with open(self._path("meta.json"), encoding="utf-8") as f:
+                meta = json.load(f)
+        if meta.get("dim") != self.dim:
+            meta = {}  # Índice inexistente ou de outra dimensão: começa vazio
+        self.count = meta.get("count", 0)
+        self.built_count = meta.get("built_count", 0)
+        self.documents = meta.get("documents", 0)
+        self.capacity = max(INITIAL_CAPACITY, meta.get("capacity", 0))
+        self._map_files("r+" if meta else "w+")
+        if not meta:
+            self._write_meta()
+
+    def _map_files(self, mode: str = "r+"):
+        self._vectors = np.memmap(self._path("vectors.f32"), dtype=np.float32, mode=mode, shape=(self.capacity, self.dim))
+        self._rows = np.memmap(self._path("rows.i64"), dtype=np.int64, mode=mode, shape=(self.capacity, 3))
+        self._df = np.memmap(self._path("df.f64"), dtype=np.float64, mode=mode, shape=(self.dim,))
+        self.embedder = HashedTfidf(self.dim, self._df)
+
+    @contextmanager
+    def _unmapped(self):
+        """
+        Fecha os mapas dos arquivos (depois que as buscas em andamento os soltarem) e os reabre ao
+        sair, com a capacidade atual: no Windows, um arquivo mapeado não pode ser substituído nem
+        truncado. Chamado com self._lock.
+        """
+        self._remapping = True
+        try:
+            while self._readers:
+                self._readers_done.wait()
+            self._vectors.flush()
+            self._rows.flush()
+            self._df.flush()
+            # O mmap é fechado quando a última referência ao array some
+            self._vectors = self._rows = self._df = self.embedder = None
+            yield
+        finally:
+            if self._vectors is None:
+                self._map_files()
+            self._remapping = False
+            self._readers_done.notify_all()
+
+    def _write_meta(self):
+        meta = {"dim": self.dim, "count": self.count, "capacity": self.capacity,
+                "documents": self.documents, "built_count": self.built_count}
+        tmp_path = self._path("meta.json.tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, self._path("meta.json"))
+        self._meta_dirty = False
+        self._meta_written = time.monotonic()
+
+    def _grow(self, needed: int):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        with self._unmapped():
+            for name, row_bytes in (("vectors.f32", self.dim * 4), ("rows.i64", 3 * 8)):
+                with open(self._path(name), "r+b") as f:
+                    f.truncate(capacity * row_bytes)
+            self.capacity = capacity
+
+    def flush(self):
+        with self._lock:
+            self._vectors.flush()
+            self._rows.flush()
+            self._df.flush()
+            self._write_meta()
+
+    # --- Busca ---
+
+    def lookup_many(self, questions: list[str]) -> list[tuple[int, int, float] | None]:
+        """
+        Para cada pergunta, (id da resposta, id da sessão, similaridade) do par mais parecido acima do
+        limiar, ou None.
+        As perguntas são comparadas juntas, bloco a bloco, com um único produto de matrizes.
+        """
+        started = time.perf_counter()
+        results: list[tuple[int, float] | None] = [None] * len(questions)
+        with self._lock:
+            while self._remapping:
+                self._readers_done.wait()
+            count, documents = self.count, self.documents
+            queries = []
+            for i, question in enumerate(questions):
+                indexes, tf, words = self.embedder.terms(question)
+                if words >= SEMANTIC_CACHE_MIN_WORDS:
+                    queries.append((i, self.embedder.vector(indexes, tf, documents)))
+            self._readers += 1
+        try:
+            if queries and count:
+                for (i, _), match in zip(queries, self._scan(np.stack([vector for _, vector in queries]), count)):
+                    results[i] = match
+        finally:
+            with self._lock:
+                self._readers -= 1
+                self._readers_done.notify_all()
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._lock:
+            self._lookup_ms.append(elapsed_ms / max(1, len(questions)))
+        return results
+
+    def _scan(self, matrix: np.ndarray, count: int) -> list[tuple[int, int, float] | None]:
+        """Melhor par acima do limiar para cada linha de `matrix`, entre as `count` primeiras do índice."""
+        vectors, rows = self._vectors, self._rows  # Soltos ao retornar (ver _unmapped)
+        best_scores = np.full(len(matrix), -1.0, dtype=np.float32)
+        best_rows = np.zeros(len(matrix), dtype=np.int64)
+        for start in range(0, count, LOOKUP_BLOCK_ROWS):
+            scores = vectors[start:min(count, start + LOOKUP_BLOCK_ROWS)] @ matrix.T  # (linhas do bloco x perguntas)
+            block_best = scores.argmax(axis=0)
+            block_scores = scores[block_best, np.arange(len(matrix))]
+            better = block_scores > best_scores
+            best_scores[better] = block_scores[better]
+            best_rows[better] = block_best[better] + start
+        return [(int(rows[row, 1]), int(rows[row, 2]), float(score)) if score >= self.threshold else None
+                for score, row in zip(best_scores, best_rows)]
+
+    def lookup(self, question: str) -> str | None:
+        """Resposta guardada para uma pergunta equivalente, ou None."""
+        if self.router.route(question).use_deepseek:
+            with self._lock:
+                self.skipped += 1
+            return None
+        match = self.lookup_many([question])[0]
+        answer = None
+        if match is not None:
+            with get_db() as db:
+                answer = get_message_text(db, match[0], session_id=match[1])
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def mark_served(self, session_id: int):
+        """A próxima resposta gravada na sessão veio do cache e não deve ser indexada de novo."""
+        with self._lock:
+            self._served_sessions.add(session_id)
+
+    # --- Atualização ---
+
+    def _cacheable(self, question: str, answer: str) -> bool:
+        if any(marker in answer for marker in UNCACHEABLE_MARKERS):
+            return False
+        return not self.router.route(question).use_deepseek
+
+    def add_pair(self, question_id: int, question: str, answer_id: int, session_id: int):
+        with self._lock:
+            if self._rebuilding:
+                self._replay.append((question_id, question, answer_id, session_id))
+                return
+            indexes, tf, words = self.embedder.terms(question)
+            if words < SEMANTIC_CACHE_MIN_WORDS:
+                return
+            self._df[indexes] += 1
+            self.documents += 1
+            if self.count >= self.capacity:
+                self._grow(self.count + 1)
+            self._vectors[self.count] = self.embedder.vector(indexes, tf, self.documents)
+            self._rows[self.count] = (question_id, answer_id, session_id)
+            self.count += 1
+            self._meta_dirty = True
+            if time.monotonic() - self._meta_written >= SEMANTIC_CACHE_META_INTERVAL:
+                self._write_meta()
+            needs_rebuild = self.count >= max(1000, self.built_count * SEMANTIC_CACHE_REBUILD_GROWTH)
+        if needs_rebuild:
+            self.start_rebuild()
+
+    def _on_message_saved(self, message: ChatMessage):
+        if message.sender == "user":
+            with self._lock:
+                self._pending_questions[message.session_id] = (message.id, message.text)
+            return
+        with self._lock:
+            question = self._pending_questions.pop(message.session_id, None)
+            served = message.session_id in self._served_sessions
+            self._served_sessions.discard(message.session_id)
+        if question is None or served or not self._cacheable(question[1], message.text):
+            return
+        try:
+            self.add_pair(question[0], question[1], message.id, message.session_id)
+        except Exception as e:
+            print(f"DK Chat: Erro ao indexar a resposta no cache semântico: {e}")
+
+    def _on_history_cleared(self, session_id: int):
+        # As respostas da sessão sumiram do banco: zera os vetores (nunca mais serão o mais próximo)
+        with self._lock:
+            self._pending_questions.pop(session_id, None)
+            if self.count:
+                self._vectors[:self.count][self._rows[:self.count, 2] == session_id] = 0.0
+
+    # --- Reconstrução ---
+
+    def start_rebuild(self) -> threading.Thread:
+        """Reconstrói o índice em segundo plano; se já houver uma reconstrução em andamento, retorna a thread dela."""
+        with self._lock:
+            if self._rebuild_thread is None or not self._rebuild_thread.is_alive():
+                self._rebuilding = True
+                self._rebuild_thread = threading.Thread(target=self._rebuild, daemon=True, name="dk-chat-semantic-cache")
+                self._rebuild_thread.start()
+            return self._rebuild_thread
+
+    def rebuild(self):
+        """Reindexa todo o histórico com um IDF novo e troca os arquivos do índice (espera terminar)."""
+        self.start_rebuild().join()
+
+    def _iter_pairs(self):
+        """Pares (pergunta, resposta) consecutivos de cada sessão no histórico, com resposta aproveitável."""
+        previous = None
+        with get_db() as db:
+            query = db.query(ChatMessage.id, ChatMessage.session_id, ChatMessage.sender, ChatMessage.text).order_by(
+                ChatMessage.session_id, ChatMessage.timestamp, ChatMessage.id
+            ).yield_per(5000)
+            for row in query:
+                if (row.sender != "user" and previous is not None and previous.sender == "user"
+                        and previous.session_id == row.session_id and self._cacheable(previous.text, row.text)):
+                    yield previous.id, previous.text, row.id, row.session_id
+                previous = row
+
+    def _rebuild(self):
+        started = time.perf_counter()
+        try:
+            embedder = HashedTfidf(self.dim, np.zeros(self.dim, dtype=np.float64))
+            entries = []
+            for question_id, question, answer_id, session_id in self._iter_pairs():
+                indexes, tf, words = embedder.terms(question)
+                if words >= SEMANTIC_CACHE_MIN_WORDS:
+                    entries.append((indexes, tf, (question_id, answer_id, session_id)))
+                    embedder.df[indexes] += 1
+            documents = len(entries)
+            capacity = INITIAL_CAPACITY
+            while capacity < documents:
+                capacity *= 2
+            vectors = np.memmap(self._path("vectors.f32.tmp"), dtype=np.float32, mode="w+", shape=(capacity, self.dim))
+            rows = np.memmap(self._path("rows.i64.tmp"), dtype=np.int64, mode="w+", shape=(capacity, 3))
+            for i, (indexes, tf, row) in enumerate(entries):
+                vectors[i] = embedder.vector(indexes, tf, documents)
+                rows[i] = row
+            vectors.flush()
+            rows.flush()
+            embedder.df.tofile(self._path("df.f64.tmp"))
+            del vectors, rows
+
+            with self._lock, self._unmapped():
+                for name in ("vectors.f32", "rows.i64", "df.f64"):
+                    os.replace(self._path(f"{name}.tmp"), self._path(name))
+                self.count = self.built_count = self.documents = documents
+                self.capacity = capacity
+                self._write_meta()
+            print(f"DK Chat: Cache semântico reconstruído com {documents:,} pares em {time.perf_counter() - started:.1f}s.")
+        except Exception as e:
+            print(f"DK Chat: Erro ao reconstruir o cache semântico: {e}")
+        finally:
+            with self._lock:
+                self._rebuilding = False
+                replay, self._replay = self._replay, []
+            # Pares gravados durante a reconstrução e que o histórico lido talvez não tivesse
+            with self._lock:
+                indexed = set(self._rows[:self.count, 1].tolist()) if replay else set()
+            for pair in replay:
+                if pair[2] not in indexed:
+                    self.add_pair(*pair)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            latencies = sorted(self._lookup_ms)
+            return {
+                "entries": self.count,
+                "hits": self.hits,
+                "misses": self.misses,
+                "skipped_time_sensitive": self.skipped,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "lookup_p50_ms": latencies[len(latencies) // 2] if latencies else 0.0,
+                "lookup_p95_ms": latencies[int(len(latencies) * 0.95) - 1] if len(latencies) >= 20 else None,
+                "rebuilding": self._rebuilding,
+            }
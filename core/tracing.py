@@ -0,0 +1,385 @@
+"""
+Rastreamento por etapa dos turnos de conversa.
+
+Cada turno (`core.turn_pipeline.Turn`) tem um `TurnTrace` ativo enquanto é executado; as etapas
+marcadas com `stage(...)` (fila, gravação no banco, roteamento, cache, busca na DeepSeek, chamadas
+aos provedores...) registram seu tempo no trace e em histogramas no formato do Prometheus.
+Se DK_CHAT_TRACE_FILE estiver definido, ao fim do turno o trace é gravado como uma linha JSON
+nesse arquivo por uma thread à parte, para que o turno não espere pelo disco; o arquivo é
+rotacionado ao passar de DK_CHAT_TRACE_FILE_MAX_MB (a cópia anterior fica em <arquivo>.1).
+
+Os histogramas ficam em `render_metrics()`, servidos em http://127.0.0.1:DK_CHAT_METRICS_PORT/metrics
+pelo app (`start_metrics_server`) e em /metrics pelo servidor headless.
+"""
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+TRACING_ENABLED = os.getenv("DK_CHAT_TRACING", "1") == "1"
+# Arquivo JSONL com um registro por turno (ex.: dk_chat_traces.jsonl); vazio (padrão) desativa
+TRACE_FILE = os.getenv("DK_CHAT_TRACE_FILE", "")
+TRACE_FILE_MAX_BYTES = int(float(os.getenv("DK_CHAT_TRACE_FILE_MAX_MB", "10")) * 1024 * 1024)
+METRICS_HOST = os.getenv("DK_CHAT_METRICS_HOST", "127.0.0.1")
+# Porta do endpoint /metrics do app Flet (0 desativa; o servidor headless usa a própria porta)
+METRICS_PORT = int(os.getenv("DK_CHAT_METRICS_PORT", "9464"))
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (16, 64, 256, 1024, 4096, 16384, 65536)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _label_text(labelnames: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(labelnames, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Histogram:
+    """Histograma com buckets fixos, no formato de exposição de texto do Prometheus."""
+    def __init__(self, name: str, documentation: str, buckets: tuple[float, ...], labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = buckets
+        self.labelnames = labelnames
+        self._series: dict[tuple, list] = {}  # valores dos rótulos -> [contagens por bucket..., soma]
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {labels: list(series) for labels, series in self._series.items()}
+        for labels, series in sorted(snapshot.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_label_text(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_label_text(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_label_text(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = sorted(self._values.items())
+        lines.extend(f"{self.name}{_label_text(self.labelnames, labels)} {value}" for labels, value in values)
+        return lines
+
+
+STAGE_SECONDS = Histogram("dk_chat_stage_seconds", "Duração de cada etapa de um turno.", LATENCY_BUCKETS, ("stage",))
+TURN_SECONDS = Histogram("dk_chat_turn_seconds", "Duração total do turno, do envio à resposta completa.", LATENCY_BUCKETS, ("route", "outcome"))
+FIRST_CHUNK_SECONDS = Histogram("dk_chat_turn_first_chunk_seconds", "Tempo até o primeiro trecho da resposta.", LATENCY_BUCKETS, ("route",))
+PROMPT_CHARS = Histogram("dk_chat_prompt_chars", "Tamanho (caracteres) da mensagem do usuário.", SIZE_BUCKETS)
+RESPONSE_CHARS = Histogram("dk_chat_response_chars", "Tamanho (caracteres) da resposta.", SIZE_BUCKETS, ("route",))
+EVENTS = Counter("dk_chat_events_total", "Eventos dos turnos (cache, novas tentativas, failover...).", ("event",))
+METRICS = [STAGE_SECONDS, TURN_SECONDS, FIRST_CHUNK_SECONDS, PROMPT_CHARS, RESPONSE_CHARS, EVENTS]
+
+_current_trace: ContextVar["TurnTrace | None"] = ContextVar("dk_chat_turn_trace", default=None)
+_turn_ids = itertools.count(1)
+
+
+class TurnTrace:
+    """Etapas, rota, tamanhos e eventos de um turno. Criado no envio da mensagem (`Turn`)."""
+    def __init__(self, session_id: int, user_message: str, source: str = "app"):
+        self.turn_id = next(_turn_ids)
+        self.session_id = session_id
+        self.source = source
+        self.created_at = time.time()
+        self.started = time.perf_counter()
+        self.route = "geral"
+        self.prompt_chars = len(user_message)
+        self.response_chars = 0
+        self.first_chunk: float | None = None
+        self.stages: list[tuple[str, float, float, dict | None]] = []  # (nome, início, duração, atributos)
+        self.events: dict[str, int] = {}
+
+    def add_stage(self, name: str, start: float, seconds: float, attrs: dict | None = None):
+        self.stages.append((name, start - self.started, seconds, attrs))
+
+    def event(self, name: str, amount: int = 1):
+        self.events[name] = self.events.get(name, 0) + amount
+
+    def mark_chunk(self, chunk: str):
+        if self.first_chunk is None:
+            self.first_chunk = time.perf_counter() - self.started
+        self.response_chars += len(chunk)
+
+    @contextmanager
+    def activate(self):
+        token = _current_trace.set(self)
+        try:
+            yield self
+        finally:
+            _current_trace.reset(token)
+
+    def finish(self, outcome: str = "ok"):
+        if not TRACING_ENABLED:
+            return
+        total = time.perf_counter() - self.started
+        TURN_SECONDS.observe(total, self.route, outcome)
+        if self.first_chunk is not None:
+            FIRST_CHUNK_SECONDS.observe(self.first_chunk, self.route)
+        PROMPT_CHARS.observe(self.prompt_chars)
+        RESPONSE_CHARS.observe(self.response_chars, self.route)
+        if TRACE_FILE:
+            _get_trace_writer().put((self, outcome, total))
+
+    def to_record(self, outcome: str, total: float) -> dict:
+        return {
+            "turn_id": self.turn_id,
+            "source": self.source,
+            "session_id": self.session_id,
+            "time": datetime.fromtimestamp(self.created_at).isoformat(timespec="milliseconds"),
+            "route": self.route,
+            "outcome": outcome,
+            "total_ms": round(total * 1000, 2),
+            "first_chunk_ms": round(self.first_chunk * 1000, 2) if self.first_chunk is not None else None,
+            "prompt_chars": self.prompt_chars,
+            "response_chars": self.response_chars,
+            "stages": [
+                {"stage": name, "start_ms": round(start * 1000, 2), "ms": round(seconds * 1000, 2), **(attrs or {})}
+                for name, start, seconds, attrs in list(self.stages)
+            ],
+            "events": dict(self.events),
+        }
+
+
+def current_trace() -> TurnTrace | None:
+    return _current_trace.get()
+
+def record_stage(name: str, start: float, attrs: dict | None = None):
+    """Registra uma etapa iniciada em `start` (time.perf_counter) e terminada agora."""
+    if not TRACING_ENABLED:
+        return
+    seconds = time.perf_counter() - start
+    STAGE_SECONDS.observe(seconds, name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_stage(name, start, seconds, attrs)
+
+@contextmanager
+def stage(name: str, **attrs):
+    """Mede o bloco como a etapa `name` do turno atual (e no histograma, mesmo fora de um turno)."""
+    start = time.perf_counter()
+    try:
+        yield attrs  # O bloco pode acrescentar atributos (ex.: resultado do cache)
+    finally:
+        record_stage(name, start, attrs or None)
+
+def event(name: str, amount: int = 1):
+    """Conta um evento (ex.: acerto de cache, nova tentativa) no turno atual e no contador global."""
+    if not TRACING_ENABLED:
+        return
+    EVENTS.inc(amount, name)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.event(name, amount)
+
+def set_route(route: str):
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.route = route
+
+
+class _TraceWriter:
+    """Grava os traces no arquivo JSONL em segundo plano, em lotes, rotacionando o arquivo pelo tamanho."""
+    def __init__(self, path: str, max_bytes: int = TRACE_FILE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        threading.Thread(target=self._run, daemon=True, name="dk-chat-trace-writer").start()
+
+    def put(self, item):
+        self._queue.put(item)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    for trace, outcome, total in batch:
+                        f.write(json.dumps(trace.to_record(outcome, total), ensure_ascii=False) + "\n")
+                    size = f.tell()
+                if self.max_bytes and size > self.max_bytes:
+                    os.replace(self.path, self.path + ".1")
+            except OSError as e:
+                print(f"DK Chat: Erro ao gravar o arquivo de traces: {e}")
+
+_trace_writer: _TraceWriter | None = None
+_trace_writer_lock = threading.Lock()
+
+def _get_trace_writer() -> _TraceWriter:
+    # A thread de gravação só é criada no primeiro turno
+    global _trace_writer
+    if _trace_writer is None:
+        with _trace_writer_lock:
+            if _trace_writer is None:
+                _trace_writer = _TraceWriter(TRACE_FILE)
+    return _trace_writer
+
+
+def render_metrics() -> str:
+    """Métricas no formato de texto do Prometheus, incluindo limites e disjuntores dos provedores."""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+
+    from .llm_providers import provider_metrics
+    gauges = {
+        "dk_chat_provider_in_flight": ("Chamadas em andamento no provedor.", lambda m: m["in_flight"]),
+        "dk_chat_provider_requests_available": ("Requisições disponíveis no balde do provedor.", lambda m: m["requests_available"]),
+        "dk_chat_provider_tokens_available": ("Tokens disponíveis no balde do provedor.", lambda m: m["tokens_available"]),
+        "dk_chat_provider_circuit_open": ("1 se o disjuntor do provedor está aberto.", lambda m: int(m["circuit"]["state"] != "closed")),
+        "dk_chat_provider_calls_total": ("Chamadas admitidas pelo provedor.", lambda m: m["calls"]),
+        "dk_chat_provider_failures_total": ("Chamadas do provedor que falharam.", lambda m: m["failures"]),
+    }
+    providers = provider_metrics()
+    for name, (documentation, value) in gauges.items():
+        kind = "counter" if name.endswith("_total") else "gauge"
+        lines += [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+        for metrics in providers:
+            if value(metrics) is not None:
+                lines.append(f'{name}{{provider="{metrics["provider"]}"}} {value(metrics)}')
+    lines += ["# HELP dk_chat_provider_rejected_total Chamadas recusadas pelo provedor, por motivo.",
+              "# TYPE dk_chat_provider_rejected_total counter"]
+    for metrics in providers:
+        for reason, count in metrics["rejected"].items():
+            lines.append(f'dk_chat_provider_rejected_total{{provider="{metrics["provider"]}",reason="{reason}"}} {count}')
+
+    # Acertos/erros do cache semântico já saem em dk_chat_events_total e a latência em dk_chat_stage_seconds
+    from .registry import get_provider_registry
+    semantic_cache = get_provider_registry().peek("semantic_cache")
+    if semantic_cache is not None:
+        stats = semantic_cache.stats()
+        lines += ["# HELP dk_chat_semantic_cache_entries Pares pergunta/resposta no cache semântico.",
+                  "# TYPE dk_chat_semantic_cache_entries gauge",
+                  f"dk_chat_semantic_cache_entries {stats['entries']}",
+                  "# HELP dk_chat_semantic_cache_hit_ratio Fração das consultas ao cache semântico com acerto.",
+                  "# TYPE dk_chat_semantic_cache_hit_ratio gauge",
+                  f"dk_chat_semantic_cache_hit_ratio {stats['hit_rate']}"]
+    memory_index = get_provider_registry().peek("memory_index")
+    if memory_index is not None:
+        stats = memory_index.stats()
+        lines += ["# HELP dk_chat_memory_chunks Trechos do histórico no índice de memória de longo prazo.",
+                  "# TYPE dk_chat_memory_chunks gauge",
+                  f"dk_chat_memory_chunks {stats['chunks']}",
+                  "# HELP dk_chat_memory_indexed_message_id Último id de mensagem indexado (marca d'água).",
+                  "# TYPE dk_chat_memory_indexed_message_id gauge",
+                  f"dk_chat_memory_indexed_message_id {stats['watermark']}"]
+    chat_logic = get_provider_registry().peek("chat_logic")
+    if chat_logic is not None:
+        stats = chat_logic.news_cache.stats()
+        lines += ["# HELP dk_chat_news_cache_entries Respostas de notícias guardadas no cache.",
+                  "# TYPE dk_chat_news_cache_entries gauge",
+                  f"dk_chat_news_cache_entries {stats['entries']}",
+                  "# HELP dk_chat_news_cache_lookups_total Consultas ao cache de notícias, por resultado.",
+                  "# TYPE dk_chat_news_cache_lookups_total counter",
+                  f'dk_chat_news_cache_lookups_total{{result="hit"}} {stats["hits"]}',
+                  f'dk_chat_news_cache_lookups_total{{result="miss"}} {stats["misses"]}',
+                  "# HELP dk_chat_news_cache_removed_total Respostas retiradas do cache de notícias, por motivo.",
+                  "# TYPE dk_chat_news_cache_removed_total counter",
+                  f'dk_chat_news_cache_removed_total{{reason="eviction"}} {stats["evictions"]}',
+                  f'dk_chat_news_cache_removed_total{{reason="expiration"}} {stats["expirations"]}']
+        stats = chat_logic.single_flight.stats()
+        lines += ["# HELP dk_chat_news_flights_in_flight Buscas de notícias em andamento (uma por pergunta normalizada).",
+                  "# TYPE dk_chat_news_flights_in_flight gauge",
+                  f"dk_chat_news_flights_in_flight {stats['in_flight']}",
+                  "# HELP dk_chat_news_flight_requests_total Pedidos de busca de notícias, por papel na busca compartilhada.",
+                  "# TYPE dk_chat_news_flight_requests_total counter",
+                  f'dk_chat_news_flight_requests_total{{role="leader"}} {stats["leaders"]}',
+                  f'dk_chat_news_flight_requests_total{{role="joined"}} {stats["joined"]}',
+                  "# HELP dk_chat_news_flights_cancelled_total Buscas de notícias canceladas sem ninguém esperando.",
+                  "# TYPE dk_chat_news_flights_cancelled_total counter",
+                  f"dk_chat_news_flights_cancelled_total {stats['cancelled']}"]
+    deepseek = get_provider_registry().peek("deepseek")
+    if deepseek is not None:
+        stats = deepseek.stats()
+        lines += ["# HELP dk_chat_deepseek_requests_total Requisições HTTP enviadas pela sessão da DeepSeek.",
+                  "# TYPE dk_chat_deepseek_requests_total counter",
+                  f"dk_chat_deepseek_requests_total {stats['requests']}",
+                  "# HELP dk_chat_deepseek_connections_total Conexões abertas pela sessão da DeepSeek (as demais requisições reaproveitaram uma).",
+                  "# TYPE dk_chat_deepseek_connections_total counter",
+                  f"dk_chat_deepseek_connections_total {stats['new_connections']}",
+                  "# HELP dk_chat_deepseek_retries_total Novas tentativas de requisições à DeepSeek.",
+                  "# TYPE dk_chat_deepseek_retries_total counter",
+                  f"dk_chat_deepseek_retries_total {stats['retries']}"]
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_metrics().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Sem uma linha de log por coleta
+
+_metrics_server: ThreadingHTTPServer | None = None
+_metrics_server_lock = threading.Lock()
+
+def start_metrics_server(port: int = METRICS_PORT, host: str = METRICS_HOST) -> ThreadingHTTPServer | None:
+    """
+    Serve /metrics em segundo plano (app Flet), uma vez por processo.
+    Retorna None se desativado ou se a porta estiver ocupada.
+    """
+    global _metrics_server
+    if not TRACING_ENABLED or not port:
+        return None
+    with _metrics_server_lock:
+        if _metrics_server is not None:
+            return _metrics_server
+        try:
+            server = ThreadingHTTPServer((host, port), _MetricsHandler)
+        except OSError as e:
+            print(f"DK Chat: Endpoint de métricas não iniciado ({host}:{port}): {e}")
+            return None
+        server.daemon_threads = True
+        threading.Thread(target=server.serve_forever, daemon=True, name="dk-chat-metrics").start()
+        print(f"DK Chat: Métricas em http://{host}:{port}/metrics")
+        _metrics_server = server
+        return server
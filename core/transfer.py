@@ -0,0 +1,270 @@
+"""
+Exportação e importação do histórico de conversas em NDJSON (uma linha JSON por registro).
+
+Formato (gzip opcional):
+    {"type": "header", "format": "dk_chat_export", "version": 1, "export_id": "...", "exported_at": "..."}
+    {"type": "session", "id": 1, "start_time": "...", "title": "...", "message_count": 2, "last_activity": "...", "preview": "..."}
+    {"type": "message", "id": 10, "session_id": 1, "sender": "user", "text": "...", "timestamp": "..."}
+    ...
+    {"type": "end", "sessions": 1, "messages": 2}
+
+Cada sessão vem seguida das suas mensagens, em ordem cronológica; sessões arquivadas (core.archive)
+saem descomprimidas, como as demais. A exportação lê tudo em uma única consulta percorrida aos
+poucos (yield_per), com uso de memória constante, e grava em "<arquivo>.partial" até terminar.
+
+A importação grava em transações grandes (DK_CHAT_IMPORT_BATCH_SIZE mensagens, com executemany) e
+dá ids novos às sessões e mensagens, para não colidir com o histórico já existente. O progresso fica
+em chat_imports na mesma transação de cada lote: rodar o mesmo arquivo de novo, depois de uma
+interrupção, continua da última linha confirmada.
+"""
+import gzip
+import json
+import os
+import sys
+import time
+import uuid
+from datetime import datetime
+
+from sqlalchemy import delete, insert, select, update
+
+from .archive import decode_messages, decompress
+from .models import (
+    ChatImport, ChatMessage, ChatSession, ChatSessionArchive, FTS_INSERT_TRIGGER, FTS_INSERT_TRIGGER_SQL, FTS_TABLE,
+    engine, ensure_db_ready,
+)
+
+EXPORT_FORMAT = "dk_chat_export"
+EXPORT_FORMAT_VERSION = 1
+EXPORT_BATCH_SIZE = int(os.getenv("DK_CHAT_EXPORT_BATCH_SIZE", "5000"))  # Linhas lidas do banco por vez
+EXPORT_GZIP_LEVEL = int(os.getenv("DK_CHAT_EXPORT_GZIP_LEVEL", "3"))  # 6+ comprime pouco mais e é bem mais lento
+IMPORT_BATCH_SIZE = int(os.getenv("DK_CHAT_IMPORT_BATCH_SIZE", "50000"))  # Mensagens por transação
+
+_WRITE_CHUNK_LINES = 2000
+_GZIP_MAGIC = b"\x1f\x8b"
+
+
+def _iso(value: datetime | None) -> str | None:
+    return value.isoformat() if value is not None else None
+
+def _db_datetime(value: str | None) -> str | None:
+    # Mesmo formato que o SQLAlchemy grava no SQLite (sempre com microssegundos)
+    if value is None:
+        return None
+    if len(value) == 26 and value[10] == "T":  # Caso comum (isoformat com microssegundos): só troca o separador
+        return f"{value[:10]} {value[11:]}"
+    return f"{datetime.fromisoformat(value):%Y-%m-%d %H:%M:%S.%f}"
+
+
+# --- Exportação ---
+
+_encode = json.JSONEncoder(ensure_ascii=False).encode  # Reaproveitado: json.dumps recria o encoder a cada linha
+
+def _message_line(message_id, session_id, sender, text, timestamp) -> str:
+    return _encode({"type": "message", "id": message_id, "session_id": session_id, "sender": sender,
+                       "text": text, "timestamp": _iso(timestamp)})
+
+def iter_export_lines(batch_size: int = EXPORT_BATCH_SIZE, stats: dict | None = None):
+    """Gera as linhas (sem o "\\n") da exportação; `stats` recebe as contagens à medida que avança."""
+    ensure_db_ready()
+    stats = stats if stats is not None else {}
+    stats.update(sessions=0, messages=0)
+    query = (
+        select(ChatSession.id, ChatSession.start_time, ChatSession.title, ChatSession.message_count,
+               ChatSession.last_activity, ChatSession.preview, ChatSessionArchive.codec, ChatSessionArchive.data,
+               ChatMessage.id.label("message_id"), ChatMessage.sender, ChatMessage.text, ChatMessage.timestamp)
+        .select_from(ChatSession)
+        .outerjoin(ChatSessionArchive, ChatSessionArchive.session_id == ChatSession.id)
+        .outerjoin(ChatMessage, ChatMessage.session_id == ChatSession.id)
+        # Sessão por sessão, na ordem do índice (session_id, timestamp): sem ordenação em memória
+        .order_by(ChatSession.id, ChatMessage.timestamp, ChatMessage.id)
+        .execution_options(yield_per=batch_size)
+    )
+    yield json.dumps({"type": "header", "format": EXPORT_FORMAT, "version": EXPORT_FORMAT_VERSION,
+                      "export_id": uuid.uuid4().hex, "exported_at": _iso(datetime.utcnow())})
+    # Uma única consulta: o SQLite lê tudo do mesmo instantâneo, mesmo com o app gravando ao lado
+    with engine.connect() as conn:
+        current = None
+        for partition in conn.execute(query).partitions():
+            for (session_id, start_time, title, message_count, last_activity, preview, codec, data,
+                 message_id, sender, text, timestamp) in partition:
+                if session_id != current:
+                    current = session_id
+                    stats["sessions"] += 1
+                    yield _encode({"type": "session", "id": session_id, "start_time": _iso(start_time), "title": title,
+                                   "message_count": message_count, "last_activity": _iso(last_activity),
+                                   "preview": preview})
+                    if codec is not None:
+                        for message in decode_messages(decompress(data, codec)):
+                            stats["messages"] += 1
+                            yield _message_line(message.id, session_id, message.sender, message.text, message.timestamp)
+                if message_id is not None:
+                    stats["messages"] += 1
+                    yield _message_line(message_id, session_id, sender, text, timestamp)
+    yield json.dumps({"type": "end", "sessions": stats["sessions"], "messages": stats["messages"]})
+
+def export_history(path: str, compress: bool | None = None, batch_size: int = EXPORT_BATCH_SIZE,
+                   on_progress=None) -> dict:
+    """
+    Exporta todo o histórico para `path` ("-" = saída padrão). Com compress=None, usa gzip se o
+    nome terminar em ".gz". Retorna as contagens, os bytes gravados e a duração.
+    """
+    compress = path.endswith(".gz") if compress is None else compress
+    partial = None if path == "-" else path + ".partial"
+    raw = sys.stdout.buffer if partial is None else open(partial, "wb")
+    out = gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=EXPORT_GZIP_LEVEL) if compress else raw
+    stats = {}
+    started = time.perf_counter()
+    try:
+        chunk, chunks = [], 0
+        for line in iter_export_lines(batch_size, stats):
+            chunk.append(line)
+            if len(chunk) >= _WRITE_CHUNK_LINES:
+                out.write(("\n".join(chunk) + "\n").encode("utf-8"))
+                chunk.clear()
+                chunks += 1
+                if on_progress is not None and chunks % 50 == 0:
+                    on_progress(stats)
+        out.write(("\n".join(chunk) + "\n").encode("utf-8"))
+        if compress:
+            out.close()  # Grava o final do gzip (não fecha `raw`)
+        raw.flush()
+    except BaseException:
+        if partial is not None:
+            raw.close()
+            os.remove(partial)
+        raise
+    if partial is not None:
+        raw.close()
+        os.replace(partial, path)
+        stats["bytes"] = os.path.getsize(path)
+    stats["seconds"] = time.perf_counter() - started
+    return stats
+
+
+# --- Importação ---
+
+def _open_lines(path: str):
+    if path == "-":
+        stream = sys.stdin.buffer
+        return gzip.GzipFile(fileobj=stream) if stream.peek(2)[:2] == _GZIP_MAGIC else stream
+    with open(path, "rb") as probe:
+        is_gzip = probe.read(2) == _GZIP_MAGIC
+    return gzip.open(path, "rb") if is_gzip else open(path, "rb")
+
+class _Batch:
+    """Sessões e mensagens lidas desde a última transação, ainda com os ids do arquivo."""
+
+    def __init__(self):
+        self.sessions: list[tuple] = []  # (id no arquivo, start_time, title, message_count, last_activity, preview)
+        self.messages: list[tuple] = []  # (id da sessão no arquivo, sender, text, timestamp)
+
+def _write_batch(batch: _Batch, progress: dict, lines_done: int, finished: bool = False):
+    """Grava o lote e o progresso na mesma transação; atualiza `progress` (sessão em andamento, contagens)."""
+    with engine.begin() as conn:
+        # IMMEDIATE: trava a escrita desde já, então os ids acima de last_id são todos deste lote
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+        last_id = conn.exec_driver_sql("SELECT COALESCE(MAX(id), 0) FROM chat_messages").scalar()
+        session_ids = {}
+        if progress["current_source_session_id"] is not None:
+            session_ids[progress["current_source_session_id"]] = progress["current_session_id"]
+        for source_id, *fields in batch.sessions:
+            # Uma a uma, para o SQLite escolher o id (lastrowid); são poucas perto das mensagens
+            session_ids[source_id] = conn.exec_driver_sql(
+                "INSERT INTO chat_sessions (start_time, title, message_count, last_activity, preview) "
+                "VALUES (?, ?, ?, ?, ?)", tuple(fields)).lastrowid
+        if batch.messages:
+            # O gatilho do FTS5 por linha custa ~4x mais que indexar o lote inteiro de uma vez; como o DDL
+            # faz parte da transação, uma interrupção desfaz tudo e o gatilho nunca fica faltando
+            conn.exec_driver_sql(f"DROP TRIGGER {FTS_INSERT_TRIGGER}")
+            conn.exec_driver_sql(
+                "INSERT INTO chat_messages (session_id, sender, text, timestamp) VALUES (?, ?, ?, ?)",
+                [(session_ids[source_id], sender, text, timestamp) for source_id, sender, text, timestamp in batch.messages])
+            conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}(rowid, text) SELECT id, text FROM chat_messages WHERE id > ?",
+                                 (last_id,))
+            conn.exec_driver_sql(FTS_INSERT_TRIGGER_SQL)
+        if batch.sessions:
+            progress["current_source_session_id"] = batch.sessions[-1][0]
+            progress["current_session_id"] = session_ids[batch.sessions[-1][0]]
+        progress["sessions"] += len(batch.sessions)
+        progress["messages"] += len(batch.messages)
+        progress["lines_done"] = lines_done
+        conn.execute(update(ChatImport).where(ChatImport.export_id == progress["export_id"]).values(
+            lines_done=lines_done, sessions=progress["sessions"], messages=progress["messages"],
+            current_source_session_id=progress["current_source_session_id"],
+            current_session_id=progress["current_session_id"], finished_at=datetime.utcnow() if finished else None))
+    batch.sessions.clear()
+    batch.messages.clear()
+
+def import_history(path: str, batch_size: int = IMPORT_BATCH_SIZE, force: bool = False, on_progress=None) -> dict:
+    """
+    Importa uma exportação de `export_history` ("-" = entrada padrão) como sessões novas. Se a mesma
+    exportação já foi interrompida antes, continua de onde parou; se já foi concluída, recusa
+    (a menos que force=True, que importa tudo de novo).
+    """
+    ensure_db_ready()
+    started = time.perf_counter()
+    with _open_lines(path) as lines:
+        header = json.loads(next(lines, b"{}"))
+        if header.get("format") != EXPORT_FORMAT:
+            raise ValueError(f"{path} não é uma exportação do DK Chat.")
+        if header.get("version", 0) > EXPORT_FORMAT_VERSION:
+            raise ValueError(f"Exportação na versão {header['version']}; esta versão do DK Chat lê até a {EXPORT_FORMAT_VERSION}.")
+
+        export_id = header["export_id"]
+        with engine.begin() as conn:
+            previous = conn.execute(select(ChatImport).where(ChatImport.export_id == export_id)).first()
+            if previous is not None and previous.finished_at is not None and not force:
+                raise ValueError(f"Esta exportação já foi importada em {previous.finished_at:%d/%m/%Y %H:%M} "
+                                 f"({previous.messages:,} mensagens). Use --force para importar de novo.")
+            if previous is None or force:
+                conn.execute(delete(ChatImport).where(ChatImport.export_id == export_id))
+                conn.execute(insert(ChatImport).values(export_id=export_id, source=path, lines_done=1))
+                previous = conn.execute(select(ChatImport).where(ChatImport.export_id == export_id)).first()
+        progress = {
+            "export_id": export_id, "lines_done": previous.lines_done, "sessions": previous.sessions,
+            "messages": previous.messages, "current_source_session_id": previous.current_source_session_id,
+            "current_session_id": previous.current_session_id,
+        }
+        resumed_from = progress["lines_done"] if previous.lines_done > 1 else None
+        already_imported = progress["messages"]
+        if resumed_from:
+            print(f"DK Chat: Retomando a importação da linha {resumed_from + 1:,} "
+                  f"({progress['messages']:,} mensagens já importadas).")
+
+        batch = _Batch()
+        footer = None
+        line_number = 1
+        for line_number, line in enumerate(lines, start=2):
+            if line_number <= progress["lines_done"]:
+                continue  # Já gravada em uma execução anterior
+            record = json.loads(line)
+            kind = record["type"]
+            if kind == "message":
+                open_session = batch.sessions[-1][0] if batch.sessions else progress["current_source_session_id"]
+                if record["session_id"] != open_session:
+                    raise ValueError(f"Linha {line_number}: mensagem fora da sua sessão ({record['session_id']}).")
+                batch.messages.append((record["session_id"], record["sender"], record["text"],
+                                       _db_datetime(record["timestamp"])))
+                if len(batch.messages) >= batch_size:
+                    _write_batch(batch, progress, line_number)
+                    if on_progress is not None:
+                        on_progress(progress)
+            elif kind == "session":
+                batch.sessions.append((record["id"], _db_datetime(record["start_time"]), record["title"],
+                                       record["message_count"], _db_datetime(record["last_activity"]), record["preview"]))
+            elif kind == "end":
+                footer = record
+                break
+        _write_batch(batch, progress, line_number, finished=footer is not None)
+
+    result = {key: progress[key] for key in ("sessions", "messages")}
+    result.update(imported_now=progress["messages"] - already_imported, seconds=time.perf_counter() - started,
+                  resumed_from_line=resumed_from, complete=footer is not None)
+    if footer is not None:
+        if (footer["sessions"], footer["messages"]) != (progress["sessions"], progress["messages"]):
+            print(f"DK Chat: Aviso: o arquivo anuncia {footer['sessions']:,} sessões e {footer['messages']:,} "
+                  f"mensagens, mas foram importadas {progress['sessions']:,} e {progress['messages']:,}.")
+    else:
+        print("DK Chat: O arquivo terminou antes do registro final (exportação incompleta?). "
+              "O que foi lido está gravado; importe o arquivo completo para continuar.")
+    return result
@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable
+
+from .tracing import TurnTrace, record_stage
+
+# Número máximo de turnos executando ao mesmo tempo no processo (todas as páginas/sessões)
+MAX_TURN_WORKERS = int(os.getenv("DK_CHAT_MAX_TURN_WORKERS", "8"))
+
+# Workers somados de todos os TurnPipeline do processo (ex.: o do app e o do server.py)
+_total_workers = 0
+_total_workers_lock = threading.Lock()
+
+
+class TurnCancelled(Exception):
+    """Levantada dentro de um turno quando o usuário o cancela."""
+
+
+class Turn:
+    """
+    Um turno de conversa (mensagem do usuário -> resposta do bot) executado fora do thread da UI.
+    `future` recebe o resultado do job ou a exceção (inclusive `TurnCancelled`).
+    """
+    def __init__(self, session_id: int, user_message: str, source: str = "app"):
+        self.session_id = session_id
+        self.user_message = user_message
+        self.trace = TurnTrace(session_id, user_message, source)
+        self.future: Future = Future()
+        self._cancel_event = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        # O job verifica o cancelamento entre etapas (e entre trechos do stream)
+        self._cancel_event.set()
+
+    def raise_if_cancelled(self):
+        if self._cancel_event.is_set():
+            raise TurnCancelled()
+
+    def add_done_callback(self, fn: Callable[["Turn"], None]):
+        self.future.add_done_callback(lambda _: fn(self))
+
+
+class TurnPipeline:
+    """
+    Executa turnos em um pool de threads limitado.
+    Cada sessão tem sua própria fila e no máximo um turno em execução por vez,
+    de modo que uma sessão com muitos turnos enfileirados não ocupa todos os workers
+    e as demais sessões continuam sendo atendidas.
+    """
+    def __init__(self, max_workers: int = MAX_TURN_WORKERS, source: str = "app"):
+        global _total_workers
+        self.source = source  # Origem dos turnos nos traces ("app" ou "server")
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dk-chat-turn")
+        with _total_workers_lock:
+            _total_workers += max_workers
+        self._lock = threading.Lock()
+        self._queues: dict[int, deque] = {}
+        self._running: set[int] = set()
+
+    def submit(self, session_id: int, user_message: str, job: Callable[[Turn], object]) -> Turn:
+        turn = Turn(session_id, user_message, self.source)
+        with self._lock:
+            self._queues.setdefault(session_id, deque()).append((turn, job))
+            if session_id not in self._running:
+                self._running.add(session_id)
+                self._executor.submit(self._drain, session_id)
+        return turn
+
+    def _drain(self, session_id: int):
+        # Executa um turno da sessão e devolve o worker ao pool; o próximo turno da
+        # mesma sessão volta para o fim da fila do executor.
+        with self._lock:
+            turn, job = self._queues[session_id].popleft()
+        try:
+            with turn.trace.activate():
+                record_stage("queue", turn.trace.started)
+                try:
+                    result = job(turn)
+                except BaseException as e:
+                    turn.trace.finish("cancelled" if isinstance(e, TurnCancelled) else "error")
+                    raise
+                turn.trace.finish("cancelled" if turn.cancelled else "ok")
+            turn.future.set_result(result)
+        except BaseException as e:
+            turn.future.set_exception(e)
+        finally:
+            with self._lock:
+                if self._queues[session_id]:
+                    self._executor.submit(self._drain, session_id)
+                else:
+                    del self._queues[session_id]
+                    self._running.discard(session_id)
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+def total_turn_workers() -> int:
+    """Turnos que podem executar ao mesmo tempo no processo, somando todos os pipelines criados."""
+    with _total_workers_lock:
+        return _total_workers
+
+
+_pipeline: TurnPipeline | None = None
+_pipeline_lock = threading.Lock()
+
+def get_turn_pipeline() -> TurnPipeline:
+    """Pipeline compartilhado por todas as páginas e sessões do processo."""
+    global _pipeline
+    with _pipeline_lock:
+        if _pipeline is None:
+            _pipeline = TurnPipeline()
+        return _pipeline
@@ -0,0 +1,71 @@
+import threading
+import time
+from typing import Callable
+
+# Os módulos pesados (SQLAlchemy, SDKs, requests) só são importados dentro das etapas,
+# para que importar este módulo não atrase a primeira tela.
+
+def _warm_database():
+    from sqlalchemy import text
+    from .db_manager import get_db
+    with get_db() as db:  # Verifica o esquema e abre a primeira conexão (pragmas aplicados)
+        db.execute(text("SELECT 1"))
+
+def _warm_chat_logic():
+    from .chat_logic import get_chat_logic
+    get_chat_logic()
+
+def _warm_gemini():
+    from .registry import get_provider
+    get_provider("gemini")
+
+def _warm_deepseek():
+    from .registry import get_provider
+    client = get_provider("deepseek")
+    if client is not None:
+        client.warm_up()
+
+def _start_archive_maintenance():
+    # Arquiva as conversas inativas em uma thread própria; o aquecimento não espera
+    from .archive import start_maintenance
+    start_maintenance()
+
+WARMUP_STEPS: list[tuple[str, Callable[[], None]]] = [
+    ("banco de dados", _warm_database),
+    ("lógica do chat", _warm_chat_logic),
+    ("SDK do Gemini", _warm_gemini),
+    ("conexão DeepSeek", _warm_deepseek),
+    ("arquivo de conversas", _start_archive_maintenance),
+]
+
+def warm_up(extra_steps: list[tuple[str, Callable[[], None]]] = ()) -> dict[str, float]:
+    """
+    Executa as etapas de aquecimento em sequência e retorna a duração (ms) de cada uma.
+    Uma etapa com erro é registrada e ignorada: o mesmo trabalho será refeito sob demanda.
+    """
+    timings = {}
+    for name, step in [*extra_steps, *WARMUP_STEPS]:
+        started = time.perf_counter()
+        try:
+            step()
+        except Exception as e:
+            print(f"DK Chat: Aquecimento '{name}' falhou: {e}")
+        timings[name] = (time.perf_counter() - started) * 1000
+    summary = ", ".join(f"{name} {ms:.0f} ms" for name, ms in timings.items())
+    print(f"DK Chat: Aquecimento concluído ({summary}).")
+    return timings
+
+_warmup_thread: threading.Thread | None = None
+_warmup_lock = threading.Lock()
+
+def start_warmup(extra_steps: list[tuple[str, Callable[[], None]]] = ()) -> threading.Thread:
+    """
+    Roda `warm_up` em segundo plano (ex.: enquanto a tela inicial é exibida), uma única vez por
+    processo: as páginas abertas depois da primeira recebem a mesma thread.
+    """
+    global _warmup_thread
+    with _warmup_lock:
+        if _warmup_thread is None:
+            _warmup_thread = threading.Thread(target=warm_up, args=(list(extra_steps),), name="dk-chat-warmup", daemon=True)
+            _warmup_thread.start()
+        return _warmup_thread
@@ -0,0 +1,177 @@
+import atexit
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from .archive import restore_session
+from .db_manager import get_db, save_message, notify_message_saved, session_stats_update
+from .models import ChatMessage, engine
+from .tracing import stage
+
+# "immediate": cada mensagem é gravada (e sincronizada) na hora, como antes.
+# "batched": as mensagens vão para uma fila e um thread dedicado grava lotes em uma única transação.
+DB_DURABILITY = os.getenv("DK_CHAT_DB_DURABILITY", "immediate")
+WRITE_BATCH_SIZE = int(os.getenv("DK_CHAT_WRITE_BATCH_SIZE", "256"))
+# Tempo máximo (s) que uma mensagem espera por outras para formar um lote
+WRITE_FLUSH_INTERVAL = float(os.getenv("DK_CHAT_WRITE_FLUSH_INTERVAL", "0.02"))
+
+
+class _PendingMessage:
+    __slots__ = ("session_id", "sender", "text", "timestamp", "future")
+
+    def __init__(self, session_id: int, sender: str, text: str):
+        self.session_id = session_id
+        self.sender = sender
+        self.text = text
+        self.timestamp = datetime.utcnow()
+        self.future: Future = Future()
+
+
+class MessageWriter:
+    """
+    Gravação "write-behind" das mensagens com commit em grupo: um thread dedicado junta
+    as mensagens enfileiradas e as insere em lote (INSERT ... RETURNING) em uma única transação.
+    O future de cada mensagem recebe a `ChatMessage` gravada, com o id gerado pelo banco
+    (ou a exceção, se o lote falhar).
+    """
+    _STOP = object()
+
+    def __init__(self, batch_size: int = WRITE_BATCH_SIZE, flush_interval: float = WRITE_FLUSH_INTERVAL):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: queue.Queue = queue.Queue()
+        self._stopped = False
+        self.batches = 0
+        self.messages_written = 0
+        self._thread = threading.Thread(target=self._run, name="dk-chat-writer", daemon=True)
+        self._thread.start()
+
+    def enqueue(self, session_id: int, sender: str, text: str) -> Future:
+        if self._stopped:
+            raise RuntimeError("O gravador de mensagens já foi encerrado.")
+        pending = _PendingMessage(session_id, sender, text)
+        self._queue.put(pending)
+        return pending.future
+
+    def flush(self, timeout: float | None = None):
+        """Bloqueia até que tudo o que foi enfileirado antes desta chamada esteja gravado."""
+        marker = Future()
+        self._queue.put(marker)
+        marker.result(timeout=timeout)
+
+    def shutdown(self, timeout: float | None = 10):
+        if self._stopped:
+            return
+        self._stopped = True
+        self._queue.put(self._STOP)
+        self._thread.join(timeout=timeout)
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            batch, markers, stop = [], [], False
+            while True:
+                if item is self._STOP:
+                    stop = True
+                elif isinstance(item, _PendingMessage):
+                    batch.append(item)
+                else:
+                    markers.append(item)
+                if stop or len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = self._queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write_batch(batch)
+            for marker in markers:
+                marker.set_result(None)
+            if stop:
+                # Grava o que ainda estiver na fila antes de sair
+                remaining = []
+                while not self._queue.empty():
+                    item = self._queue.get_nowait()
+                    if isinstance(item, _PendingMessage):
+                        remaining.append(item)
+                    elif isinstance(item, Future):
+                        item.set_result(None)
+                if remaining:
+                    self._write_batch(remaining)
+                return
+
+    def _write_batch(self, batch: list[_PendingMessage]):
+        rows = [
+            {"session_id": p.session_id, "sender": p.sender, "text": p.text, "timestamp": p.timestamp}
+            for p in batch
+        ]
+        try:
+            with stage("db_write_batch"), engine.begin() as conn:
+                # O pysqlite só abre a transação no primeiro INSERT; IMMEDIATE trava a escrita antes das
+                # leituras de restore_session, para nenhum outro processo/conexão gravar entre elas e o INSERT
+                conn.exec_driver_sql("BEGIN IMMEDIATE")
+                for session_id in {p.session_id for p in batch}:
+                    restore_session(conn, session_id)  # Conversa arquivada voltando a ser usada
+                # INSERT ... RETURNING: o id de cada linha vem do próprio banco, na ordem das linhas do lote
+                table = ChatMessage.__table__
+                ids = conn.execute(
+                    insert(table).returning(table.c.id, sort_by_parameter_order=True), rows
+                ).scalars().all()
+                # Estatísticas das conversas: um UPDATE por sessão do lote, na mesma transação
+                by_session: dict[int, list] = {}
+                for p in batch:
+                    by_session.setdefault(p.session_id, []).append((p.sender, p.text, p.timestamp))
+                for session_id, messages in by_session.items():
+                    conn.execute(session_stats_update(session_id, messages))
+        except Exception as e:
+            print(f"DK Chat: Erro ao gravar lote de {len(batch)} mensagens: {e}")
+            for pending in batch:
+                pending.future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.messages_written += len(batch)
+        for message_id, pending in zip(ids, batch):
+            message = ChatMessage(
+                id=message_id, session_id=pending.session_id, sender=pending.sender,
+                text=pending.text, timestamp=pending.timestamp,
+            )
+            notify_message_saved(message)
+            pending.future.set_result(message)
+
+
+_writer: MessageWriter | None = None
+_writer_lock = threading.Lock()
+
+def get_message_writer() -> MessageWriter:
+    global _writer
+    with _writer_lock:
+        if _writer is None:
+            _writer = MessageWriter()
+            atexit.register(shutdown_message_writer)
+        return _writer
+
+def shutdown_message_writer():
+    """Hook de encerramento: grava as mensagens pendentes e para o thread do gravador."""
+    with _writer_lock:
+        writer = _writer
+    if writer is not None:
+        writer.shutdown()
+
+def persist_message(session_id: int, sender: str, text: str) -> Future:
+    """
+    Grava uma mensagem respeitando DK_CHAT_DB_DURABILITY.
+    Retorna um future com a `ChatMessage` gravada (id e timestamp preenchidos);
+    no modo "immediate" ele já vem resolvido.
+    """
+    if DB_DURABILITY == "batched":
+        return get_message_writer().enqueue(session_id, sender, text)
+    future = Future()
+    with get_db() as db:
+        future.set_result(save_message(db, session_id, sender, text))
+    return future
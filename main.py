@@ -1,8 +1,13 @@
 import flet as ft
 import os
+import time
 from ui.splash_screen import SplashScreen
-from ui.chat_screen import ChatScreen
-from core.db_manager import get_db, create_chat_session, get_last_session
+from core.warmup import start_warmup
+
+# ui.chat_screen e core.db_manager (SDKs, SQLAlchemy, esquema do banco) são importados sob demanda:
+# a tela inicial aparece primeiro e o aquecimento em segundo plano prepara o resto.
+
+_PROCESS_START = time.perf_counter()
 
 # Definir o diretório de assets
 ASSETS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), 'assets'))
@@ -21,9 +26,16 @@ def main(page: ft.Page):
         print(f"AVISO: Diretório de assets não encontrado em {ASSETS_DIR}. Logos e imagens podem não carregar.")
 
     current_session_id = None
+    # As telas são reaproveitadas entre navegações: voltar ao chat não recria a view
+    # nem recarrega o histórico. O chat é guardado por sessão.
+    splash_view = None
+    sessions_view = None
+    chat_views: dict[int, "ChatScreen"] = {}
+    first_route = True
 
     def get_or_create_current_session():
         nonlocal current_session_id
+        from core.db_manager import get_db, create_chat_session
         with get_db() as db:
             if current_session_id is None:
                 session = create_chat_session(db)
@@ -34,19 +46,39 @@ def main(page: ft.Page):
         return current_session_id
 
     def route_change(route):
+        nonlocal splash_view, sessions_view, first_route
+        started = time.perf_counter()
         page.views.clear()
         
-        page.views.append(
-            SplashScreen(page, start_chat_action)
-        )
+        if splash_view is None:
+            splash_view = SplashScreen(page, start_chat_action, show_sessions_action)
+        page.views.append(splash_view)
 
-        if page.route == "/chat":
+        reused = True
+        if page.route == "/sessions":
+            if sessions_view is None:
+                from ui.sessions_screen import SessionsScreen
+                reused = False
+                sessions_view = SessionsScreen(page, open_session_action, new_session_action)
+            page.views.append(sessions_view)
+            sessions_view.refresh()
+        elif page.route == "/chat":
             session_id_for_chat = get_or_create_current_session()
-            page.views.append(
-                ChatScreen(page, session_id_for_chat)
-            )
+            chat_view = chat_views.get(session_id_for_chat)
+            if chat_view is None:
+                from ui.chat_screen import ChatScreen
+                reused = False
+                chat_view = ChatScreen(page, session_id_for_chat)
+                chat_views[session_id_for_chat] = chat_view
+            page.views.append(chat_view)
         page.update()
 
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        if first_route:
+            first_route = False
+            print(f"DK Chat: Primeira tela ({page.route}) exibida {(time.perf_counter() - _PROCESS_START) * 1000:.0f} ms após o início do processo.")
+        print(f"DK Chat: Navegação para {page.route} em {elapsed_ms:.1f} ms ({'tela reaproveitada' if reused else 'tela criada'}).")
+
     def view_pop(view):
         page.views.pop()
         top_view = page.views[-1]
@@ -55,13 +87,43 @@ def main(page: ft.Page):
     def start_chat_action():
         page.go("/chat")
 
+    def show_sessions_action():
+        page.go("/sessions")
+
+    def open_session_action(session_id: int):
+        nonlocal current_session_id
+        current_session_id = session_id
+        page.go("/chat")
+
+    def new_session_action():
+        nonlocal current_session_id
+        current_session_id = None # get_or_create_current_session cria uma nova
+        page.go("/chat")
+
+    def page_close(e):
+        nonlocal splash_view, sessions_view
+        # Sessão da página encerrada: solta as telas guardadas (e o histórico carregado em cada chat)
+        chat_views.clear()
+        splash_view = None
+        sessions_view = None
+
     page.on_route_change = route_change
     page.on_view_pop = view_pop
+    page.on_close = page_close
     page.go(page.route)
 
+    # Enquanto a tela inicial é exibida: importa a tela do chat e os SDKs, abre o banco
+    # e pré-conecta o pool HTTP, para que "Iniciar Chat" seja imediato; também abre o endpoint /metrics.
+    # Roda só na primeira página do processo; as seguintes já encontram tudo aquecido
+    start_warmup([
+        ("tela do chat", lambda: __import__("ui.chat_screen")),
+        ("endpoint de métricas", lambda: __import__("core.tracing").tracing.start_metrics_server()),
+    ])
+
 if __name__ == "__main__":
-    from core.models import create_db_and_tables
-    create_db_and_tables()
-    
     # Passe assets_dir para ft.app também, especialmente útil para builds web/desktop
-    ft.app(target=main, assets_dir=ASSETS_DIR)
\ No newline at end of file
+    ft.app(target=main, assets_dir=ASSETS_DIR)
+
+    # Grava as mensagens que ainda estiverem na fila do modo "batched" antes de sair
+    from core.write_behind import shutdown_message_writer
+    shutdown_message_writer()
\ No newline at end of file
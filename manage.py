@@ -0,0 +1,156 @@
+"""
+Comandos de manutenção do banco do DK Chat.
+
+Uso: python manage.py <comando> [opções]
+  fts-backfill             indexa (ou reindexa) todo o histórico para a busca textual
+  semantic-cache-rebuild   reconstrói o índice do cache semântico de respostas (DK_CHAT_SEMANTIC_CACHE)
+  memory-index             indexa as mensagens novas para a memória de longo prazo (DK_CHAT_MEMORY)
+  archive                  arquiva as sessões inativas e mostra tamanho e latência antes e depois
+  vacuum                   VACUUM completo (ativa o auto_vacuum incremental em bancos antigos)
+  export <arquivo>         exporta o histórico em NDJSON (gzip se terminar em .gz; "-" = saída padrão)
+  import <arquivo>         importa uma exportação como conversas novas (retoma se foi interrompida)
+"""
+import argparse
+import contextlib
+import sys
+import time
+
+def fts_backfill(args):
+    from sqlalchemy import text
+    from core.models import engine, ensure_db_ready, rebuild_search_index
+
+    ensure_db_ready()
+    with engine.connect() as conn:
+        total = conn.execute(text("SELECT COUNT(*) FROM chat_messages")).scalar()
+    print(f"DK Chat: Indexando {total:,} mensagens para a busca...")
+    started = time.perf_counter()
+    rebuild_search_index()
+    print(f"DK Chat: Índice de busca reconstruído em {time.perf_counter() - started:.1f}s.")
+
+def semantic_cache_rebuild(args):
+    from core.semantic_cache import SemanticCache
+
+    cache = SemanticCache(listen=False)
+    cache.rebuild()
+    print(f"DK Chat: Cache semântico com {cache.count:,} pares em {cache.directory}.")
+
+def memory_index(args):
+    from core.memory_index import MemoryIndex
+
+    index = MemoryIndex(background=False)
+    started = time.perf_counter()
+    indexed = index.index_pending()
+    stats = index.stats()
+    print(f"DK Chat: {indexed:,} mensagens indexadas em {time.perf_counter() - started:.1f}s; "
+          f"{stats['chunks']:,} trechos em {stats['segments']} segmento(s) em {index.directory}.")
+
+def _print_report(title: str, report: dict, before: dict | None = None):
+    print(f"\n{title}")
+    rows = [
+        ("arquivo do banco (MB)", report.get("file_bytes", 0) / 1e6, before and before.get("file_bytes", 0) / 1e6),
+        ("páginas livres", report["freelist_count"], before and before["freelist_count"]),
+        ("mensagens em chat_messages", report["hot_messages"], before and before["hot_messages"]),
+        ("texto em chat_messages (MB)", report["hot_text_chars"] / 1e6, before and before["hot_text_chars"] / 1e6),
+        ("sessões arquivadas", report["archived_sessions"], before and before["archived_sessions"]),
+        ("arquivo: original -> comprimido (MB)",
+         f"{report['archived_raw_bytes'] / 1e6:.1f} -> {report['archived_bytes'] / 1e6:.1f}", None),
+    ]
+    rows += [(f"latência {name} (ms)", value, before and before.get("latency_ms", {}).get(name))
+             for name, value in report.get("latency_ms", {}).items()]
+    for label, value, previous in rows:
+        value_text = f"{value:,.2f}" if isinstance(value, float) else f"{value:,}" if isinstance(value, int) else value
+        previous_text = "" if previous is None else (f"   (antes: {previous:,.2f})" if isinstance(previous, float) else f"   (antes: {previous:,})")
+        print(f"  {label:<40} {value_text}{previous_text}")
+    if report["auto_vacuum"] != 2:
+        print("  auto_vacuum não é incremental: rode 'python manage.py vacuum' uma vez para ativá-lo.")
+
+def archive(args):
+    from core.archive import ARCHIVE_AFTER_DAYS, ARCHIVE_CODEC, archive_idle_sessions, incremental_vacuum, storage_report
+
+    before = storage_report()
+    _print_report("Antes", before)
+    if args.report_only:
+        return
+    days = ARCHIVE_AFTER_DAYS if args.days is None else args.days
+    archived = archive_idle_sessions(days, args.codec or ARCHIVE_CODEC)
+    print(f"\nDK Chat: {archived['sessions']:,} sessões arquivadas ({archived['messages']:,} mensagens) "
+          f"em {archived['seconds']:.1f}s; {archived['raw_bytes'] / 1e6:.1f} MB -> {archived['stored_bytes'] / 1e6:.1f} MB.")
+    vacuum = incremental_vacuum()
+    print(f"DK Chat: incremental_vacuum em {vacuum['steps']} passo(s): "
+          f"{vacuum['free_pages_before']:,} -> {vacuum['free_pages_after']:,} páginas livres.")
+    _print_report("Depois", storage_report(), before)
+
+def vacuum(args):
+    from core.archive import full_vacuum, storage_report
+
+    before = storage_report(measure_latency=False)
+    started = time.perf_counter()
+    full_vacuum()
+    print(f"DK Chat: VACUUM concluído em {time.perf_counter() - started:.1f}s.")
+    _print_report("Depois", storage_report(measure_latency=False), before)
+
+def export(args):
+    from core.models import ensure_db_ready
+    from core.transfer import export_history
+
+    # Os avisos de migração vão para stderr, para não se misturarem ao NDJSON em "export -"
+    with contextlib.redirect_stdout(sys.stderr):
+        ensure_db_ready()
+
+    def progress(stats):
+        print(f"DK Chat: {stats['messages']:,} mensagens exportadas...", file=sys.stderr)
+
+    stats = export_history(args.path, compress=True if args.gzip else None, on_progress=progress)
+    size = f", {stats['bytes'] / 1e6:.1f} MB" if "bytes" in stats else ""
+    print(f"DK Chat: {stats['sessions']:,} sessões e {stats['messages']:,} mensagens exportadas em "
+          f"{stats['seconds']:.1f}s ({stats['messages'] / max(stats['seconds'], 1e-9):,.0f} msg/s{size}).", file=sys.stderr)
+
+def import_(args):
+    from core.transfer import IMPORT_BATCH_SIZE, import_history
+
+    def progress(state):
+        print(f"DK Chat: {state['messages']:,} mensagens importadas...")
+
+    try:
+        result = import_history(args.path, batch_size=args.batch_size or IMPORT_BATCH_SIZE, force=args.force,
+                                on_progress=progress)
+    except ValueError as e:
+        sys.exit(f"DK Chat: {e}")
+    print(f"DK Chat: {result['sessions']:,} sessões e {result['messages']:,} mensagens importadas; "
+          f"{result['imported_now']:,} nesta execução, em {result['seconds']:.1f}s "
+          f"({result['imported_now'] / max(result['seconds'], 1e-9):,.0f} msg/s).")
+    if result["complete"]:
+        print("DK Chat: Para servir as respostas importadas pelo cache semântico, rode: python manage.py semantic-cache-rebuild")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    backfill = commands.add_parser("fts-backfill", help="Indexa todo o histórico para a busca textual")
+    backfill.set_defaults(handler=fts_backfill)
+    semantic = commands.add_parser("semantic-cache-rebuild", help="Reconstrói o índice do cache semântico")
+    semantic.set_defaults(handler=semantic_cache_rebuild)
+    memory = commands.add_parser("memory-index", help="Indexa o histórico para a memória de longo prazo")
+    memory.set_defaults(handler=memory_index)
+    archiving = commands.add_parser("archive", help="Arquiva as sessões inativas e devolve o espaço em disco")
+    archiving.add_argument("--days", type=int, default=None, help="Inatividade mínima (padrão: DK_CHAT_ARCHIVE_AFTER_DAYS)")
+    archiving.add_argument("--codec", choices=["zlib", "zstd"], default=None)
+    archiving.add_argument("--report-only", action="store_true", help="Só mostra o relatório, sem arquivar")
+    archiving.set_defaults(handler=archive)
+    full = commands.add_parser("vacuum", help="VACUUM completo do banco")
+    full.set_defaults(handler=vacuum)
+    exporting = commands.add_parser("export", help="Exporta o histórico em NDJSON")
+    exporting.add_argument("path", help='Arquivo de saída (".gz" comprime; "-" = saída padrão)')
+    exporting.add_argument("--gzip", action="store_true", help="Comprime mesmo sem a extensão .gz")
+    exporting.set_defaults(handler=export)
+    importing = commands.add_parser("import", help="Importa uma exportação NDJSON (gzip detectado sozinho)")
+    importing.add_argument("path", help='Arquivo exportado ("-" = entrada padrão)')
+    importing.add_argument("--batch-size", type=int, default=None, help="Mensagens por transação (padrão: DK_CHAT_IMPORT_BATCH_SIZE)")
+    importing.add_argument("--force", action="store_true", help="Importa de novo uma exportação já importada")
+    importing.set_defaults(handler=import_)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,316 @@
+"""
+Servidor HTTP/WebSocket do DK Chat, sem interface gráfica, para front-ends próprios e testes de carga.
+Roda ao lado do app Flet (main.py), com o mesmo banco e a mesma lógica de conversa.
+
+Rotas:
+  POST   /sessions                          cria uma conversa
+  GET    /sessions?before_activity=&before_id=&limit=
+                                            lista as conversas (mais recentes primeiro)
+  GET    /sessions/{id}/messages?before_timestamp=&before_id=&limit=
+                                            histórico paginado (ordem cronológica)
+  POST   /sessions/{id}/messages            envia {"text": "..."}; a resposta chega por SSE
+  GET    /sessions/{id}/ws                  WebSocket: envia {"text": "..."} ou {"type": "cancel"}
+  DELETE /sessions/{id}                     exclui a conversa e suas mensagens
+  GET    /metrics                           histogramas por etapa dos turnos (formato do Prometheus)
+  GET    /metrics/providers                 limites de taxa, chamadas em andamento e disjuntores dos provedores
+
+Eventos da resposta (SSE e WebSocket): chunk {text}, error {message}, cancelled, done {message_id, text}.
+
+Uso: python server.py [--host 127.0.0.1] [--port 8080]
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+from datetime import datetime
+from typing import Awaitable, Callable
+
+from aiohttp import web, WSMsgType
+
+from core.chat_logic import get_chat_logic
+from core.conversation import get_conversation_state
+from core.db_manager import (
+    get_db, create_chat_session, get_chat_session, get_sessions_page, get_messages_page,
+    delete_session_and_messages,
+)
+from core.llm_providers import provider_metrics
+from core.tracing import render_metrics, stage
+from core.turn_pipeline import Turn, TurnCancelled, TurnPipeline
+from core.warmup import warm_up
+from core.write_behind import persist_message, shutdown_message_writer
+
+SERVER_HOST = os.getenv("DK_CHAT_SERVER_HOST", "127.0.0.1")
+SERVER_PORT = int(os.getenv("DK_CHAT_SERVER_PORT", "8080"))
+# Turnos executando ao mesmo tempo (threads); as chamadas aos provedores são limitadas à parte,
+# em core.llm_providers (DK_CHAT_<PROVEDOR>_MAX_IN_FLIGHT), só enquanto a API está sendo chamada
+SERVER_TURN_WORKERS = int(os.getenv("DK_CHAT_SERVER_TURN_WORKERS", "64"))
+# Tempo (s) que o encerramento espera pelos turnos em andamento antes de cancelá-los
+SERVER_SHUTDOWN_GRACE = float(os.getenv("DK_CHAT_SERVER_SHUTDOWN_GRACE", "20"))
+MAX_PAGE_SIZE = 200
+
+SendEvent = Callable[[str, dict], Awaitable[None]]
+
+
+class ChatService:
+    """Executa os turnos do servidor em um pipeline de threads."""
+
+    def __init__(self):
+        self.chat_logic = get_chat_logic()
+        self.pipeline = TurnPipeline(max_workers=SERVER_TURN_WORKERS, source="server")
+        self.active_turns: set[Turn] = set()
+        self.websockets: set[web.WebSocketResponse] = set()
+        self.accepting = True
+
+    async def run_turn(self, session_id: int, text: str, send: SendEvent,
+                       on_start: Callable[[Turn], None] | None = None):
+        """Executa um turno e repassa os eventos a `send`; se o cliente sair, o turno é cancelado."""
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+
+        def emit(kind: str, payload: dict):
+            loop.call_soon_threadsafe(events.put_nowait, (kind, payload))
+
+        turn = self.pipeline.submit(session_id, text, lambda t: self._turn_job(t, emit))
+        self.active_turns.add(turn)
+        turn.add_done_callback(lambda _: emit("end", {}))
+        if on_start is not None:
+            on_start(turn)
+        try:
+            while True:
+                kind, payload = await events.get()
+                if kind == "end":
+                    break
+                await send(kind, payload)
+        except (ConnectionResetError, asyncio.CancelledError):
+            turn.cancel()
+            raise
+        finally:
+            with contextlib.suppress(BaseException):
+                await asyncio.shield(asyncio.wrap_future(turn.future))
+            self.active_turns.discard(turn)
+
+    def _turn_job(self, turn: Turn, emit: Callable[[str, dict], None]) -> int:
+        """Executado em um worker do pipeline (mesmo fluxo do ChatScreen._run_turn)."""
+        with stage("save_user_message"):
+            persist_message(turn.session_id, "user", turn.user_message).result()
+        conversation = get_conversation_state(turn.session_id)
+        chunks: list[str] = []
+        try:
+            turn.raise_if_cancelled()
+            stream = self.chat_logic.get_response(turn.user_message, stream=True, conversation=conversation)
+            try:
+                for chunk in stream:
+                    turn.raise_if_cancelled()
+                    chunks.append(chunk)
+                    emit("chunk", {"text": chunk})
+            finally:
+                stream.close()  # Interrompe a chamada ao provedor se o turno foi cancelado
+        except TurnCancelled:
+            chunks.append("\n\n(Resposta cancelada.)" if chunks else "(Resposta cancelada.)")
+            emit("cancelled", {})
+        except Exception as ex:
+            print(f"Erro crítico ao obter resposta do bot (sessão {turn.session_id}): {ex}")
+            error_text = f"Ocorreu um erro crítico ao processar sua solicitação: {ex}"
+            chunks.append(f"\n\n{error_text}" if chunks else error_text)
+            emit("error", {"message": error_text})
+
+        text = "".join(chunks) or "Recebi uma resposta vazia."
+        saved = persist_message(turn.session_id, "dk_chat", text).result()
+        emit("done", {"message_id": saved.id, "text": text})
+        return saved.id
+
+    async def shutdown(self):
+        """Para de aceitar turnos, espera os em andamento (até SERVER_SHUTDOWN_GRACE) e cancela o resto."""
+        self.accepting = False
+        for ws in list(self.websockets):
+            await ws.close(code=1001, message=b"Servidor encerrando")
+        pending = [asyncio.wrap_future(turn.future) for turn in list(self.active_turns)]
+        if pending:
+            print(f"DK Chat: Aguardando {len(pending)} turno(s) em andamento antes de encerrar...")
+            _, still_running = await asyncio.wait(pending, timeout=SERVER_SHUTDOWN_GRACE)
+            if still_running:
+                for turn in list(self.active_turns):
+                    turn.cancel()
+                await asyncio.wait(still_running, timeout=5)
+        self.pipeline.shutdown(wait=False)
+
+
+# --- Acesso ao banco: uma sessão do SQLAlchemy por requisição, fora do loop de eventos ---
+
+def _with_db(fn, *args):
+    with get_db() as db:
+        return fn(db, *args)
+
+async def db_call(fn, *args):
+    return await asyncio.to_thread(_with_db, fn, *args)
+
+def _session_dict(row) -> dict:
+    return {
+        "id": row.id,
+        "title": row.title,
+        "message_count": row.message_count,
+        "last_activity": row.last_activity.isoformat() if row.last_activity else None,
+        "preview": row.preview,
+    }
+
+def _message_dict(row) -> dict:
+    return {"id": row.id, "sender": row.sender, "text": row.text, "timestamp": row.timestamp.isoformat()}
+
+def _page_args(request: web.Request, timestamp_param: str) -> tuple[tuple[datetime, int] | None, int]:
+    try:
+        limit = min(MAX_PAGE_SIZE, max(1, int(request.query.get("limit", "50"))))
+        before = None
+        if timestamp_param in request.query and "before_id" in request.query:
+            before = (datetime.fromisoformat(request.query[timestamp_param]), int(request.query["before_id"]))
+    except ValueError:
+        raise web.HTTPBadRequest(text="Parâmetros de paginação inválidos.")
+    return before, limit
+
+async def _require_session(request: web.Request) -> int:
+    try:
+        session_id = int(request.match_info["session_id"])
+    except ValueError:
+        raise web.HTTPNotFound()
+    if await db_call(get_chat_session, session_id) is None:
+        raise web.HTTPNotFound(text="Conversa não encontrada.")
+    return session_id
+
+async def _read_text(request: web.Request) -> str:
+    try:
+        text = (await request.json()).get("text", "").strip()
+    except (ValueError, AttributeError):
+        raise web.HTTPBadRequest(text='Corpo esperado: {"text": "..."}')
+    if not text:
+        raise web.HTTPBadRequest(text="A mensagem está vazia.")
+    return text
+
+def _service(request: web.Request) -> ChatService:
+    service = request.app["service"]
+    if not service.accepting:
+        raise web.HTTPServiceUnavailable(text="Servidor encerrando.")
+    return service
+
+
+# --- Rotas ---
+
+async def create_session(request: web.Request) -> web.Response:
+    session = await db_call(create_chat_session)
+    return web.json_response({"id": session.id, "start_time": session.start_time.isoformat()}, status=201)
+
+async def list_sessions(request: web.Request) -> web.Response:
+    before, limit = _page_args(request, "before_activity")
+    rows = await db_call(get_sessions_page, before, limit)
+    return web.json_response({"sessions": [_session_dict(row) for row in rows]})
+
+async def get_history(request: web.Request) -> web.Response:
+    session_id = await _require_session(request)
+    before, limit = _page_args(request, "before_timestamp")
+    rows = await db_call(get_messages_page, session_id, before, None, limit)
+    return web.json_response({"messages": [_message_dict(row) for row in rows]})
+
+async def delete_session(request: web.Request) -> web.Response:
+    session_id = await _require_session(request)
+    await db_call(delete_session_and_messages, session_id)
+    return web.Response(status=204)
+
+async def get_provider_metrics(request: web.Request) -> web.Response:
+    return web.json_response({"providers": provider_metrics()})
+
+async def get_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=render_metrics(), content_type="text/plain", charset="utf-8")
+
+async def send_message_sse(request: web.Request) -> web.StreamResponse:
+    service = _service(request)
+    session_id = await _require_session(request)
+    text = await _read_text(request)
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Cache-Control": "no-cache"})
+    await response.prepare(request)
+
+    async def send(kind: str, payload: dict):
+        await response.write(f"event: {kind}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    with contextlib.suppress(ConnectionResetError):
+        await service.run_turn(session_id, text, send)
+        await response.write_eof()
+    return response
+
+async def chat_websocket(request: web.Request) -> web.WebSocketResponse:
+    service = _service(request)
+    session_id = await _require_session(request)
+    ws = web.WebSocketResponse(heartbeat=30)
+    await ws.prepare(request)
+    service.websockets.add(ws)
+    turns: set[Turn] = set()
+    tasks: set[asyncio.Task] = set()
+
+    async def send(kind: str, payload: dict):
+        await ws.send_json({"type": kind, **payload})
+
+    try:
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            try:
+                data = json.loads(msg.data)
+            except ValueError:
+                await send("error", {"message": "JSON inválido."})
+                continue
+            if data.get("type") == "cancel":
+                for turn in list(turns):
+                    turn.cancel()
+            elif str(data.get("text", "")).strip():
+                # Vários envios seguidos são enfileirados pelo pipeline, na ordem, por sessão
+                task = asyncio.create_task(
+                    service.run_turn(session_id, str(data["text"]).strip(), send, on_start=turns.add)
+                )
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+    finally:
+        # Cliente desconectou: cancela o que ainda estiver em andamento
+        for turn in list(turns):
+            turn.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        service.websockets.discard(ws)
+    return ws
+
+
+async def _on_startup(app: web.Application):
+    await asyncio.to_thread(warm_up)  # Esquema do banco, lógica do chat, SDKs e pool HTTP
+    app["service"] = ChatService()
+
+async def _on_shutdown(app: web.Application):
+    await app["service"].shutdown()
+
+async def _on_cleanup(app: web.Application):
+    # Grava as mensagens que ainda estiverem na fila do modo "batched"
+    await asyncio.to_thread(shutdown_message_writer)
+
+def create_app() -> web.Application:
+    app = web.Application()
+    app.add_routes([
+        web.post("/sessions", create_session),
+        web.get("/sessions", list_sessions),
+        web.get("/sessions/{session_id}/messages", get_history),
+        web.post("/sessions/{session_id}/messages", send_message_sse),
+        web.get("/sessions/{session_id}/ws", chat_websocket),
+        web.delete("/sessions/{session_id}", delete_session),
+        web.get("/metrics/providers", get_provider_metrics),
+        web.get("/metrics", get_metrics),
+    ])
+    app.on_startup.append(_on_startup)
+    app.on_shutdown.append(_on_shutdown)
+    app.on_cleanup.append(_on_cleanup)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    args = parser.parse_args()
+    web.run_app(create_app(), host=args.host, port=args.port, shutdown_timeout=SERVER_SHUTDOWN_GRACE + 5)
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
 import flet as ft
+import time
+from datetime import datetime
 
 class ChatBubble(ft.Row):
-    def __init__(self, message: str, sender: str, timestamp: str, bubble_max_width: int):
+    # Intervalo mínimo entre atualizações da tela durante o streaming (em segundos)
+    STREAM_UPDATE_INTERVAL = 0.08
+
+    def __init__(self, message: str, sender: str, timestamp: str, bubble_max_width: int, render_scheduler=None):
         super().__init__(expand=True) 
+        self._last_stream_update = 0.0
+        # Com um RenderScheduler, as atualizações do streaming são agrupadas com as do resto da tela
+        self.render_scheduler = render_scheduler
+        # (timestamp, id) da mensagem no banco; None enquanto ela ainda não foi gravada
+        self.message_key: tuple[datetime, int] | None = None
         
         self.vertical_alignment = ft.CrossAxisAlignment.START
         is_user = sender == "user"
@@ -28,16 +38,16 @@ class ChatBubble(ft.Row):
                                                           # ou com cantos arredondados.
             )
 
-        message_content = ft.Text(
+        self.message_content = ft.Text(
             message,
             selectable=True,
         )
 
-        bubble_container = ft.Container(
+        self.bubble_container = bubble_container = ft.Container(
             content=ft.Column(
                 [
                     ft.Text(sender.capitalize(), weight=ft.FontWeight.BOLD, size=12),
-                    message_content,
+                    self.message_content,
                     ft.Text(timestamp, size=10, color=ft.colors.WHITE54, italic=True, text_align=ft.TextAlign.RIGHT)
                 ],
                 spacing=5,
@@ -53,4 +63,35 @@ class ChatBubble(ft.Row):
         else:
             self.controls = [sender_display_control, bubble_container, ft.Container(expand=True, content=None)]
         
-        self.spacing = 10
\ No newline at end of file
+        self.spacing = 10
+
+    def set_message_key(self, timestamp: datetime, message_id: int):
+        """Associa a bolha à mensagem gravada; a chave é usada na paginação do histórico."""
+        self.message_key = (timestamp, message_id)
+        self.key = f"msg-{message_id}"
+
+    def highlight(self):
+        """Destaca a bolha (ex.: resultado de uma busca)."""
+        self.bubble_container.border = ft.border.all(2, ft.colors.AMBER_300)
+
+    @property
+    def message_text(self) -> str:
+        return self.message_content.value or ""
+
+    def append_text(self, chunk: str):
+        """Acrescenta um trecho à mensagem, atualizando a tela no máximo a cada STREAM_UPDATE_INTERVAL."""
+        self.message_content.value = self.message_text + chunk
+        if self.render_scheduler is not None:
+            self.render_scheduler.mark_dirty(self.message_content)
+            return
+        now = time.monotonic()
+        if now - self._last_stream_update >= self.STREAM_UPDATE_INTERVAL:
+            self._last_stream_update = now
+            self.message_content.update()
+
+    def finish_streaming(self):
+        """Garante que o texto final seja exibido, mesmo que o último trecho tenha caído no intervalo de espera."""
+        if self.render_scheduler is not None:
+            self.render_scheduler.update_now(self.message_content)
+        else:
+            self.message_content.update()
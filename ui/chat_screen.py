@@ -1,27 +1,68 @@
 import flet as ft
-from core.chat_logic import DKChatLogic
-from core.db_manager import get_db, save_message, get_messages_for_session, clear_chat_history_for_session
+import threading
+from core.chat_logic import get_chat_logic
+from core.turn_pipeline import Turn, TurnCancelled, get_turn_pipeline
+from core.conversation import get_conversation_state
+from core.db_manager import get_db, clear_chat_history_for_session, get_messages_page, search_messages
+from core.tracing import stage
+from core.write_behind import persist_message
 from ui.chat_bubble import ChatBubble
+from ui.render_scheduler import RenderScheduler
 from datetime import datetime
 
 class ChatScreen(ft.View):
+    # O histórico é exibido em janela: carregamos páginas sob demanda ao rolar e
+    # descartamos as bolhas mais distantes quando passam do limite de controles na tela
+    HISTORY_PAGE_SIZE = 30
+    MAX_RESIDENT_BUBBLES = 120
+    SCROLL_EDGE_THRESHOLD = 80 # Distância (px) da borda da lista que dispara o carregamento de outra página
+    SEARCH_RESULTS_LIMIT = 20
+
     def __init__(self, page: ft.Page, session_id: int):
         super().__init__(route="/chat")
         self.page = page
         self.session_id = session_id
-        self.chat_logic = DKChatLogic()
+        self.chat_logic = get_chat_logic()
+        get_conversation_state(session_id)  # Carrega o estado da conversa já na abertura da tela
+        self.turn_pipeline = get_turn_pipeline()
+        self.current_turn: Turn | None = None
+        # As alterações da tela passam pelo agendador, que agrupa os page.update()
+        self.render = RenderScheduler(page)
+        self._window_lock = threading.RLock()
+        self._page_loading = threading.Lock()
+        self._has_older = False # Há mensagens mais antigas no banco que não estão na tela
+        self._has_newer = False # Há mensagens mais recentes no banco que foram descartadas da tela
+
+        self.search_field = ft.TextField(
+            hint_text="Buscar no histórico...",
+            width=220,
+            dense=True,
+            filled=True,
+            border_radius=20,
+            prefix_icon=ft.icons.SEARCH,
+            text_size=13,
+            content_padding=ft.padding.symmetric(horizontal=12, vertical=8),
+            on_submit=self._search_submit,
+        )
 
         self.appbar = ft.AppBar(
             title=ft.Text("DK Chat", weight=ft.FontWeight.BOLD),
             center_title=True,
             bgcolor=ft.colors.with_opacity(0.05, ft.colors.WHITE10),
             actions=[
+                self.search_field,
                 ft.IconButton(
                     ft.icons.DELETE_SWEEP_OUTLINED,
                     tooltip="Limpar Chat Atual",
                     on_click=self._confirm_clear_chat,
                     icon_color=ft.colors.RED_ACCENT_200
                 ),
+                ft.IconButton(
+                    ft.icons.HISTORY,
+                    tooltip="Conversas Anteriores",
+                    on_click=lambda _: self.page.go("/sessions"),
+                    icon_color=ft.colors.BLUE_GREY_200
+                ),
                 ft.IconButton(
                     ft.icons.HOME_OUTLINED,
                     tooltip="Voltar para Início",
@@ -36,6 +77,8 @@ class ChatScreen(ft.View):
             spacing=12,
             auto_scroll=True,
             padding=ft.padding.symmetric(horizontal=20, vertical=15),
+            on_scroll=self._on_chat_scroll,
+            on_scroll_interval=100,
         )
 
         self.new_message_field = ft.TextField(
@@ -89,15 +132,17 @@ class ChatScreen(ft.View):
 
     def _show_status(self, is_thinking: bool):
         self.status_indicator.visible = is_thinking
-        self.new_message_field.disabled = is_thinking
-        self.send_button.disabled = is_thinking
-        self.page.update()
+        self.render.mark_dirty(self.status_indicator)
 
-    def _add_message_to_view(self, message_text: str, sender: str, timestamp_dt: datetime = None):
-        if timestamp_dt is None:
-            timestamp_dt = datetime.now()
-        timestamp_str = timestamp_dt.strftime("%d/%m/%Y %H:%M") 
-        
+    def _set_turn_in_flight(self, in_flight: bool):
+        # Durante um turno, o botão de enviar vira um botão de cancelar
+        self.new_message_field.disabled = in_flight
+        self.send_button.icon = ft.icons.STOP_CIRCLE_OUTLINED if in_flight else ft.icons.SEND_ROUNDED
+        self.send_button.tooltip = "Cancelar Resposta" if in_flight else "Enviar Mensagem"
+        self.status_indicator.visible = in_flight
+        self.render.mark_dirty()
+
+    def _bubble_width(self) -> int:
         current_page_width = self.page.width if self.page and self.page.width else 700 
         
         calculated_bubble_width = int(current_page_width * 0.70) 
@@ -115,94 +160,287 @@ class ChatScreen(ft.View):
         if current_page_width < 400 and actual_bubble_width < current_page_width * 0.85:
             test_width = int(current_page_width * 0.85)
             actual_bubble_width = min(test_width, max_bubble_width)
+        return actual_bubble_width
 
-        bubble = ChatBubble(
+    def _new_bubble(self, message_text: str, sender: str, timestamp_dt: datetime = None, width: int = None) -> ChatBubble:
+        if timestamp_dt is None:
+            timestamp_dt = datetime.now()
+        timestamp_str = timestamp_dt.strftime("%d/%m/%Y %H:%M") 
+        return ChatBubble(
             message_text, 
             sender, 
             timestamp_str, 
-            bubble_max_width=actual_bubble_width 
+            bubble_max_width=width or self._bubble_width(),
+            render_scheduler=self.render,
         )
-        self.chat_list.controls.append(bubble)
-        self.page.update() 
+
+    def _bubble_from_row(self, row, width: int) -> ChatBubble:
+        bubble = self._new_bubble(row.text, row.sender, row.timestamp, width)
+        bubble.set_message_key(row.timestamp, row.id)
+        return bubble
+
+    def _add_message_to_view(self, message_text: str, sender: str, timestamp_dt: datetime = None):
+        """Acrescenta uma mensagem nova ao fim da conversa; quem chama decide quando enviar (`render.flush()`)."""
+        with self._window_lock:
+            if self._has_newer:
+                # O usuário estava lendo páginas antigas: volta para a janela mais recente
+                self._load_chat_history(update=False)
+            bubble = self._new_bubble(message_text, sender, timestamp_dt)
+            self.chat_list.controls.append(bubble)
+            if self._evict_overflow(from_top=True):
+                self._has_older = True
+            self.chat_list.auto_scroll = True
+        self.render.mark_dirty()
+        return bubble
+
+    def _evict_overflow(self, from_top: bool) -> bool:
+        """
+        Remove as bolhas excedentes da ponta oposta à que está sendo lida.
+        Só bolhas já gravadas (com chave) são descartadas, pois precisam poder ser recarregadas.
+        """
+        controls = self.chat_list.controls
+        excess = len(controls) - self.MAX_RESIDENT_BUBBLES
+        evicted = 0
+        while evicted < excess:
+            index = evicted if from_top else len(controls) - 1 - evicted
+            if getattr(controls[index], "message_key", None) is None:
+                break
+            evicted += 1
+        if evicted:
+            if from_top:
+                del controls[:evicted]
+            else:
+                del controls[-evicted:]
+        return evicted > 0
+
+    def _on_chat_scroll(self, e: ft.OnScrollEvent):
+        near_top = e.pixels <= e.min_scroll_extent + self.SCROLL_EDGE_THRESHOLD
+        near_bottom = e.pixels >= e.max_scroll_extent - self.SCROLL_EDGE_THRESHOLD
+        if near_top and self._has_older:
+            self._load_page(older=True)
+        elif near_bottom and self._has_newer:
+            self._load_page(older=False)
+        elif self.chat_list.auto_scroll != (near_bottom and not self._has_newer):
+            # Só acompanha as mensagens novas enquanto o usuário está no fim da conversa
+            self.chat_list.auto_scroll = near_bottom and not self._has_newer
+            self.render.mark_dirty(self.chat_list)
+
+    def _load_page(self, older: bool):
+        if not self._page_loading.acquire(blocking=False):
+            return # Uma página já está sendo carregada
+        try:
+            with self._window_lock:
+                controls = self.chat_list.controls
+                if not controls:
+                    return
+                anchor = controls[0] if older else controls[-1]
+                if anchor.message_key is None:
+                    return
+                with get_db() as db:
+                    if older:
+                        rows = get_messages_page(db, self.session_id, before=anchor.message_key, limit=self.HISTORY_PAGE_SIZE)
+                    else:
+                        rows = get_messages_page(db, self.session_id, after=anchor.message_key, limit=self.HISTORY_PAGE_SIZE)
+                width = self._bubble_width()
+                bubbles = [self._bubble_from_row(row, width) for row in rows]
+                if older:
+                    self._has_older = len(rows) == self.HISTORY_PAGE_SIZE
+                    controls[0:0] = bubbles
+                    if self._evict_overflow(from_top=False):
+                        self._has_newer = True
+                    self.chat_list.auto_scroll = False
+                else:
+                    self._has_newer = len(rows) == self.HISTORY_PAGE_SIZE
+                    controls.extend(bubbles)
+                    if self._evict_overflow(from_top=True):
+                        self._has_older = True
+            self.render.update_now()
+            if older and bubbles:
+                # Mantém na tela a mensagem que o usuário estava lendo
+                self.chat_list.scroll_to(key=anchor.key, duration=0)
+        finally:
+            self._page_loading.release()
 
     def _send_message_click(self, e):
+        if self.current_turn is not None:
+            self.current_turn.cancel()
+            return
+
         user_message = self.new_message_field.value.strip()
         if not user_message:
             return
 
-        self._add_message_to_view(user_message, "user")
-        
-        with get_db() as db:
-            save_message(db, self.session_id, "user", user_message)
-        
+        self.render.begin_turn()
+        user_bubble = self._add_message_to_view(user_message, "user")
         self.new_message_field.value = "" 
-        self.page.update() 
+        self._set_turn_in_flight(True)
+        self.render.flush() # A mensagem do usuário aparece na hora, junto com o indicador
 
-        self._show_status(True) 
+        # O turno (DB + chamadas às APIs) roda no pipeline; o handler do Flet retorna imediatamente
+        self.current_turn = self.turn_pipeline.submit(
+            self.session_id, user_message, lambda turn: self._run_turn(turn, user_bubble)
+        )
+        self.current_turn.add_done_callback(self._on_turn_done)
 
-        current_conversation_history = []
-        with get_db() as db:
-            messages_from_db = get_messages_for_session(db, self.session_id)
-            for msg in messages_from_db:
-                current_conversation_history.append({"sender": msg.sender, "text": msg.text})
-        
+    def _run_turn(self, turn: Turn, user_bubble: ChatBubble) -> str:
+        """Executado em um worker do pipeline."""
+        # A gravação também acrescenta a mensagem ao estado em memória da conversa;
+        # esperamos por ela para que o histórico do turno já inclua a mensagem do usuário.
+        with stage("save_user_message"):
+            saved = persist_message(self.session_id, "user", turn.user_message).result()
+        user_bubble.set_message_key(saved.timestamp, saved.id)
+
+        # A resposta chega em trechos; a bolha do bot só é criada no primeiro trecho,
+        # para que o indicador "pensando" fique visível até lá.
+        bot_bubble = None
+        stream = None
         try:
-            bot_response = self.chat_logic.get_response(user_message, current_conversation_history)
+            turn.raise_if_cancelled()
+            # Buscado a cada turno (e não guardado na tela): o estado pode ter saído do cache de conversas
+            conversation = get_conversation_state(self.session_id)
+            stream = self.chat_logic.get_response(turn.user_message, stream=True, conversation=conversation)
+            for chunk in stream:
+                turn.raise_if_cancelled()
+                if bot_bubble is None:
+                    self._show_status(False)
+                    bot_bubble = self._add_message_to_view(chunk, "dk_chat")
+                    self.render.flush() # O primeiro trecho define a latência percebida
+                else:
+                    bot_bubble.append_text(chunk)
+        except TurnCancelled:
+            if bot_bubble is None:
+                bot_bubble = self._add_message_to_view("(Resposta cancelada.)", "dk_chat")
+            else:
+                bot_bubble.append_text("\n\n(Resposta cancelada.)")
         except Exception as ex:
             print(f"Erro crítico ao obter resposta do bot: {ex}")
-            bot_response = f"Ocorreu um erro crítico ao processar sua solicitação: {ex}"
+            error_text = f"Ocorreu um erro crítico ao processar sua solicitação: {ex}"
+            if bot_bubble is None:
+                bot_bubble = self._add_message_to_view(error_text, "dk_chat")
+            else:
+                bot_bubble.append_text(f"\n\n{error_text}")
         finally:
-            self._show_status(False) 
-            self.new_message_field.focus() 
+            if stream is not None:
+                stream.close() # Interrompe a requisição em andamento se o turno foi cancelado
+
+        if bot_bubble is None: # O stream terminou sem nenhum trecho
+            bot_bubble = self._add_message_to_view("Recebi uma resposta vazia.", "dk_chat")
+        bot_bubble.finish_streaming()
 
-        self._add_message_to_view(bot_response, "dk_chat")
+        # O texto final é persistido uma única vez, quando o stream termina
+        # (no modo "batched", sem esperar pelo commit)
+        persist_message(self.session_id, "dk_chat", bot_bubble.message_text).add_done_callback(
+            lambda future: self._on_bot_message_saved(bot_bubble, future)
+        )
+        return bot_bubble.message_text
+
+    def _on_bot_message_saved(self, bubble: ChatBubble, future):
+        if future.exception() is None:
+            saved = future.result()
+            bubble.set_message_key(saved.timestamp, saved.id)
+
+    def _on_turn_done(self, turn: Turn):
+        if turn.future.exception() is not None:
+            print(f"Erro crítico no turno da sessão {turn.session_id}: {turn.future.exception()}")
+        self.current_turn = None
+        self._set_turn_in_flight(False)
+        self.render.end_turn(f"Turno da sessão {turn.session_id}")
+        self.new_message_field.focus()
+
+    def _search_submit(self, e):
+        query = self.search_field.value.strip()
+        if not query:
+            return
         with get_db() as db:
-            save_message(db, self.session_id, "dk_chat", bot_response)
-        
-        self.page.update() 
+            results = search_messages(db, query, session_id=self.session_id, limit=self.SEARCH_RESULTS_LIMIT)
 
-    def _load_chat_history(self):
-        self.chat_list.controls.clear() 
+        def close_dialog(e_dialog=None):
+            results_dialog.open = False
+            self.render.update_now()
+
+        def jump(result):
+            close_dialog()
+            self._jump_to_message(result.timestamp, result.id)
+
+        if results:
+            content = ft.ListView(
+                [
+                    ft.ListTile(
+                        title=ft.Text(result.snippet, size=13),
+                        subtitle=ft.Text(
+                            f"{result.sender.capitalize()} · {result.timestamp.strftime('%d/%m/%Y %H:%M')}",
+                            size=11, color=ft.colors.WHITE54,
+                        ),
+                        on_click=lambda _, result=result: jump(result),
+                    )
+                    for result in results
+                ],
+                width=480,
+                height=360,
+            )
+        else:
+            content = ft.Text("Nenhuma mensagem encontrada.")
+
+        results_dialog = ft.AlertDialog(
+            title=ft.Text(f'Resultados para "{query}"'),
+            content=content,
+            actions=[ft.TextButton("Fechar", on_click=close_dialog)],
+            actions_alignment=ft.MainAxisAlignment.END,
+            shape=ft.RoundedRectangleBorder(radius=10),
+        )
+        self.page.dialog = results_dialog
+        results_dialog.open = True
+        self.render.update_now()
+
+    def _jump_to_message(self, timestamp: datetime, message_id: int):
+        """Troca a janela do histórico pela vizinhança da mensagem e rola até ela."""
+        half_page = self.HISTORY_PAGE_SIZE // 2
         with get_db() as db:
-            messages = get_messages_for_session(db, self.session_id)
-            for msg in messages:
-                # Ao carregar o histórico, também precisamos calcular a largura da bolha
-                self._add_message_to_view(msg.text, msg.sender, msg.timestamp)
-        self.page.update()
+            older = get_messages_page(db, self.session_id, before=(timestamp, message_id), limit=half_page)
+            # (timestamp, id - 1) inclui a própria mensagem: os ids são inteiros e únicos
+            newer = get_messages_page(db, self.session_id, after=(timestamp, message_id - 1), limit=self.HISTORY_PAGE_SIZE)
+        width = self._bubble_width()
+        with self._window_lock:
+            self.chat_list.controls = [self._bubble_from_row(row, width) for row in older + newer]
+            self._has_older = len(older) == half_page
+            self._has_newer = len(newer) == self.HISTORY_PAGE_SIZE
+            self.chat_list.auto_scroll = False
+            target = next((b for b in self.chat_list.controls if b.message_key == (timestamp, message_id)), None)
+            if target is not None:
+                target.highlight()
+        self.render.update_now()
+        if target is not None:
+            self.chat_list.scroll_to(key=target.key, duration=300)
+
+    def _load_chat_history(self, update: bool = True):
+        """Exibe só a página mais recente do histórico; as anteriores vêm ao rolar para o topo."""
+        with get_db() as db:
+            rows = get_messages_page(db, self.session_id, limit=self.HISTORY_PAGE_SIZE)
+        width = self._bubble_width()
+        with self._window_lock:
+            self.chat_list.controls = [self._bubble_from_row(row, width) for row in rows]
+            self._has_older = len(rows) == self.HISTORY_PAGE_SIZE
+            self._has_newer = False
+            self.chat_list.auto_scroll = True
+        if update:
+            self.render.update_now() # Uma única atualização para a página inteira
 
     def _confirm_clear_chat(self, e):
         def close_dialog(e_dialog):
             confirm_dialog.open = False
-            self.page.update()
+            self.render.update_now()
 
         def handle_confirm_clear(e_dialog):
             with get_db() as db:
                 clear_chat_history_for_session(db, self.session_id)
             
-            self.chat_list.controls.clear()
-            # Adiciona uma mensagem informativa que não será salva no histórico do DB
-            # Precisamos calcular a largura da bolha para esta mensagem também
-            current_page_width = self.page.width if self.page and self.page.width else 700
-            calculated_bubble_width = int(current_page_width * 0.70)
-            min_bubble_width = 150
-            max_bubble_width = 550
-            if calculated_bubble_width < min_bubble_width: actual_bubble_width = min_bubble_width
-            elif calculated_bubble_width > max_bubble_width: actual_bubble_width = max_bubble_width
-            else: actual_bubble_width = calculated_bubble_width
-            if current_page_width < 400 and actual_bubble_width < current_page_width * 0.85:
-                test_width = int(current_page_width * 0.85)
-                actual_bubble_width = min(test_width, max_bubble_width)
-
-            info_bubble = ChatBubble(
-                "Histórico de chat limpo.", 
-                "dk_chat", 
-                datetime.now().strftime("%d/%m/%Y %H:%M"),
-                bubble_max_width=actual_bubble_width
-            )
-            self.chat_list.controls.append(info_bubble)
+            with self._window_lock:
+                self.chat_list.controls.clear()
+                self._has_older = self._has_newer = False
+                # Adiciona uma mensagem informativa que não será salva no histórico do DB
+                self.chat_list.controls.append(self._new_bubble("Histórico de chat limpo.", "dk_chat"))
             
             close_dialog(e_dialog)
-            self.page.update()
 
         confirm_dialog = ft.AlertDialog(
             modal=True,
@@ -217,4 +455,4 @@ class ChatScreen(ft.View):
         )
         self.page.dialog = confirm_dialog
         confirm_dialog.open = True
-        self.page.update()
\ No newline at end of file
+        self.render.update_now()
\ No newline at end of file
@@ -0,0 +1,94 @@
+import flet as ft
+import threading
+import time
+
+class RenderScheduler:
+    """
+    Agrupa as atualizações da página: as alterações só marcam a tela (ou controles
+    específicos) como "suja" e um único `page.update()` é enviado por intervalo de quadro.
+    Mudanças sensíveis à latência (mensagem do usuário, primeiro trecho da resposta)
+    chamam `flush()` para enviar na hora tudo o que estiver pendente.
+    """
+    # Intervalo de quadro (em segundos) usado para agrupar as atualizações
+    FRAME_INTERVAL = 0.05
+
+    def __init__(self, page: ft.Page, frame_interval: float = None):
+        self.page = page
+        self.frame_interval = frame_interval if frame_interval is not None else self.FRAME_INTERVAL
+        self._lock = threading.Lock()
+        self._page_dirty = False
+        self._dirty_controls: dict[int, ft.Control] = {}
+        self._timer: threading.Timer | None = None
+
+        # Contadores (acumulados e do turno atual) para medir o efeito do agrupamento
+        self.updates = 0
+        self.payload_bytes = 0
+        self._turn_start: tuple[int, int, float] | None = None
+
+    def mark_dirty(self, *controls: ft.Control):
+        """Agenda uma atualização: da página inteira, ou só dos controles informados."""
+        with self._lock:
+            if controls:
+                for control in controls:
+                    self._dirty_controls[id(control)] = control
+            else:
+                self._page_dirty = True
+            if self._timer is None:
+                self._timer = threading.Timer(self.frame_interval, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def flush(self):
+        """Envia agora as atualizações pendentes (se houver) em um único `page.update()`."""
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            page_dirty, controls = self._page_dirty, list(self._dirty_controls.values())
+            self._page_dirty = False
+            self._dirty_controls.clear()
+        if not page_dirty and not controls:
+            return
+        # Uma atualização da página inteira já inclui os controles sujos
+        if page_dirty:
+            self.page.update()
+        else:
+            self.page.update(*controls)
+        payload_bytes = self._payload_size(controls)
+        with self._lock:
+            self.updates += 1
+            self.payload_bytes += payload_bytes
+
+    def update_now(self, *controls: ft.Control):
+        """Atalho para mudanças que devem aparecer imediatamente."""
+        self.mark_dirty(*controls)
+        self.flush()
+
+    def begin_turn(self):
+        with self._lock:
+            self._turn_start = (self.updates, self.payload_bytes, time.perf_counter())
+
+    def end_turn(self, label: str = "Turno"):
+        """Envia o que estiver pendente e registra quantas atualizações o turno custou."""
+        self.flush()
+        with self._lock:
+            if self._turn_start is None:
+                return
+            updates, payload_bytes, started = self._turn_start
+            self._turn_start = None
+            updates = self.updates - updates
+            payload_bytes = self.payload_bytes - payload_bytes
+        print(f"DK Chat: {label}: {updates} atualizações da tela (~{payload_bytes:,} bytes de texto) em {time.perf_counter() - started:.2f}s.")
+
+    @staticmethod
+    def _payload_size(controls: list[ft.Control]) -> int:
+        """
+        Estimativa do tamanho de uma atualização: o texto (`value`) dos controles enviados, que
+        domina o tráfego durante o streaming de uma resposta (a bolha é reenviada a cada quadro).
+        """
+        size = 0
+        for control in controls:
+            value = getattr(control, "value", None)
+            if isinstance(value, str):
+                size += len(value.encode("utf-8"))
+        return size
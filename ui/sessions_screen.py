@@ -0,0 +1,99 @@
+import flet as ft
+import threading
+from datetime import datetime
+from core.db_manager import get_db, get_sessions_page
+from ui.render_scheduler import RenderScheduler
+
+class SessionsScreen(ft.View):
+    # A lista é paginada: abre só com a primeira página e carrega as seguintes ao rolar
+    SESSIONS_PAGE_SIZE = 30
+    SCROLL_EDGE_THRESHOLD = 120
+
+    def __init__(self, page: ft.Page, open_session_callback, new_session_callback):
+        super().__init__(route="/sessions")
+        self.page = page
+        self.open_session_callback = open_session_callback
+        self.new_session_callback = new_session_callback
+        self.render = RenderScheduler(page)
+        self._page_loading = threading.Lock()
+        self._last_key: tuple[datetime, int] | None = None # (last_activity, id) da última conversa exibida
+        self._has_more = False
+
+        self.appbar = ft.AppBar(
+            title=ft.Text("Conversas", weight=ft.FontWeight.BOLD),
+            center_title=True,
+            bgcolor=ft.colors.with_opacity(0.05, ft.colors.WHITE10),
+            actions=[
+                ft.IconButton(
+                    ft.icons.ADD_COMMENT_OUTLINED,
+                    tooltip="Nova Conversa",
+                    on_click=lambda _: self.new_session_callback(),
+                    icon_color=ft.colors.BLUE_ACCENT_200
+                ),
+                ft.IconButton(
+                    ft.icons.HOME_OUTLINED,
+                    tooltip="Voltar para Início",
+                    on_click=lambda _: self.page.go("/"),
+                    icon_color=ft.colors.BLUE_GREY_200
+                ),
+            ]
+        )
+
+        self.sessions_list = ft.ListView(
+            expand=True,
+            spacing=4,
+            padding=ft.padding.symmetric(horizontal=20, vertical=10),
+            on_scroll=self._on_list_scroll,
+            on_scroll_interval=100,
+        )
+        self.empty_text = ft.Text("Nenhuma conversa ainda.", color=ft.colors.WHITE60, visible=False)
+
+        self.controls = [self.appbar, self.empty_text, self.sessions_list]
+
+    def refresh(self):
+        """Recarrega a primeira página (as estatísticas mudam a cada mensagem)."""
+        with self._page_loading:
+            self.sessions_list.controls.clear()
+            self._last_key = None
+            self._append_page()
+            self.empty_text.visible = not self.sessions_list.controls
+        self.render.update_now()
+
+    def _append_page(self):
+        with get_db() as db:
+            rows = get_sessions_page(db, before=self._last_key, limit=self.SESSIONS_PAGE_SIZE)
+        self.sessions_list.controls.extend(self._session_tile(row) for row in rows)
+        self._has_more = len(rows) == self.SESSIONS_PAGE_SIZE
+        if rows:
+            self._last_key = (rows[-1].last_activity, rows[-1].id)
+
+    def _session_tile(self, row) -> ft.ListTile:
+        count = f"{row.message_count} mensagem" if row.message_count == 1 else f"{row.message_count} mensagens"
+        return ft.ListTile(
+            leading=ft.Icon(ft.icons.CHAT_BUBBLE_OUTLINE_ROUNDED, color=ft.colors.BLUE_ACCENT_200),
+            title=ft.Text(row.title or "Conversa sem título", weight=ft.FontWeight.BOLD, max_lines=1,
+                          overflow=ft.TextOverflow.ELLIPSIS),
+            subtitle=ft.Text(row.preview or "", size=12, color=ft.colors.WHITE60, max_lines=2,
+                             overflow=ft.TextOverflow.ELLIPSIS),
+            trailing=ft.Column(
+                [
+                    ft.Text(row.last_activity.strftime("%d/%m/%Y %H:%M"), size=11, color=ft.colors.WHITE54),
+                    ft.Text(count, size=11, color=ft.colors.WHITE54),
+                ],
+                alignment=ft.MainAxisAlignment.CENTER,
+                horizontal_alignment=ft.CrossAxisAlignment.END,
+                spacing=2,
+            ),
+            on_click=lambda _, session_id=row.id: self.open_session_callback(session_id),
+        )
+
+    def _on_list_scroll(self, e: ft.OnScrollEvent):
+        if not self._has_more or e.pixels < e.max_scroll_extent - self.SCROLL_EDGE_THRESHOLD:
+            return
+        if not self._page_loading.acquire(blocking=False):
+            return # Uma página já está sendo carregada
+        try:
+            self._append_page()
+        finally:
+            self._page_loading.release()
+        self.render.update_now(self.sessions_list)
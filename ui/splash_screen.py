@@ -1,10 +1,11 @@
 import flet as ft
 
 class SplashScreen(ft.View):
-    def __init__(self, page: ft.Page, start_chat_callback):
+    def __init__(self, page: ft.Page, start_chat_callback, show_sessions_callback=None):
         super().__init__(route="/")
         self.page = page
         self.start_chat_callback = start_chat_callback
+        self.show_sessions_callback = show_sessions_callback
 
         # Tenta carregar um logo, senão usa texto
         try:
@@ -41,6 +42,14 @@ class SplashScreen(ft.View):
                             bgcolor=ft.colors.BLUE_ACCENT_700,
                         )
                     ),
+                    ft.OutlinedButton(
+                        text="Conversas Anteriores",
+                        icon=ft.icons.HISTORY,
+                        on_click=lambda _: self.show_sessions_callback(),
+                        height=45,
+                        width=200,
+                        visible=show_sessions_callback is not None,
+                    ),
                 ],
                 alignment=ft.MainAxisAlignment.CENTER,
                 horizontal_alignment=ft.CrossAxisAlignment.CENTER,